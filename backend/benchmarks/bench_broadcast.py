@@ -0,0 +1,251 @@
+"""
+Broadcast Throughput Benchmark
+Drives the real send actors (send_template_messages_task, send_broadcast,
+schedule_woo_task) in-process against the mock Graph API and a local Postgres
+and Redis, and reports msgs/sec, p50/p99 send latency, DB flush time and peak RSS.
+
+Run from backend/ with the mock server up (see benchmarks/mock_graph.py):
+    uvicorn benchmarks.mock_graph:app --port 8900
+    python -m benchmarks.bench_broadcast --recipients 5000
+
+DATABASE_URL must point at a throwaway local database: the benchmark creates
+its own user, broadcasts and message logs there.
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+import statistics
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the broadcast send path against the mock Graph API")
+    parser.add_argument("--mock-url", default="http://127.0.0.1:8900", help="Mock Graph API base URL")
+    parser.add_argument("--recipients", type=int, default=2000, help="Recipients per scenario")
+    parser.add_argument("--rate", type=float, default=1000, help="Per-number send rate (msg/s) for the benchmark")
+    parser.add_argument(
+        "--scenario",
+        choices=["template", "scheduled", "woo", "all"],
+        default="all",
+        help="template = send_template_messages_task, scheduled = send_broadcast, woo = schedule_woo_task",
+    )
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# Settings read at import time by the backend modules
+os.environ.setdefault("ENVIRONMENT", "dev")
+os.environ["GRAPH_API_BASE_URL"] = args.mock_url
+os.environ["WHATSAPP_SEND_RATE"] = str(args.rate)
+
+import httpx  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from wati.database import database  # noqa: E402
+from wati.models import User, Broadcast, Integration  # noqa: E402
+from wati.services import tasks  # noqa: E402
+from wati.services.bulk_writer import BulkWriter  # noqa: E402
+from wati.services.graph_client import get_graph_client, graph_url  # noqa: E402
+
+BENCH_PHONE_ID = 100000000000001
+BENCH_TEMPLATE_DATA = json.dumps({"language": "en_US"})
+
+
+class Metrics:
+    """Send latencies (from httpx event hooks) and bulk write time for one scenario."""
+
+    def __init__(self):
+        self.latencies = []
+        self.flush_seconds = 0.0
+        self._started = {}
+
+    async def on_request(self, request):
+        self._started[id(request)] = time.perf_counter()
+
+    async def on_response(self, response):
+        started = self._started.pop(id(response.request), None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+metrics = Metrics()
+
+
+def instrument():
+    """Time every bulk flush and every Graph API request of the shared client."""
+    flush_table = BulkWriter._flush_table
+
+    async def timed_flush_table(self, table):
+        started = time.perf_counter()
+        try:
+            await flush_table(self, table)
+        finally:
+            metrics.flush_seconds += time.perf_counter() - started
+
+    BulkWriter._flush_table = timed_flush_table
+    get_graph_client().event_hooks = {"request": [metrics.on_request], "response": [metrics.on_response]}
+
+
+def run_actor(actor, *actor_args, **actor_kwargs):
+    """The actor's coroutine, bypassing the Dramatiq event loop thread wrapper."""
+    fn = getattr(actor.fn, "__wrapped__", actor.fn)
+    return fn(*actor_args, **actor_kwargs)
+
+
+async def get_bench_user(db):
+    result = await db.execute(select(User).filter(User.email == "bench@wotnot.local"))
+    user = result.scalars().first()
+    if not user:
+        user = User(
+            username="bench",
+            email="bench@wotnot.local",
+            password_hash="",
+            Phone_id=BENCH_PHONE_ID,
+            WABAID=BENCH_PHONE_ID,
+            PAccessToken="bench-token",
+        )
+        db.add(user)
+        await db.commit()
+        await db.refresh(user)
+    return user
+
+
+async def create_broadcast(db, user, name: str, total: int):
+    broadcast_list = Broadcast.BroadcastList(
+        user_id=user.id,
+        name=name,
+        template="bench_template",
+        contacts=[],
+        type="bench",
+        success=0,
+        failed=0,
+        status="processing...",
+    )
+    db.add(broadcast_list)
+    await db.commit()
+    await db.refresh(broadcast_list)
+
+    contacts = [{"name": f"Bench {i}", "phone": f"91980{i:07d}"} for i in range(total)]
+    await tasks.store_broadcast_recipients(db, broadcast_list.id, contacts)
+    await db.commit()
+    tasks.register_broadcast_chunks(broadcast_list.id, 1)
+    return broadcast_list.id
+
+
+async def scenario_template(db, user, total):
+    broadcast_id = await create_broadcast(db, user, "bench/template", total)
+    await run_actor(
+        tasks.send_template_messages_task,
+        broadcast_id=broadcast_id,
+        recipients=None,
+        template="bench_template",
+        template_data=BENCH_TEMPLATE_DATA,
+        image_id=None,
+        body_parameters="Name",
+        phone_id=user.Phone_id,
+        access_token=user.PAccessToken,
+        user_id=user.id,
+        chunk_index=0,
+        recipient_range=[0, total],
+    )
+    return total
+
+
+async def scenario_scheduled(db, user, total):
+    broadcast_id = await create_broadcast(db, user, "bench/scheduled", total)
+    headers = {"Authorization": f"Bearer {user.PAccessToken}", "Content-Type": "application/json"}
+    await run_actor(
+        tasks.send_broadcast,
+        "bench_template", BENCH_TEMPLATE_DATA, None, broadcast_id, graph_url(f"{user.Phone_id}/messages"),
+        headers, user.id, None, "Name", user.Phone_id, 0, [0, total],
+    )
+    return total
+
+
+async def scenario_woo(db, user, total):
+    integration = Integration.WooIntegration(
+        user_id=user.id,
+        rest_key="ck_bench",
+        rest_secret="cs_bench",
+        type="woo",
+        template="bench_template",
+        template_data=BENCH_TEMPLATE_DATA,
+        parameters=[{"key": "billing.first_name"}],
+        base_url=args.mock_url,
+    )
+    db.add(integration)
+    await db.commit()
+    await db.refresh(integration)
+    try:
+        await run_actor(tasks.schedule_woo_task, integration.id)
+    except Exception as e:
+        # schedule_woo_task raises when any send failed (e.g. with MOCK_ERROR_RATE set)
+        print(f"   schedule_woo_task reported: {str(e)[:120]}")
+    return total
+
+
+SCENARIOS = {
+    "template": ("send_template_messages_task", scenario_template),
+    "scheduled": ("send_broadcast", scenario_scheduled),
+    "woo": ("schedule_woo_task", scenario_woo),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[pct - 1]
+
+
+async def main():
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.create_all)
+
+    instrument()
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+
+    async with httpx.AsyncClient() as control:
+        await control.post(f"{args.mock_url}/_config", json={"woo_orders": args.recipients})
+        results = []
+        for name in names:
+            label, scenario = SCENARIOS[name]
+            metrics.latencies.clear()
+            metrics.flush_seconds = 0.0
+            await control.post(f"{args.mock_url}/_reset")
+
+            async for db in database.get_db():
+                user = await get_bench_user(db)
+                started = time.perf_counter()
+                total = await scenario(db, user, args.recipients)
+                elapsed = time.perf_counter() - started
+
+            mock_stats = (await control.get(f"{args.mock_url}/_stats")).json()
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            results.append({
+                "scenario": label,
+                "recipients": total,
+                "requests": mock_stats.get("requests", 0),
+                "seconds": round(elapsed, 2),
+                "msgs_per_sec": round(total / elapsed, 1) if elapsed else 0,
+                "p50_ms": round(percentile(metrics.latencies, 50) * 1000, 1),
+                "p99_ms": round(percentile(metrics.latencies, 99) * 1000, 1),
+                "db_flush_s": round(metrics.flush_seconds, 2),
+                "peak_rss_mb": round(peak_rss_mb, 1),
+            })
+            print(f"✅ {label}: {results[-1]}")
+
+    print("\nscenario                      msgs/s    p50 ms    p99 ms  flush s  peak RSS MB")
+    for row in results:
+        print(
+            f"{row['scenario']:<28}{row['msgs_per_sec']:>8}{row['p50_ms']:>10}{row['p99_ms']:>10}"
+            f"{row['db_flush_s']:>9}{row['peak_rss_mb']:>13}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Mock Graph API Server
+A local stand-in for graph.facebook.com (and a WooCommerce orders endpoint) for
+benchmarking the send path without hitting Meta.
+
+Run:
+    uvicorn benchmarks.mock_graph:app --port 8900
+
+and point the backend at it with GRAPH_API_BASE_URL=http://127.0.0.1:8900.
+
+Behaviour is set with environment variables (or POST /_config at runtime):
+    MOCK_LATENCY_MS        mean response latency (default 80)
+    MOCK_LATENCY_JITTER_MS +/- uniform jitter around the mean (default 40)
+    MOCK_ERROR_RATE        share of sends failing permanently, code 131026 (default 0)
+    MOCK_THROTTLE_RATE     share of sends answered 429 / code 130429 (default 0)
+    MOCK_SERVER_ERROR_RATE share of sends answered 500 / code 131000 (default 0)
+    MOCK_WOO_ORDERS        orders returned by /wp-json/wc/v3/orders (default 1000)
+"""
+import os
+import time
+import base64
+import random
+import asyncio
+from collections import Counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Mock Graph API")
+
+config = {
+    "latency_ms": float(os.getenv("MOCK_LATENCY_MS", "80")),
+    "latency_jitter_ms": float(os.getenv("MOCK_LATENCY_JITTER_MS", "40")),
+    "error_rate": float(os.getenv("MOCK_ERROR_RATE", "0")),
+    "throttle_rate": float(os.getenv("MOCK_THROTTLE_RATE", "0")),
+    "server_error_rate": float(os.getenv("MOCK_SERVER_ERROR_RATE", "0")),
+    "woo_orders": int(os.getenv("MOCK_WOO_ORDERS", "1000")),
+}
+
+stats = Counter()
+started_at = time.time()
+
+
+def _graph_error(status_code: int, code: int, message: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": "OAuthException", "code": code, "fbtrace_id": "mock"}},
+    )
+
+
+def _wamid() -> str:
+    return "wamid." + base64.b64encode(os.urandom(24)).decode().rstrip("=")
+
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def root():
+    return {"status": "ok"}
+
+
+@app.post("/{version}/{phone_id}/messages")
+async def send_message(version: str, phone_id: str, request: Request):
+    body = await request.json()
+
+    latency = config["latency_ms"] + random.uniform(-config["latency_jitter_ms"], config["latency_jitter_ms"])
+    await asyncio.sleep(max(0.0, latency) / 1000)
+
+    roll = random.random()
+    if roll < config["throttle_rate"]:
+        stats["throttled"] += 1
+        return _graph_error(429, 130429, "(#130429) Rate limit hit")
+    roll -= config["throttle_rate"]
+    if roll < config["server_error_rate"]:
+        stats["server_error"] += 1
+        return _graph_error(500, 131000, "Something went wrong")
+    roll -= config["server_error_rate"]
+    if roll < config["error_rate"]:
+        stats["failed"] += 1
+        return _graph_error(400, 131026, "Message undeliverable")
+
+    stats["sent"] += 1
+    to = str(body.get("to", ""))
+    return {
+        "messaging_product": "whatsapp",
+        "contacts": [{"input": to, "wa_id": "".join(c for c in to if c.isdigit())}],
+        "messages": [{"id": _wamid(), "message_status": "accepted"}],
+    }
+
+
+@app.get("/wp-json/wc/v3/orders")
+async def woo_orders():
+    """WooCommerce orders with the fields schedule_woo_task reads."""
+    orders = []
+    for i in range(config["woo_orders"]):
+        orders.append({
+            "id": i + 1,
+            "status": "completed",
+            "date_created": "2024-01-01T10:00:00",
+            "billing": {
+                "first_name": f"Customer{i}",
+                "email": f"customer{i}@example.com",
+                "phone": f"98{i:08d}",
+                "country": "IN",
+            },
+            "line_items": [{"product_id": 1, "price": 100}],
+        })
+    return orders
+
+
+@app.get("/_stats")
+async def get_stats():
+    elapsed = time.time() - started_at
+    total = sum(stats.values())
+    return {"requests": total, "per_second": round(total / elapsed, 1) if elapsed else 0, **stats}
+
+
+@app.post("/_reset")
+async def reset_stats():
+    global started_at
+    stats.clear()
+    started_at = time.time()
+    return {"status": "reset"}
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in config:
+            config[key] = type(config[key])(value)
+    return config
@@ -16,6 +16,9 @@ from wati.models import (
     User, 
     BroadcastList, 
     BroadcastAnalysis,
+    BroadcastCheckpoint,
+    BroadcastRecipient,
+    ScheduledBroadcast,
     Template,
     Contact, 
     Conversation, 
@@ -36,6 +39,8 @@ async def create_tables():
             print("Creating tables...")
             await conn.run_sync(database.Base.metadata.create_all)
             print("✓ All tables created successfully!")
+            await conn.run_sync(database.ensure_indexes)
+            print("✓ Indexes on existing tables are up to date!")
             
         # List created tables
         print("\nCreated tables:")
@@ -24,6 +24,12 @@ def start_dramatiq():
             sys.executable, "-m", "dramatiq", 
             "wati.services.dramatiq_router"
         ]
+
+        # Optional queue selection, e.g. DRAMATIQ_QUEUES=transactional for a worker
+        # reserved for order confirmations (default: all queues)
+        queues = [q.strip() for q in os.getenv("DRAMATIQ_QUEUES", "").split(",") if q.strip()]
+        if queues:
+            cmd += ["--queues", *queues]
         
         print(f"Running: {' '.join(cmd)}")
         print("Dramatiq worker is processing background tasks...")
@@ -0,0 +1,26 @@
+import fakeredis
+
+from wati.services.broadcast_progress import BroadcastProgress
+
+
+def test_a_batch_moves_from_in_flight_to_sent_and_failed():
+    progress = BroadcastProgress(fakeredis.FakeRedis())
+    progress.start(1, user_id=7, total=10)
+    progress.add_in_flight(1, 4)
+
+    progress.record(1, sent=3, failed=1)
+
+    snapshot = progress.snapshot(1)
+    assert (snapshot["sent"], snapshot["failed"], snapshot["in_flight"], snapshot["remaining"]) == (3, 1, 0, 6)
+
+
+def test_unsent_recipients_are_failed_without_touching_in_flight():
+    redis_client = fakeredis.FakeRedis()
+    progress = BroadcastProgress(redis_client)
+    progress.start(1, user_id=7, total=10)
+    progress.add_in_flight(1, 4)
+
+    progress.record(1, sent=0, failed=6, in_flight=False)
+
+    assert int(redis_client.hget("broadcast:1:progress", "in_flight")) == 4
+    assert progress.snapshot(1)["failed"] == 6
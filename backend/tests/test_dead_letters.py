@@ -0,0 +1,27 @@
+import fakeredis
+
+from wati.services.dead_letters import DeadLetterStore
+
+
+def entry(broadcast_id, phone):
+    return {"broadcast_id": broadcast_id, "recipient": {"phone": phone}, "payload": "{}"}
+
+
+def test_take_removes_entries_of_one_broadcast():
+    store = DeadLetterStore(fakeredis.FakeRedis())
+    store.add(1, [entry(10, "91"), entry(11, "92")])
+
+    assert [taken["recipient"]["phone"] for taken in store.take(1, 10)] == ["91"]
+    assert store.take(1, 10) == []
+    assert [left["broadcast_id"] for left in store.list(1)] == [11]
+
+
+def test_put_back_parks_taken_entries_unchanged():
+    store = DeadLetterStore(fakeredis.FakeRedis())
+    store.add(1, [entry(10, "91")])
+    taken = store.take(1)
+
+    store.put_back(1, taken)
+
+    assert store.list(1) == taken
+    assert store.take(1) == taken
@@ -0,0 +1,80 @@
+import json
+
+from wati.services.payload_plan import compile_payload_plan
+
+RECIPIENT = {"name": "Asha", "phone": "919800000001"}
+
+
+def test_render_matches_the_payload_built_per_recipient():
+    plan = compile_payload_plan("order_update", "en", image_id="media-1", parameter_keys=["Name"])
+
+    assert json.loads(plan.render(RECIPIENT)) == {
+        "messaging_product": "whatsapp",
+        "to": "919800000001",
+        "type": "template",
+        "template": {
+            "name": "order_update",
+            "language": {"code": "en"},
+            "components": [
+                {"type": "header", "parameters": [{"type": "image", "image": {"id": "media-1"}}]},
+                {"type": "body", "parameters": [{"type": "text", "text": "Asha"}]},
+            ],
+        },
+    }
+
+
+def test_render_returns_json_bytes():
+    plan = compile_payload_plan("hello", "en")
+    assert isinstance(plan.render(RECIPIENT), bytes)
+
+
+def test_no_parameter_keys_sends_no_components():
+    plan = compile_payload_plan("hello", "en")
+    assert "components" not in json.loads(plan.render(RECIPIENT))["template"]
+
+
+def test_empty_parameter_keys_sends_an_empty_body():
+    plan = compile_payload_plan("hello", "en", parameter_keys=[])
+    assert json.loads(plan.render(RECIPIENT))["template"]["components"] == [{"type": "body", "parameters": []}]
+
+
+def test_unknown_parameter_keys_render_empty():
+    plan = compile_payload_plan("hello", "en", parameter_keys=["billing.first_name", "order.total"])
+    parameters = json.loads(plan.render(RECIPIENT))["template"]["components"][0]["parameters"]
+    assert [parameter["text"] for parameter in parameters] == ["Asha", ""]
+
+
+def test_none_values_render_empty():
+    plan = compile_payload_plan("hello", "en", parameter_keys=["Name"])
+    parameters = json.loads(plan.render({"name": None, "phone": "1"}))["template"]["components"][0]["parameters"]
+    assert parameters[0]["text"] == ""
+
+
+def test_recipient_values_are_json_escaped():
+    plan = compile_payload_plan("hello", "en", parameter_keys=["Name"])
+    name = 'Dr. "Q" \\ O\'Neil\n</script>'
+
+    payload = json.loads(plan.render({"name": name, "phone": "1"}))
+    assert payload["template"]["components"][0]["parameters"][0]["text"] == name
+
+
+def test_non_ascii_values_are_sent_as_utf8():
+    plan = compile_payload_plan("hello", "hi", parameter_keys=["Name"])
+    body = plan.render({"name": "अनन्या 😊", "phone": "1"})
+
+    assert "अनन्या 😊".encode("utf-8") in body
+    assert json.loads(body)["template"]["components"][0]["parameters"][0]["text"] == "अनन्या 😊"
+
+
+def test_template_fields_are_escaped_once_at_compile_time():
+    plan = compile_payload_plan('promo "spring"', "en_US")
+    assert json.loads(plan.render(RECIPIENT))["template"]["name"] == 'promo "spring"'
+
+
+def test_plan_is_reusable_across_recipients():
+    plan = compile_payload_plan("hello", "en", parameter_keys=["Name"])
+    first = json.loads(plan.render({"name": "A", "phone": "1"}))
+    second = json.loads(plan.render({"name": "B", "phone": "2"}))
+
+    assert (first["to"], second["to"]) == ("1", "2")
+    assert first["template"]["components"][0]["parameters"][0]["text"] == "A"
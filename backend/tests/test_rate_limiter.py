@@ -0,0 +1,76 @@
+import fakeredis
+import pytest
+
+from wati.services import rate_limiter
+from wati.services.rate_limiter import PhoneRateLimiter
+from wati.services.sender import MIN_SEND_RATE
+
+PHONE_ID = "1001"
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "get_target_rate", lambda phone_id: 10.0)
+    return PhoneRateLimiter(fakeredis.FakeRedis())
+
+
+def test_reserve_within_burst_does_not_wait(limiter):
+    assert limiter.reserve(PHONE_ID, tokens=10) == 0
+
+
+def test_reserve_beyond_burst_waits_for_the_deficit(limiter):
+    limiter.reserve(PHONE_ID, tokens=10)
+    wait = limiter.reserve(PHONE_ID, tokens=5)
+    assert 0.4 < wait <= 0.5
+
+
+def test_throttling_halves_the_shared_rate_once_per_cooldown(limiter):
+    assert limiter.throttled(PHONE_ID) == (5.0, True)
+    # Other requests in flight report the same throttling event
+    assert limiter.throttled(PHONE_ID) == (5.0, False)
+
+
+def test_throttled_rate_applies_to_every_limiter_on_the_number(limiter):
+    other_process = PhoneRateLimiter(limiter.redis_client)
+    limiter.throttled(PHONE_ID)
+
+    # The burst shrinks to 5 with the rate; reserving it raises the rate to 6 msg/s
+    assert other_process.reserve(PHONE_ID, tokens=5) == 0
+    # (waits are rounded up to the millisecond)
+    assert 0.8 < other_process.reserve(PHONE_ID, tokens=5) <= 0.834
+
+
+def test_throttling_never_goes_below_the_minimum_rate(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "THROTTLE_COOLDOWN_SECONDS", 0)
+    for _ in range(10):
+        rate, _ = limiter.throttled(PHONE_ID)
+    assert rate == min(10.0, MIN_SEND_RATE)
+
+
+def test_sends_raise_the_adapted_rate_back_to_the_target(limiter):
+    limiter.throttled(PHONE_ID)
+    rate_key = limiter._rate_key(PHONE_ID)
+
+    limiter.reserve(PHONE_ID, tokens=5)
+    assert float(limiter.redis_client.hget(rate_key, "rate")) == pytest.approx(6.0)
+
+    for _ in range(10):
+        limiter.reserve(PHONE_ID, tokens=10)
+    assert limiter.redis_client.hget(rate_key, "rate") is None
+
+
+def test_bulk_bucket_refills_at_its_share_and_does_not_raise_the_rate(limiter, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "BULK_RATE_SHARE", 0.5)
+    limiter.throttled(PHONE_ID)
+
+    assert limiter.reserve(PHONE_ID, tokens=2, bulk_bucket=True) == 0
+    # 2.5 msg/s (half of the throttled 5 msg/s), with a burst of 2.5
+    assert 0.5 < limiter.reserve(PHONE_ID, tokens=2, bulk_bucket=True) <= 0.6
+    assert float(limiter.redis_client.hget(limiter._rate_key(PHONE_ID), "rate")) == 5.0
+
+
+def test_reserve_fails_open_without_redis(limiter, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("redis down")
+    monkeypatch.setattr(limiter, "script", unavailable)
+    assert limiter.reserve(PHONE_ID) == 0
@@ -0,0 +1,137 @@
+import fakeredis
+from sqlalchemy.dialects import postgresql
+
+from wati.services import status_updates
+from wati.services.status_updates import apply_status_updates, merge_status_update, status_update_from_event
+
+
+def event(status, wamid="wamid.1", **extra):
+    return dict({"id": wamid, "status": status}, **extra)
+
+
+def merged(*statuses):
+    updates = {}
+    for status in statuses:
+        merge_status_update(updates, status_update_from_event(event(status)))
+    return updates
+
+
+def test_unknown_status_is_ignored():
+    assert status_update_from_event(event("deleted")) is None
+
+
+def test_failed_status_carries_the_error_reason():
+    update = status_update_from_event(event("failed", errors=[{
+        "code": 131026, "title": "Message undeliverable", "error_data": {"details": "Not on WhatsApp"},
+    }]))
+
+    assert update["rank"] == status_updates.STATUS_RANK["failed"]
+    assert update["error_reason"] == "Error Code: 131026, Title: Message undeliverable, Details: Not on WhatsApp"
+
+
+def test_merge_keeps_the_highest_rank_in_any_order():
+    assert merged("sent", "read", "delivered")["wamid.1"]["status"] == "read"
+    assert merged("read", "delivered", "sent")["wamid.1"]["status"] == "read"
+
+
+def test_merge_only_ever_sets_flags():
+    update = merged("delivered", "sent")["wamid.1"]
+
+    assert update["status"] == "delivered"
+    assert update["delivered"] and update["sent"]
+    assert not update["read"]
+
+
+def test_merge_keeps_the_error_reason_of_a_lower_ranked_later_event():
+    updates = {}
+    merge_status_update(updates, status_update_from_event(event("failed", errors=[{"code": 1}])))
+    merge_status_update(updates, status_update_from_event(event("sent")))
+
+    assert updates["wamid.1"]["status"] == "failed"
+    assert updates["wamid.1"]["error_reason"].startswith("Error Code: 1,")
+
+
+def test_merge_does_not_mutate_the_update_it_replaces():
+    first = status_update_from_event(event("read"))
+    updates = {"wamid.1": first}
+    merge_status_update(updates, status_update_from_event(event("sent")))
+
+    assert updates["wamid.1"] is not first
+    assert first["sent"] is True and first["status"] == "read"
+
+
+def test_merge_keeps_wamids_apart():
+    updates = {}
+    merge_status_update(updates, status_update_from_event(event("read", "wamid.1")))
+    merge_status_update(updates, status_update_from_event(event("sent", "wamid.2")))
+
+    assert {wamid: update["status"] for wamid, update in updates.items()} == {"wamid.1": "read", "wamid.2": "sent"}
+
+
+class RecordingSession:
+    """Records executed statements; every UPDATE matches the given wamids."""
+
+    def __init__(self, matched=()):
+        self.statements = []
+        self.matched = list(matched)
+        self.commits = 0
+
+    async def execute(self, statement):
+        self.statements.append(statement)
+        matched = self.matched
+
+        class Result:
+            def scalars(self):
+                return self
+
+            def all(self):
+                return matched
+
+        return Result()
+
+    async def commit(self):
+        self.commits += 1
+
+
+async def test_apply_compiles_to_one_update_from_values():
+    db = RecordingSession(matched=["wamid.1"])
+
+    found = await apply_status_updates(db, merged("sent", "read"))
+
+    assert found == {"wamid.1"}
+    assert db.commits == 1
+    assert len(db.statements) == 1
+    sql = " ".join(str(db.statements[0].compile(dialect=postgresql.dialect())).split())
+    assert sql.startswith('UPDATE "BroadcastAnalysis" SET status=CASE WHEN (incoming.rank > CASE')
+    assert "FROM (VALUES" in sql
+    assert 'AS incoming (message_id, status, rank, read, delivered, sent, error_reason)' in sql
+    assert 'WHERE "BroadcastAnalysis".message_id = incoming.message_id' in sql
+    assert 'RETURNING "BroadcastAnalysis".message_id' in sql
+    assert 'read=(coalesce("BroadcastAnalysis".read, false) OR incoming.read)' in sql
+    assert 'error_reason=coalesce(incoming.error_reason, "BroadcastAnalysis".error_reason)' in sql
+
+
+async def test_apply_batches_large_updates(monkeypatch):
+    monkeypatch.setattr(status_updates, "STATUS_UPDATE_BATCH_SIZE", 2)
+    updates = {}
+    for index in range(5):
+        merge_status_update(updates, status_update_from_event(event("delivered", f"wamid.{index}")))
+    db = RecordingSession()
+
+    await apply_status_updates(db, updates)
+
+    assert len(db.statements) == 3
+    assert db.commits == 1
+
+
+async def test_statuses_without_a_row_are_parked_until_the_sender_reconciles():
+    pending = status_updates.PendingStatusStore(fakeredis.FakeRedis())
+    await status_updates.apply_or_park_status_updates(RecordingSession(), merged("sent", "delivered"), pending)
+
+    assert pending.get(["wamid.1"])["wamid.1"]["status"] == "delivered"
+
+    db = RecordingSession(matched=["wamid.1"])
+    await status_updates.reconcile_pending_statuses(db, pending, iter(["wamid.1"]))
+
+    assert len(db.statements) == 1
+    assert pending.get(["wamid.1"]) == {}
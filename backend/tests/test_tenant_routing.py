@@ -0,0 +1,95 @@
+import asyncio
+
+import fakeredis
+
+from wati.services.tenant_routing import TenantRoute, TenantRoutingTable
+
+
+class UsersTable:
+    """Answers the table's queries from a list of routes, counting the queries."""
+
+    def __init__(self, routes=()):
+        self.routes = list(routes)
+        self.queries = 0
+
+    async def execute(self, statement):
+        self.queries += 1
+        rows = self.routes
+        criteria = statement.whereclause
+        if criteria is not None:
+            field, key = criteria.left.key, criteria.right.value
+            rows = [route for route in rows if getattr(route, field) == key]
+
+        class Result:
+            def all(self):
+                return rows
+
+            def first(self):
+                return rows[0] if rows else None
+
+        return Result()
+
+
+ROUTE = TenantRoute(id=7, Phone_id=1001, WABAID=2002, api_key="key-7", PAccessToken="token")
+
+
+async def test_lookups_are_served_from_the_loaded_table():
+    db = UsersTable([ROUTE])
+    table = TenantRoutingTable()
+
+    assert await table.by_phone_id(db, "1001") == ROUTE
+    assert await table.by_waba_id(db, 2002) == ROUTE
+    assert await table.by_api_key(db, "key-7") == ROUTE
+    assert db.queries == 1
+
+
+async def test_a_miss_is_cached():
+    db = UsersTable()
+    table = TenantRoutingTable()
+
+    assert await table.by_api_key(db, "unknown") is None
+    assert await table.by_api_key(db, "unknown") is None
+    assert db.queries == 2  # the load, then one query for the key
+
+
+async def test_cached_misses_are_bounded():
+    db = UsersTable()
+    table = TenantRoutingTable(max_misses=3)
+
+    for index in range(10):
+        await table.by_api_key(db, f"random-{index}")
+
+    assert len(table._misses) == 3
+    queries = db.queries
+    await table.by_api_key(db, "random-9")
+    assert db.queries == queries
+    await table.by_api_key(db, "random-0")
+    assert db.queries == queries + 1
+
+
+async def test_invalidate_forgets_a_users_routes():
+    db = UsersTable([ROUTE])
+    table = TenantRoutingTable()
+    await table.by_api_key(db, "key-7")
+
+    db.routes = [ROUTE._replace(api_key="key-7b")]
+    table.invalidate(ROUTE.id)
+
+    assert await table.by_api_key(db, "key-7") is None
+    assert (await table.by_api_key(db, "key-7b")).api_key == "key-7b"
+
+
+async def test_invalidations_reach_other_processes():
+    redis_client = fakeredis.FakeAsyncRedis()
+    db = UsersTable([ROUTE])
+    here, other_process = TenantRoutingTable(), TenantRoutingTable()
+    await other_process.by_api_key(db, "key-7")
+    listener = asyncio.create_task(other_process.listen_for_invalidations(redis_client))
+    await asyncio.sleep(0.1)
+
+    db.routes = [ROUTE._replace(api_key="key-7b")]
+    await here.invalidate_everywhere(redis_client, ROUTE.id)
+    await asyncio.sleep(0.1)
+    listener.cancel()
+
+    assert await other_process.by_api_key(db, "key-7") is None
@@ -0,0 +1,83 @@
+import fakeredis
+import pytest
+
+from wati.services.webhook_dedup import WebhookDeduplicator, is_status_key
+
+
+def webhook(*wamids, status="delivered"):
+    return {"entry": [{"changes": [{"value": {
+        "statuses": [{"id": wamid, "status": status} for wamid in wamids],
+    }}]}]}
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeAsyncRedis()
+
+
+async def test_first_delivery_is_kept_and_a_repeat_dropped(redis_client):
+    dedup = WebhookDeduplicator(redis_client)
+
+    assert await dedup.drop_duplicates(webhook("wamid.1")) == ["status:wamid.1:delivered"]
+
+    repeat = webhook("wamid.1", "wamid.2")
+    assert await dedup.drop_duplicates(repeat) == ["status:wamid.2:delivered"]
+    assert [status["id"] for status in repeat["entry"][0]["changes"][0]["value"]["statuses"]] == ["wamid.2"]
+
+
+async def test_a_change_left_without_events_loses_the_field(redis_client):
+    dedup = WebhookDeduplicator(redis_client)
+    await dedup.claim(["status:wamid.1:delivered"])
+
+    repeat = webhook("wamid.1")
+    assert await dedup.drop_duplicates(repeat) == []
+    assert "statuses" not in repeat["entry"][0]["changes"][0]["value"]
+
+
+async def test_claim_is_not_shared_until_confirmed(redis_client):
+    keys = ["status:wamid.1:read"]
+    first = WebhookDeduplicator(redis_client)
+    other_process = WebhookDeduplicator(redis_client)
+
+    assert await first.claim(keys) == [True]
+    # Still processing: a consumer dying now must not lose the event
+    assert await redis_client.exists("webhook:seen:status:wamid.1:read") == 0
+    assert await other_process.claim(keys) == [True]
+
+    await first.confirm(keys)
+
+    assert await redis_client.ttl("webhook:seen:status:wamid.1:read") > 0
+    assert await WebhookDeduplicator(redis_client).claim(keys) == [False]
+
+
+async def test_release_lets_the_redelivery_through(redis_client):
+    keys = ["message:wamid.9"]
+    dedup = WebhookDeduplicator(redis_client)
+    await dedup.claim(keys)
+
+    await dedup.release(keys)
+
+    assert await dedup.claim(keys) == [True]
+
+
+async def test_statuses_of_one_wamid_are_deduplicated_separately(redis_client):
+    dedup = WebhookDeduplicator(redis_client)
+    await dedup.confirm(["status:wamid.1:delivered"])
+
+    assert await dedup.claim(["status:wamid.1:delivered", "status:wamid.1:read"]) == [False, True]
+
+
+async def test_redis_errors_fail_open():
+    class Unavailable:
+        def pipeline(self, transaction=True):
+            raise ConnectionError("redis down")
+
+    dedup = WebhookDeduplicator(Unavailable())
+
+    assert await dedup.claim(["message:wamid.1"]) == [True]
+    await dedup.confirm(["message:wamid.1"])
+
+
+def test_status_keys_are_told_from_message_keys():
+    assert is_status_key("status:wamid.1:read")
+    assert not is_status_key("message:wamid.1")
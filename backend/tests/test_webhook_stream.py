@@ -0,0 +1,249 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+from wati.services import webhook_stream
+from wati.services.webhook_stream import (
+    WebhookStream, conversation_key, partition_of, split_by_conversation, split_value,
+)
+
+PHONE_NUMBER_ID = "1001"
+
+
+def value(**fields):
+    return dict({"metadata": {"phone_number_id": PHONE_NUMBER_ID}}, **fields)
+
+
+def status(wamid, wa_id):
+    return {"id": wamid, "status": "delivered", "recipient_id": wa_id}
+
+
+def message(message_id, wa_id):
+    return {"id": message_id, "from": wa_id, "type": "text", "text": {"body": "hi"}}
+
+
+def webhook(*values):
+    return {"object": "whatsapp_business_account", "entry": [
+        {"id": "waba", "changes": [{"field": "messages", "value": change_value} for change_value in values]}
+    ]}
+
+
+def test_partition_of_is_stable_and_in_range():
+    assert partition_of("1001:919800000001", 8) == partition_of("1001:919800000001", 8)
+    assert all(0 <= partition_of(f"1001:{wa_id}", 8) < 8 for wa_id in range(100))
+    # crc32, so every process agrees
+    assert partition_of("1001:919800000001", 8) == 5
+
+
+def test_partition_of_spreads_conversations():
+    used = {partition_of(f"1001:9198000{wa_id:05d}", 8) for wa_id in range(200)}
+    assert used == set(range(8))
+
+
+def test_conversation_key_of_each_kind_of_value():
+    assert conversation_key(value(messages=[message("m1", "91")])) == "1001:91"
+    assert conversation_key(value(statuses=[status("s1", "92")])) == "1001:92"
+    assert conversation_key(value(contacts=[{"wa_id": "93"}])) == "1001:93"
+    assert conversation_key({}) == ":"
+
+
+def test_split_value_keeps_a_single_conversation_whole():
+    single = value(statuses=[status("s1", "91"), status("s2", "91")])
+    assert split_value(single) == [single]
+
+
+def test_split_value_splits_per_conversation_in_order():
+    mixed = value(statuses=[status("s1", "91"), status("s2", "92"), status("s3", "91")])
+
+    parts = split_value(mixed)
+
+    assert [[item["id"] for item in part["statuses"]] for part in parts] == [["s1", "s3"], ["s2"]]
+    assert all(part["metadata"] == mixed["metadata"] for part in parts)
+
+
+def test_split_value_keeps_contacts_with_their_messages():
+    mixed = value(
+        contacts=[{"wa_id": "91", "profile": {"name": "Asha"}}, {"wa_id": "92", "profile": {"name": "Ravi"}}],
+        messages=[message("m1", "91"), message("m2", "92")],
+    )
+
+    parts = split_value(mixed)
+
+    assert [(part["messages"][0]["id"], part["contacts"][0]["profile"]["name"]) for part in parts] == [
+        ("m1", "Asha"), ("m2", "Ravi"),
+    ]
+    assert all(len(part["contacts"]) == 1 and "statuses" not in part for part in parts)
+
+
+def test_split_by_conversation_routes_each_conversation_to_its_partition():
+    body = webhook(
+        value(statuses=[status("s1", "919800000001"), status("s2", "919800000002")]),
+        value(messages=[message("m1", "919800000001")]),
+    )
+
+    parts = split_by_conversation(body)
+
+    routed = {
+        (single["entry"][0]["changes"][0]["value"].get("statuses") or
+         single["entry"][0]["changes"][0]["value"]["messages"])[0]["id"]: partition
+        for partition, bodies in parts.items() for single in bodies
+    }
+    assert routed == {
+        "s1": partition_of("1001:919800000001"),
+        "s2": partition_of("1001:919800000002"),
+        "m1": partition_of("1001:919800000001"),
+    }
+    for bodies in parts.values():
+        for single in bodies:
+            assert single["object"] == body["object"]
+            assert len(single["entry"]) == 1 and len(single["entry"][0]["changes"]) == 1
+
+
+def test_split_by_conversation_passes_malformed_changes_through():
+    body = {"entry": [{"changes": [{"field": "messages"}]}]}
+
+    (bodies,) = split_by_conversation(body).values()
+
+    assert bodies == [body]
+
+
+@pytest.fixture
+async def stream():
+    stream = WebhookStream(fakeredis.FakeAsyncRedis(), partitions=1)
+    await stream.ensure_group(0)
+    return stream
+
+
+async def deliver(stream, *names):
+    for name in names:
+        await stream.redis_client.xadd(webhook_stream._stream_key(0), {"body": json.dumps({"name": name})})
+    response = await stream.redis_client.xreadgroup(
+        stream.group, stream.consumer, {webhook_stream._stream_key(0): ">"}, count=10
+    )
+    return response[0][1]
+
+
+async def pending(stream):
+    response = await stream.redis_client.xreadgroup(
+        stream.group, stream.consumer, {webhook_stream._stream_key(0): "0"}, count=10
+    )
+    return response[0][1] if response else []
+
+
+def handler_failing(*failing):
+    seen = []
+
+    async def handler(bodies):
+        processed = []
+        for body in bodies:
+            seen.append(body["name"])
+            processed.append(body["name"] not in failing and not (processed and not processed[-1]))
+        return processed
+
+    handler.seen = seen
+    return handler
+
+
+async def test_process_batch_acks_everything_processed(stream):
+    entries = await deliver(stream, "a", "b")
+
+    assert await stream.process_batch(0, entries, handler_failing(), {}) is False
+    assert await pending(stream) == []
+
+
+async def test_process_batch_acks_only_the_prefix_before_a_failure(stream):
+    entries = await deliver(stream, "a", "b", "c")
+    attempts = {}
+
+    assert await stream.process_batch(0, entries, handler_failing("b"), attempts) is True
+
+    left = await pending(stream)
+    assert [json.loads(fields[b"body"])["name"] for _, fields in left] == ["b", "c"]
+    # Only the failed entry used up an attempt
+    assert attempts == {entries[1][0]: 1}
+
+    handler = handler_failing()
+    assert await stream.process_batch(0, left, handler, attempts) is False
+    assert handler.seen == ["b", "c"]
+    assert attempts == {}
+
+
+async def test_process_batch_drops_an_entry_after_its_last_attempt(stream, monkeypatch):
+    monkeypatch.setattr(webhook_stream, "WEBHOOK_MAX_DELIVERIES", 2)
+    await deliver(stream, "a", "b")
+    attempts = {}
+
+    for _ in range(2):
+        assert await stream.process_batch(0, await pending(stream), handler_failing("a"), attempts) is True
+
+    handler = handler_failing("a")
+    assert await stream.process_batch(0, await pending(stream), handler, attempts) is False
+    assert handler.seen == ["b"]
+    assert await pending(stream) == []
+
+
+async def test_process_batch_acks_malformed_and_trimmed_entries_in_place(stream):
+    entries = await deliver(stream, "a")
+    malformed = (b"1-1", {b"other": b"x"})
+    trimmed = (b"1-2", None)
+    handler = handler_failing()
+
+    assert await stream.process_batch(0, [malformed, trimmed] + entries, handler, {}) is False
+    assert handler.seen == ["a"]
+
+
+async def test_take_over_leaves_entries_of_a_busy_owner_alone(stream, monkeypatch):
+    monkeypatch.setattr(webhook_stream, "WEBHOOK_LEASE_MS", 60000)
+    await deliver(stream, "a")
+    next_owner = WebhookStream(stream.redis_client, partitions=1)
+    stopping = asyncio.Event()
+    stopping.set()
+
+    assert await next_owner._take_over(0, stopping) is False
+    assert [json.loads(fields[b"body"])["name"] for _, fields in await pending(stream)] == ["a"]
+
+
+async def test_take_over_claims_entries_idle_for_a_lease(stream, monkeypatch):
+    monkeypatch.setattr(webhook_stream, "WEBHOOK_LEASE_MS", 50)
+    await deliver(stream, "a", "b")
+    next_owner = WebhookStream(stream.redis_client, partitions=1)
+    assert await next_owner._acquire(0)
+
+    assert await next_owner._take_over(0, asyncio.Event()) is True
+    assert [json.loads(fields[b"body"])["name"] for _, fields in await pending(next_owner)] == ["a", "b"]
+    assert await pending(stream) == []
+
+
+async def test_a_slow_batch_keeps_renewing_its_lease(stream, monkeypatch):
+    monkeypatch.setattr(webhook_stream, "WEBHOOK_LEASE_MS", 90)
+    assert await stream._acquire(0)
+    entries = await deliver(stream, "a")
+
+    async def slow_handler(bodies):
+        await asyncio.sleep(0.3)
+        return [True] * len(bodies)
+
+    assert await stream._process_holding_lease(0, entries, slow_handler, {}) is False
+    assert await stream.redis_client.get(webhook_stream._lease_key(0)) == stream.consumer.encode()
+    assert await pending(stream) == []
+
+
+async def test_a_batch_is_abandoned_when_the_lease_is_lost(stream, monkeypatch):
+    monkeypatch.setattr(webhook_stream, "WEBHOOK_LEASE_MS", 90)
+    assert await stream._acquire(0)
+    entries = await deliver(stream, "a")
+    cancelled = asyncio.Event()
+
+    async def stuck_handler(bodies):
+        await stream.redis_client.set(webhook_stream._lease_key(0), "another-consumer")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    assert await stream._process_holding_lease(0, entries, stuck_handler, {}) is None
+    assert cancelled.is_set()
+    assert len(await pending(stream)) == 1
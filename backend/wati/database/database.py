@@ -72,6 +72,26 @@ AsyncSessionLocal = sessionmaker(
 # Base class for declarative models
 Base = declarative_base()
 
+# create_all only creates indexes together with a new table; this adds
+# indexes declared later on existing tables (run inside engine.begin()).
+# An index may name a `prepare` callable in its info, run before it is created
+# (e.g. to remove rows that would violate a new unique index).
+def ensure_indexes(connection):
+    from sqlalchemy import inspect
+
+    inspector = inspect(connection)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            prepare = index.info.get("prepare")
+            if prepare:
+                prepare(connection)
+            index.create(connection)
+
 # Dependency to get the database session
 async def get_db():
     async with AsyncSessionLocal() as session:
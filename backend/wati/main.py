@@ -4,6 +4,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from .database import database
 from .routes import user, broadcast, contacts, auth, woocommerce, integration, wallet,analytics, message_generator
 from .services import dramatiq_router
+from .services.graph_client import close_graph_client
+from .services import tasks
+from .services.broadcast_scheduler import sweep_scheduled_broadcasts, leader as broadcast_scheduler_leader, SCHEDULER_INTERVAL_SECONDS
+from .services.broadcast_progress import forward_progress_events
+from .services.websocket_manager import manager
+from .services.conversation_events import publish_active_conversation_change
+from .services.tenant_routing import tenant_routes
+from .routes.broadcast import convert_to_dict
+from .models.User import User
+import asyncio
 from . import oauth2
 from wati.models.ChatBox import Last_Conversation
 from .models import ChatBox
@@ -49,15 +59,33 @@ ai_generator = None
 async def create_db_and_tables():
     async with database.engine.begin() as conn:
         await conn.run_sync(database.Base.metadata.create_all)
+        await conn.run_sync(database.ensure_indexes)
 
 scheduler_started = False
+progress_listener = None
+webhook_consumer = None
+websocket_backplane = None
+tenant_routes_listener = None
 
 @app.on_event("startup")
 async def startup_event():
-    global ai_generator, scheduler_started
+    global ai_generator, scheduler_started, progress_listener, webhook_consumer, websocket_backplane, tenant_routes_listener
     
     # Create database tables
     await create_db_and_tables()
+
+    # Load the Phone_id / WABAID / api_key routing table used by the webhooks
+    try:
+        async for session in database.get_db():
+            await tenant_routes.load(session)
+            break
+        print("✓ Tenant routing table loaded")
+    except Exception as e:
+        print(f"⚠ Tenant routing table not loaded, it loads on the first webhook instead: {e}")
+
+    # Apply credential changes made through any API process to the routing table
+    if tenant_routes_listener is None:
+        tenant_routes_listener = asyncio.create_task(tenant_routes.listen_for_invalidations(tasks.async_redis_client))
     
     # Initialize AI generator
     try:
@@ -73,13 +101,29 @@ async def startup_event():
     # Changed to run every 10 minutes instead of 1 minute to reduce DB/Redis requests
     if not scheduler_started:
         scheduler.add_job(close_expired_chats, 'interval', minutes=10)
+        # Enqueue scheduled broadcasts shortly before they are due (leader-elected across processes)
+        scheduler.add_job(sweep_scheduled_broadcasts, 'interval', seconds=SCHEDULER_INTERVAL_SECONDS,
+                          max_instances=1, coalesce=True, next_run_time=datetime.now())
         scheduler.start()
         scheduler_started = True
-        print("✓ Scheduler started (runs every 10 minutes)")
+        print("✓ Scheduler started (expired chats every 10 minutes, scheduled broadcasts every "
+              f"{SCHEDULER_INTERVAL_SECONDS}s)")
+
+    # Deliver WebSocket updates published by any API process to this process's clients
+    if websocket_backplane is None:
+        websocket_backplane = asyncio.create_task(manager.run_backplane(tasks.async_redis_client))
+
+    # Relay broadcast progress events from the workers to WebSocket clients
+    if progress_listener is None:
+        progress_listener = asyncio.create_task(forward_progress_events(tasks.async_redis_client, manager))
+
+    # Process Meta webhooks buffered by POST /meta-webhook
+    if webhook_consumer is None:
+        webhook_consumer = asyncio.create_task(tasks.webhook_stream.consume(broadcast.process_webhook_batch))
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global ai_generator, scheduler_started
+    global scheduler_started
     
     # Cleanup AI generator
     if ai_generator:
@@ -89,8 +133,29 @@ async def shutdown_event():
     if scheduler_started:
         scheduler.shutdown(wait=False)
         scheduler_started = False
+        await broadcast_scheduler_leader.release()
         print("✓ Scheduler shut down")
 
+    # Stop the WebSocket backplane
+    if websocket_backplane:
+        websocket_backplane.cancel()
+
+    # Stop relaying broadcast progress
+    if progress_listener:
+        progress_listener.cancel()
+
+    # Stop listening for routing invalidations
+    if tenant_routes_listener:
+        tenant_routes_listener.cancel()
+
+    # Stop consuming webhooks; the released partitions are taken over by other processes
+    if webhook_consumer:
+        webhook_consumer.cancel()
+        await asyncio.gather(webhook_consumer, return_exceptions=True)
+
+    # Close pooled Graph API connections
+    await close_graph_client()
+
 async def close_expired_chats() -> None:
     """Close chats that have been inactive for more than 24 hours."""
     try:
@@ -107,6 +172,16 @@ async def close_expired_chats() -> None:
                 conversation.active = False
             await session.commit()
             print(f"Successfully closed {len(expired_conversations)} expired chats.")
+
+            # Push the closed chats to their owners' active-conversations sockets
+            if expired_conversations:
+                receivers = {int(conversation.receiver_wa_id) for conversation in expired_conversations}
+                owners = await session.execute(select(User.Phone_id, User.id).where(User.Phone_id.in_(receivers)))
+                owner_by_phone_id = {str(phone_id): user_id for phone_id, user_id in owners.all()}
+                for conversation in expired_conversations:
+                    user_id = owner_by_phone_id.get(conversation.receiver_wa_id)
+                    if user_id is not None:
+                        await publish_active_conversation_change(user_id, "upsert", convert_to_dict(conversation))
             break
     except Exception as e:
         print(f"Error in close_expired_chats: {e}")
@@ -1,12 +1,15 @@
 from ..database import database
 from sqlalchemy import Integer,Column,String,ARRAY,Boolean,JSON
 from . import User
-from sqlalchemy import Column, String, TIMESTAMP, ForeignKey, func
+from sqlalchemy import Column, String, TIMESTAMP, ForeignKey, func, UniqueConstraint, Index
 
 
 # broadcast List
 class BroadcastList(database.Base):
     __tablename__="BroadcastList"
+    # The broadcast scheduler sweeps due rows by (status, scheduled_time)
+    __table_args__ = (Index("ix_BroadcastList_status_scheduled_time", "status", "scheduled_time"),)
+
     id = Column(Integer, primary_key=True, index=True)
     user_id=Column(Integer,ForeignKey("Users.id")) # Foreign key to Users table
     name = Column(String)
@@ -55,4 +58,41 @@ class Template(database.Base):
     is_deleted = Column(Boolean, default=False, nullable=False)  # Soft delete flag
     deleted_at = Column(TIMESTAMP, nullable=True)  # When template was deleted
     created_at = Column(TIMESTAMP, server_default=func.now())
-    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+class BroadcastCheckpoint(database.Base):
+    """Durable send cursor for one chunk of a broadcast, so an interrupted chunk can resume."""
+    __tablename__="BroadcastCheckpoint"
+    __table_args__ = (UniqueConstraint("broadcast_id", "chunk_index", name="uq_broadcast_checkpoint_chunk"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    broadcast_id = Column(Integer, ForeignKey("BroadcastList.id"), index=True)
+    chunk_index = Column(Integer, nullable=False, default=0)
+    cursor = Column(Integer, nullable=False, default=0)  # Recipients of the chunk already attempted
+    success = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="running")  # running / resumable / done / failed (given up)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+class BroadcastRecipient(database.Base):
+    """One recipient of a broadcast; queue messages reference these by seq range instead of carrying the list."""
+    __tablename__="BroadcastRecipient"
+    __table_args__ = (UniqueConstraint("broadcast_id", "seq", name="uq_broadcast_recipient_seq"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    broadcast_id = Column(Integer, ForeignKey("BroadcastList.id"), nullable=False)
+    seq = Column(Integer, nullable=False)  # Position in the broadcast, 0-based
+    name = Column(String)
+    phone = Column(String, nullable=False)
+
+class ScheduledBroadcast(database.Base):
+    """Send parameters of a scheduled broadcast, kept until the scheduler enqueues it at scheduled_time."""
+    __tablename__="ScheduledBroadcast"
+
+    id = Column(Integer, primary_key=True, index=True)
+    broadcast_id = Column(Integer, ForeignKey("BroadcastList.id"), nullable=False, unique=True)
+    template_data = Column(String)
+    image_id = Column(String, nullable=True)
+    body_parameters = Column(String, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.now())
@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean,BIGINT
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean,BIGINT, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from ..database import database
@@ -22,9 +22,23 @@ class Conversation(database.Base):
     direction = Column(String, nullable=False)  # Track message direction
 
 
+def dedupe_last_conversations(connection):
+    """Keep only the newest row per (sender, receiver) before the unique index is created."""
+    connection.execute(text(
+        "DELETE FROM last_conversations WHERE id NOT IN ("
+        "SELECT MAX(id) FROM last_conversations GROUP BY sender_wa_id, receiver_wa_id)"
+    ))
+
+
 class Last_Conversation(database.Base):
     __tablename__ = 'last_conversations'
-
+    # One row per chat, maintained with INSERT ... ON CONFLICT DO UPDATE
+    __table_args__ = (
+        Index(
+            "uq_last_conversations_sender_receiver", "sender_wa_id", "receiver_wa_id",
+            unique=True, info={"prepare": dedupe_last_conversations},
+        ),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     message_id = Column(String)  # Unique message ID
@@ -1,6 +1,6 @@
 # Import all models to ensure they are registered with Base.metadata
 from .User import User
-from .Broadcast import BroadcastList, BroadcastAnalysis, Template
+from .Broadcast import BroadcastList, BroadcastAnalysis, BroadcastCheckpoint, BroadcastRecipient, ScheduledBroadcast, Template
 from .Contacts import Contact
 from .ChatBox import Conversation, Last_Conversation
 from .Integration import Integration, Integration_credentials, WooIntegration
@@ -9,6 +9,9 @@ __all__ = [
     'User',
     'BroadcastList',
     'BroadcastAnalysis',
+    'BroadcastCheckpoint',
+    'BroadcastRecipient',
+    'ScheduledBroadcast',
     'Template',
     'Contact',
     'Conversation',
@@ -3,7 +3,6 @@ from fastapi import FastAPI
 from ..models import Broadcast,Contacts,ChatBox
 from ..models.ChatBox import Last_Conversation
 from ..models.ChatBox import Conversation
-from ..models.User import User
 from ..Schemas import broadcast,user,chatbox
 from ..database import database
 from sqlalchemy.orm import Session
@@ -16,6 +15,11 @@ import asyncio
 from datetime import datetime
 from sqlalchemy import desc
 from ..crud.template import send_template_to_whatsapp
+from ..services import tasks
+from ..services.graph_client import get_graph_client
+from ..services.tenant_routing import tenant_routes
+from ..services.status_updates import status_update_from_event, merge_status_update, apply_or_park_status_updates
+from ..services.webhook_dedup import is_status_key
 from fastapi import APIRouter,Depends,HTTPException, File, UploadFile,Request
 from starlette.responses import PlainTextResponse
 from ..oauth2 import get_current_user
@@ -39,7 +43,6 @@ from fastapi.responses import StreamingResponse
 from typing import AsyncGenerator
 import asyncio
 import json
-from sqlalchemy import cast,String
 from fastapi import status
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -58,7 +61,8 @@ from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import desc, cast, String, update,BIGINT
+from sqlalchemy import desc, update,BIGINT
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from typing import  AsyncGenerator
 from datetime import datetime
 import json
@@ -105,138 +109,181 @@ async def verify_webhook(request: Request):
 @router.post("/meta-webhook")
 async def receive_meta_webhook(request: Request, db: AsyncSession = Depends(database.get_db)):
     """
-    Endpoint to receive and process webhook data from WhatsApp.
+    Endpoint to receive webhook data from WhatsApp.
+
+    Only the payload shape is checked here; the body is appended to the
+    webhook stream, partitioned per conversation, and processed in batches by
+    the stream consumers, so the response does not wait on the database (see
+    services/webhook_stream.py).
     """
     try:
-        # Parse the incoming webhook request
-        body = await request.json()
-        print(json.dumps(body, indent=4))  # For readability of the incoming payload
+        body = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
 
-        if "entry" not in body:
-            raise HTTPException(status_code=400, detail="Invalid webhook format")
+    if not isinstance(body, dict) or "entry" not in body:
+        raise HTTPException(status_code=400, detail="Invalid webhook format")
 
-        # Process each entry
-        for event in body["entry"]:
-            if "changes" not in event:
-                raise HTTPException(status_code=400, detail="Missing 'changes' key in entry")
+    if await tasks.webhook_stream.enqueue(body):
+        return {"message": "Webhook data received"}
 
-            # Iterate through each change
-            for change in event["changes"]:
-                if "value" not in change:
-                    raise HTTPException(status_code=400, detail="Missing 'value' key in changes")
+    # Redis is unavailable: process inline rather than lose the event
+    try:
+        await process_webhook_body(body, db)
+    except HTTPException:
+        raise
+    except KeyError as e:
+        logging.error(f"Missing key in webhook payload: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Missing key: {str(e)}")
+    except Exception as e:
+        logging.error(f"Error processing webhook: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
-                value = change["value"]
+    return {"message": "Webhook data received and processed successfully"}
 
-                # Handle messages (replies)
-                if "statuses" in value:
-                    for status in value["statuses"]:
-                        # Check if the necessary keys exist
-                        if "recipient_id" not in status or "id" not in status or "status" not in status or "timestamp" not in status:
-                            raise HTTPException(status_code=400, detail="Missing keys in statuses")
 
-                        
-                        message_status = status["status"]
-                        wamid=status['id']
+async def process_webhook_batch(bodies: list) -> list:
+    """
+    Webhook stream handler: process a batch of payloads on one session.
+    Delivery statuses of the whole batch are coalesced per wamid and applied
+    together. Returns, per payload, whether it was processed; processing stops
+    at the first failed payload, so later ones of its conversation keep their order.
+    """
+    processed = []
+    claimed_keys = []
+    status_updates = {}
+    statuses_applied = True
+    try:
+        async for db in database.get_db():
+            for body in bodies:
+                if processed and not processed[-1]:
+                    processed.append(False)
+                    claimed_keys.append([])
+                    continue
+                # Retried or redelivered events are dropped here, before any query
+                keys = await tasks.webhook_dedup.drop_duplicates(body)
+                claimed_keys.append(keys)
+                try:
+                    await process_webhook_body(body, db, status_updates)
+                    processed.append(True)
+                except HTTPException as e:
+                    # Malformed payload: retrying will not help
+                    await db.rollback()
+                    logging.error(f"Discarding webhook payload: {e.detail}")
+                    processed.append(True)
+                except Exception as e:
+                    await db.rollback()
+                    logging.error(f"Error processing webhook: {str(e)}")
+                    processed.append(False)
+
+            if status_updates:
+                try:
+                    await apply_or_park_status_updates(db, status_updates, tasks.pending_statuses)
+                except Exception as e:
+                    await db.rollback()
+                    logging.error(f"Error applying {len(status_updates)} delivery statuses: {str(e)}")
+                    statuses_applied = False
+            break
+    except asyncio.CancelledError:
+        # The partition was lost mid-batch: its next owner processes the whole batch again
+        await tasks.webhook_dedup.release([key for keys in claimed_keys for key in keys])
+        raise
+
+    # Only committed events count as seen; the others will be redelivered and
+    # must not be dropped as duplicates then. When only the statuses failed, a
+    # payload's messages are committed: they are confirmed, so its redelivery
+    # applies just the statuses
+    confirmed, released = [], []
+    for index, (body, keys, ok) in enumerate(zip(bodies, claimed_keys, processed)):
+        if ok and not statuses_applied and _has_statuses(body):
+            processed[index] = False
+            confirmed += [key for key in keys if not is_status_key(key)]
+            released += [key for key in keys if is_status_key(key)]
+        elif ok:
+            confirmed += keys
+        else:
+            released += keys
+    await tasks.webhook_dedup.confirm(confirmed)
+    await tasks.webhook_dedup.release(released)
+    return processed
 
-                        message_read=False
-                        message_delivered=False
-                        message_sent=False
-                        error_reason = None
-                        
 
-                        
-                        if(message_status=="read"):
-                            message_read=True
-                            message_delivered=True
-                            message_sent=True
-                            
-                        
-                        elif(message_status=="delivered"):
-                            message_read=False
-                            message_delivered=True
-                            message_sent=True
-                            
+def _has_statuses(body: dict) -> bool:
+    return any(
+        "statuses" in change.get("value", {})
+        for event in body.get("entry", [])
+        for change in event.get("changes", [])
+    )
 
 
-                        elif(message_status=="sent"):
-                            message_read=False
-                            message_delivered=False
-                            message_sent=True
+async def process_webhook_body(body: dict, db: AsyncSession, status_updates: dict = None):
+    """
+    Apply one webhook payload: delivery statuses, replies and incoming messages.
 
+    When `status_updates` is given, delivery statuses are only merged into it
+    and the caller applies them for the whole batch.
+    """
+    apply_statuses = status_updates is None
+    if apply_statuses:
+        status_updates = {}
 
-                        
-                        elif (message_status == "failed"):
-                            # Log the error reason from the status
-                            if "errors" in status and status["errors"]:
-                                error_details = status["errors"][0]
-                                error_data_details = status["errors"][0].get("error_data", {}).get("details", "No details available") # Assuming only one error is present
-                                error_reason = f"Error Code: {error_details.get('code', 'N/A')}, " \
-                                            f"Title: {error_details.get('title', 'N/A')}, " \
-                                            f"Details: {error_data_details}"
-                            
-                                
+    if "entry" not in body:
+        raise HTTPException(status_code=400, detail="Invalid webhook format")
 
+    # Process each entry
+    for event in body["entry"]:
+        if "changes" not in event:
+            raise HTTPException(status_code=400, detail="Missing 'changes' key in entry")
 
+        # Iterate through each change
+        for change in event["changes"]:
+            if "value" not in change:
+                raise HTTPException(status_code=400, detail="Missing 'value' key in changes")
 
-                        result1 =await db.execute(select(Broadcast.BroadcastAnalysis)
-                                .filter( Broadcast.BroadcastAnalysis.message_id==wamid)
-                                )
-                            
-                        broadcast_report=result1.scalars().first()
-                        
-                        if not broadcast_report:
-                                raise HTTPException(status_code=404,detail="Broadcast not found")
-
-                        if wamid:
-                                broadcast_report.read=message_read
-                                broadcast_report.delivered=message_delivered
-                                broadcast_report.sent=message_sent
-                                broadcast_report.status=message_status
-                                if error_reason is not None:
-                                    broadcast_report.error_reason = error_reason 
-
-                        db.add(broadcast_report)
-                        await db.commit()
-                        await db.refresh(broadcast_report) 
+            value = change["value"]
+
+            # Delivery statuses are merged per wamid and applied in one set-based update
+            if "statuses" in value:
+                for status in value["statuses"]:
+                    # Check if the necessary keys exist
+                    if "recipient_id" not in status or "id" not in status or "status" not in status or "timestamp" not in status:
+                        raise HTTPException(status_code=400, detail="Missing keys in statuses")
+
+                    status_update = status_update_from_event(status)
+                    if status_update:
+                        merge_status_update(status_updates, status_update)
+
+            if "messages" in value:
                 
-                if "messages" in value:
+                for message in value["messages"]:
+                    if message.get('context', {}).get('id'):
+                        message_reply=True
+                        message_status='replied'
                     
-                    for message in value["messages"]:
-                        if message.get('context', {}).get('id'):
-                            message_reply=True
-                            message_status='replied'
                         
+                        wamid=message['context']['id']
+                        result2 =await db.execute(select(Broadcast.BroadcastAnalysis)
+                                .filter( Broadcast.BroadcastAnalysis.message_id==wamid))
                             
-                            wamid=message['context']['id']
-                            result2 =await db.execute(select(Broadcast.BroadcastAnalysis)
-                                    .filter( Broadcast.BroadcastAnalysis.message_id==wamid))
-                                
-                            broadcast_report=result2.scalars().first()
-                            
-                            # if not broadcast_report:                                    
-                            #         raise HTTPException(status_code=404,detail="Broadcast not found")
-
-
-                           
-                            if broadcast_report:
-                                broadcast_report.replied=message_sent=message_reply
-                                broadcast_report.status=message_status
-                                db.add(broadcast_report)
-                                await db.commit()
-                                await db.refresh(broadcast_report)
-                # Handle incoming messages and replies
-                if "messages" in value:
-                    await handle_incoming_messages(value, db)
+                        broadcast_report=result2.scalars().first()
+                        
+                        # if not broadcast_report:                                    
+                        #         raise HTTPException(status_code=404,detail="Broadcast not found")
 
 
-        return {"message": "Webhook data received and processed successfully"}
+                       
+                        if broadcast_report:
+                            broadcast_report.replied=message_sent=message_reply
+                            broadcast_report.status=message_status
+                            db.add(broadcast_report)
+                            await db.commit()
+                            await db.refresh(broadcast_report)
+            # Handle incoming messages and replies
+            if "messages" in value:
+                await handle_incoming_messages(value, db)
 
-    except KeyError as e:
-        logging.error(f"Missing key in webhook payload: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Missing key: {str(e)}")
-    except Exception as e:
-        logging.error(f"Error processing webhook: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+    if apply_statuses and status_updates:
+        await apply_or_park_status_updates(db, status_updates, tasks.pending_statuses)
 
 
 async def handle_incoming_messages(value:dict, db: AsyncSession):
@@ -258,37 +305,32 @@ async def handle_incoming_messages(value:dict, db: AsyncSession):
 
 
         
-        result =await db.execute(select(Last_Conversation).filter(
-            Last_Conversation.sender_wa_id == wa_id,
-            Last_Conversation.receiver_wa_id == phone_number_id,
-            
-        ))
-
-        last_conversation=result.scalars().first()
-
-        # Determine if this is the first message in a new conversation
-
-        if last_conversation:
-            # Clear previous expired conversations for this pair
-
-            await db.delete(last_conversation)
-            await db.commit()
-
-
-        last_Conversation = Last_Conversation(
-                business_account_id=value['metadata'].get('business_account_id', 'unknown'),
-                message_id=message_id,
-                message_content=message_content,
-                sender_wa_id=wa_id,
-                sender_name=name,
-                receiver_wa_id=phone_number_id,
-                last_chat_time=utc_time,
-                active=True
-            )
-        db.add(last_Conversation)
-        await db.commit()
+        # Upsert the chat's Last_Conversation row (unique per sender/receiver pair)
+        # and store the message in the Conversations table, in one transaction
+        last_conversation_values = dict(
+            business_account_id=value['metadata'].get('business_account_id', 'unknown'),
+            message_id=message_id,
+            message_content=message_content,
+            sender_wa_id=wa_id,
+            sender_name=name,
+            receiver_wa_id=phone_number_id,
+            last_chat_time=utc_time,
+            active=True
+        )
+        upsert = pg_insert(Last_Conversation).values(**last_conversation_values)
+        upsert_result = await db.execute(
+            upsert.on_conflict_do_update(
+                index_elements=[Last_Conversation.sender_wa_id, Last_Conversation.receiver_wa_id],
+                set_={
+                    key: upsert.excluded[key]
+                    for key in last_conversation_values
+                    if key not in ("sender_wa_id", "receiver_wa_id")
+                },
+            ).returning(Last_Conversation),
+            execution_options={"populate_existing": True},
+        )
+        last_conversation = upsert_result.scalars().first()
 
-        # Store the message in the Conversations table
         conversation = Conversation(
             wa_id=wa_id,
             message_id=message_id,
@@ -305,24 +347,12 @@ async def handle_incoming_messages(value:dict, db: AsyncSession):
         # Push update via WebSocket to connected clients (no polling needed!)
         from ..services.websocket_manager import manager
         
-        # Notify users watching active conversations for this receiver
-        # Find user_id from phone_number_id (receiver_wa_id)
-        user_result = await db.execute(
-            select(User).filter(User.Phone_id == int(phone_number_id))
-        )
-        receiver_user = user_result.scalars().first()
+        # Notify users watching active conversations for this receiver with just
+        # the changed chat (a versioned delta, see services/conversation_events.py)
+        # Find user_id from phone_number_id (receiver_wa_id), from the routing table
+        receiver_user = await tenant_routes.by_phone_id(db, phone_number_id)
         if receiver_user:
-            # Get updated active conversations for this user
-            active_result = await db.execute(
-                select(ChatBox.Last_Conversation)
-                .filter(cast(ChatBox.Last_Conversation.receiver_wa_id, String) == str(phone_number_id))
-                .order_by(desc(ChatBox.Last_Conversation.last_chat_time))
-            )
-            active_chats = [convert_to_dict(chat) for chat in active_result.scalars().all()]
-            await manager.broadcast_active_conversations_update(
-                receiver_user.id,
-                {"type": "update", "data": active_chats}
-            )
+            await publish_active_conversation_change(receiver_user.id, "upsert", convert_to_dict(last_conversation))
         
         # Notify users watching this specific conversation
         conversation_dict = convert_to_dict(conversation)
@@ -367,7 +397,7 @@ async def websocket_conversation(
                 return
             
             # Connect to WebSocket manager
-            await manager.connect_conversation(websocket, current_user.id, contact_number)
+            sender = await manager.connect_conversation(websocket, current_user.id, contact_number)
             
             # Send initial conversation data
             result = await db.execute(
@@ -378,7 +408,8 @@ async def websocket_conversation(
             )
             conversations = result.scalars().all()
             conversation_data = [convert_to_dict(conversation) for conversation in conversations]
-            await websocket.send_json({"type": "initial", "data": conversation_data})
+            # Replies go through the connection's send queue, like the pushed updates
+            sender.send({"type": "initial", "data": conversation_data})
             break  # Exit after first iteration
         
         # Keep connection persistent - listen for messages (two-way communication)
@@ -391,27 +422,27 @@ async def websocket_conversation(
                 
                 # Handle ping/pong for keepalive
                 if message == "ping":
-                    await websocket.send_text("pong")
+                    sender.send("pong")
                 elif message.startswith("{"):
                     # Handle JSON messages from client (two-way communication)
                     try:
                         client_data = json.loads(message)
                         # Echo back or process client message
-                        await websocket.send_json({
+                        sender.send({
                             "type": "ack",
                             "message": "Received your message",
                             "client_data": client_data
                         })
                     except json.JSONDecodeError:
-                        await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                        sender.send({"type": "error", "message": "Invalid JSON"})
                         
             except WebSocketDisconnect:
                 print(f"Client disconnected from conversation {contact_number} (user_id: {current_user.id})")
-                await manager.disconnect_conversation(current_user.id, contact_number)
+                await manager.disconnect_conversation(current_user.id, contact_number, sender)
                 break
             except Exception as e:
                 print(f"WebSocket error for conversation {contact_number} (user_id: {current_user.id}): {e}")
-                await manager.disconnect_conversation(current_user.id, contact_number)
+                await manager.disconnect_conversation(current_user.id, contact_number, sender)
                 break
                 
     except Exception as e:
@@ -486,6 +517,26 @@ def convert_to_dict(instance):
 
 
 from ..services.websocket_manager import manager
+from ..services.conversation_events import current_version, publish_active_conversation_change
+
+
+async def active_conversations_snapshot(db: AsyncSession, current_user) -> dict:
+    """
+    All of the user's chats, newest first, with the version they correspond to.
+    The version is read first, so any change made meanwhile arrives as a later delta.
+    """
+    version = await current_version(current_user.id)
+    result = await db.execute(
+        select(ChatBox.Last_Conversation)
+        .filter(ChatBox.Last_Conversation.receiver_wa_id == str(current_user.Phone_id))
+        .order_by(desc(ChatBox.Last_Conversation.last_chat_time))
+    )
+    return {
+        "type": "initial",
+        "version": version,
+        "data": [convert_to_dict(chat) for chat in result.scalars().all()]
+    }
+
 
 @router.websocket("/ws/active-conversations")
 async def websocket_active_conversations(
@@ -493,7 +544,8 @@ async def websocket_active_conversations(
 ):
     '''
     WebSocket endpoint for real-time active conversations updates.
-    No polling - updates are pushed when conversations change.
+    No polling - a versioned snapshot on connect, then one upsert/remove delta
+    per changed chat. Send {"type": "resync"} after a version gap for a new snapshot.
     Query param: ?token=YOUR_TOKEN
     '''
     try:
@@ -512,16 +564,11 @@ async def websocket_active_conversations(
                 return
             
             # Connect to WebSocket manager
-            await manager.connect_active_conversations(websocket, current_user.id, db)
+            sender = await manager.connect_active_conversations(websocket, current_user.id, db)
             
-            # Send initial data
-            result = await db.execute(
-                select(ChatBox.Last_Conversation)
-                .filter(cast(ChatBox.Last_Conversation.receiver_wa_id, String) == str(current_user.Phone_id))
-                .order_by(desc(ChatBox.Last_Conversation.last_chat_time))
-            )
-            active_chat_data = [convert_to_dict(chat) for chat in result.scalars().all()]
-            await websocket.send_json({"type": "initial", "data": active_chat_data})
+            # Send initial data; later changes arrive as versioned deltas. Replies
+            # go through the connection's send queue, like the pushed updates
+            sender.send(await active_conversations_snapshot(db, current_user))
             break  # Exit after first iteration
         
         # Keep connection persistent - listen for messages (two-way communication)
@@ -534,27 +581,33 @@ async def websocket_active_conversations(
                 
                 # Handle ping/pong for keepalive
                 if message == "ping":
-                    await websocket.send_text("pong")
+                    sender.send("pong")
                 elif message.startswith("{"):
                     # Handle JSON messages from client (two-way communication)
                     try:
                         client_data = json.loads(message)
+                        if isinstance(client_data, dict) and client_data.get("type") == "resync":
+                            # Client detected a version gap: send a fresh snapshot
+                            async for db in database.get_db():
+                                sender.send(await active_conversations_snapshot(db, current_user))
+                                break
+                            continue
                         # Echo back or process client message
-                        await websocket.send_json({
+                        sender.send({
                             "type": "ack",
                             "message": "Received your message",
                             "client_data": client_data
                         })
                     except json.JSONDecodeError:
-                        await websocket.send_json({"type": "error", "message": "Invalid JSON"})
+                        sender.send({"type": "error", "message": "Invalid JSON"})
                         
             except WebSocketDisconnect:
                 print(f"Client disconnected (user_id: {current_user.id})")
-                await manager.disconnect_active_conversations(current_user.id)
+                await manager.disconnect_active_conversations(current_user.id, sender)
                 break
             except Exception as e:
                 print(f"WebSocket error for user {current_user.id}: {e}")
-                await manager.disconnect_active_conversations(current_user.id)
+                await manager.disconnect_active_conversations(current_user.id, sender)
                 break
                 
     except Exception as e:
@@ -605,9 +658,12 @@ async def send_message(
     }
 }
 
-    async with httpx.AsyncClient() as client:
-        # Send POST request to WhatsApp API
-        response = await client.post(whatsapp_url, headers=headers, json=data)
+    # Wait for a send slot on this number (shared with running broadcasts)
+    await tasks.phone_rate_limiter.acquire(get_current_user.Phone_id)
+
+    client = get_graph_client()
+    # Send POST request to WhatsApp API
+    response = await client.post(whatsapp_url, headers=headers, json=data)
 
     # Check for errors in the response
     if response.status_code != 200:
@@ -677,9 +733,12 @@ async def send_message(
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        # Send POST request to WhatsApp API
-        response = await client.post(whatsapp_url, headers=headers, json=data)
+    # Wait for a send slot on this number (shared with running broadcasts)
+    await tasks.phone_rate_limiter.acquire(get_current_user.Phone_id)
+
+    client = get_graph_client()
+    # Send POST request to WhatsApp API
+    response = await client.post(whatsapp_url, headers=headers, json=data)
 
     # Check for errors in the response
     if response.status_code != 200:
@@ -755,20 +814,91 @@ async def send_template_message(
 
 
     contacts = [{"name": contact.name, "phone": contact.phone} for contact in request.recipients]
-    # Start the background task
-    send_template_messages_task.send(
-        broadcast_id=broadcast_list.id,
-        recipients=contacts,
-        template=request.template,
-        template_data=request.template_data,
-        image_id=request.image_id,
-        body_parameters=request.body_parameters,
-        phone_id=get_current_user.Phone_id,
-        access_token=get_current_user.PAccessToken,
-        user_id=get_current_user.id
-    )
 
-    return {"status": "processing", "broadcast_id": broadcast_list.id}
+    # Store the recipients once; queue messages only reference them by seq range
+    total = await tasks.store_broadcast_recipients(db, broadcast_list.id, contacts)
+    await db.commit()
+
+    # Split the recipients into chunks so several workers can send in parallel;
+    # finalize_broadcast sets the final status once every chunk has reported
+    chunks = tasks.chunk_ranges(total)
+    await asyncio.to_thread(tasks.register_broadcast_chunks, broadcast_list.id, len(chunks))
+    await asyncio.to_thread(tasks.broadcast_progress.start, broadcast_list.id, get_current_user.id, total)
+
+    # Start the background tasks
+    for chunk_index, recipient_range in enumerate(chunks):
+        tasks.send_template_messages_task.send(
+            broadcast_id=broadcast_list.id,
+            recipients=None,
+            template=request.template,
+            template_data=request.template_data,
+            image_id=request.image_id,
+            body_parameters=request.body_parameters,
+            phone_id=get_current_user.Phone_id,
+            access_token=get_current_user.PAccessToken,
+            user_id=get_current_user.id,
+            chunk_index=chunk_index,
+            recipient_range=recipient_range
+        )
+
+    return {"status": "processing", "broadcast_id": broadcast_list.id, "chunks": len(chunks)}
+
+
+@router.get("/broadcast/{broadcast_id}/progress")
+async def get_broadcast_progress(
+    broadcast_id: int,
+    get_current_user: user.newuser = Depends(get_current_user)
+):
+    '''
+    Live send progress of a broadcast (sent, failed, in flight, ETA), read from
+    the Redis counters only. The same data is pushed as "broadcast_progress"
+    events on the active-conversations WebSocket while the broadcast runs.
+    '''
+    progress = await asyncio.to_thread(tasks.broadcast_progress.snapshot, broadcast_id)
+    if not progress or progress["user_id"] != get_current_user.id:
+        raise HTTPException(status_code=404, detail="No progress recorded for this broadcast")
+    return progress
+
+
+@router.get("/broadcast-dead-letters")
+async def get_dead_letters(
+    broadcast_id: int = Query(None),
+    get_current_user: user.newuser = Depends(get_current_user)
+):
+    '''
+    Sends that kept failing transiently (429s, 5xx, timeouts) after every retry,
+    optionally for one broadcast.
+    '''
+    entries = await asyncio.to_thread(tasks.dead_letters.list, get_current_user.id, broadcast_id)
+    return {"count": len(entries), "dead_letters": entries}
+
+
+@router.post("/broadcast-dead-letters/replay")
+async def replay_dead_letters(
+    broadcast_id: int = Query(None),
+    db: AsyncSession = Depends(database.get_db),
+    get_current_user: user.newuser = Depends(get_current_user)
+):
+    '''
+    Re-send dead-lettered messages in bulk (all of them, or one broadcast's)
+    through the retry stage. Broadcast counters are corrected as they resolve.
+    Dead letters of cancelled broadcasts are not replayed.
+    '''
+    if broadcast_id is not None:
+        result = await db.execute(
+            select(Broadcast.BroadcastList.status).filter(
+                Broadcast.BroadcastList.id == broadcast_id,
+                Broadcast.BroadcastList.user_id == get_current_user.id
+            )
+        )
+        status = result.scalars().first()
+        if status is None:
+            raise HTTPException(status_code=404, detail="Broadcast not found")
+        if status == "Cancelled":
+            raise HTTPException(status_code=400, detail="Broadcast was cancelled, its dead letters are not replayed")
+
+    replayed = await tasks.replay_dead_letters(db, get_current_user, broadcast_id)
+    return {"replayed": replayed}
 
 
 # NOTE: The send_template_messages_task Dramatiq actor has been moved to wati/services/tasks.py
@@ -1315,10 +1445,46 @@ async def delete_scheduled_broadcast(
     # Update the status to 'Cancelled' asynchronously
     broadcast.status = "Cancelled"
     await db.commit()
+
+    # Queued and running chunks check this flag instead of the database
+    await asyncio.to_thread(tasks.cancel_broadcast, broadcast_id)
+    await asyncio.to_thread(tasks.broadcast_progress.finish, broadcast_id, "Cancelled")
     
     return {"detail": "Scheduled broadcast has been canceled."}
 
 
+@router.post("/broadcast/{broadcast_id}/cancel")
+async def cancel_broadcast(
+    broadcast_id: int,
+    db: AsyncSession = Depends(database.get_db),
+    get_current_user: user.newuser = Depends(get_current_user)
+):
+    '''
+    Stop a scheduled or running broadcast. Running chunks stop before their next
+    send batch; messages already sent are kept in the report.
+    '''
+    result = await db.execute(
+        select(Broadcast.BroadcastList).filter(
+            Broadcast.BroadcastList.id == broadcast_id,
+            Broadcast.BroadcastList.user_id == get_current_user.id
+        )
+    )
+    broadcast = result.scalars().first()
+
+    if not broadcast:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+
+    if broadcast.status in ("Successful", "Partially Successful", "Failed"):
+        raise HTTPException(status_code=400, detail=f"Broadcast already finished ({broadcast.status})")
+
+    await asyncio.to_thread(tasks.cancel_broadcast, broadcast_id)
+    broadcast.status = "Cancelled"
+    await db.commit()
+    await asyncio.to_thread(tasks.broadcast_progress.finish, broadcast_id, "Cancelled")
+
+    return {"detail": "Broadcast has been cancelled.", "broadcast_id": broadcast_id}
+
+
 # @router.post("/create-template", response_model=broadcast.TemplateResponse)
 # async def create_template(
 #     template: broadcast.TemplateCreate,
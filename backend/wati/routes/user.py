@@ -10,6 +10,8 @@ from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 import secrets
 from ..oauth2 import get_current_user
+from ..services.tenant_routing import tenant_routes
+from ..services import tasks
 import requests
 import json
 import os
@@ -102,6 +104,8 @@ async def process_responses(
     db.add(current_user)
     await db.commit()
     await db.refresh(current_user)
+    # Webhook routing must see the new WABA and token
+    await tenant_routes.invalidate_everywhere(tasks.async_redis_client, current_user.id)
 
     # Permanent access token
     Paccess_token=token_data.get("access_token")
@@ -176,6 +180,7 @@ async def new_user(
     db.add(registeruser)
     await db.commit()  # Commit the transaction asynchronously
     await db.refresh(registeruser)  # Refresh the instance asynchronously
+    await tenant_routes.invalidate_everywhere(tasks.async_redis_client, registeruser.id)
 
     return {"success": True, "message": "Account created successfully"}
 
@@ -197,7 +202,6 @@ def update_profile(
     """
     Updates the WhatsApp Business Profile using the provided JSON payload.
     """
-
     WHATSAPP_API_URL = f"https://graph.facebook.com/v20.0/{get_current_user.Phone_id}/whatsapp_business_profile"
 
     # Prepare the request payload by dumping the model and ensuring all fields are serializable
@@ -2,7 +2,7 @@
 from fastapi import FastAPI, Depends, HTTPException, Request,APIRouter
 from sqlalchemy.orm import Session
 from ..database import database  # Your database connection
-from ..models import User,Integration,Broadcast
+from ..models import Integration,Broadcast
 import json # Your models
 import requests
 from ..Schemas import user,integration,woocommerce
@@ -14,6 +14,8 @@ import httpx
 from datetime import datetime, timedelta
 import pytz
 from ..services import tasks
+from ..services.graph_client import get_graph_client
+from ..services.tenant_routing import tenant_routes
 from pydantic import BaseModel
 import requests
 from urllib.parse import urlparse
@@ -38,15 +40,12 @@ async def verify_api_key(request: Request, db: AsyncSession ):
     if not api_key:
         raise HTTPException(status_code=401, detail="API key missing")
 
-    # Check if API key exists in the database
-    result =await db.execute(select(User).filter(User.api_key == api_key))
-
-    user=result.scalars().first()
+    # Check if API key belongs to a user (in-memory routing table, no query on a hit)
+    user = await tenant_routes.by_api_key(db, api_key)
     
     if not user:
         raise HTTPException(status_code=403, detail="Invalid API key")
     
-    print(user)
     return user
 
 
@@ -155,9 +154,10 @@ async def send_order_confirmation_message(order_data, whatsapp_token, phone_id,
         "Content-Type": "application/json"
     }
     
-    # Send message to WhatsApp API
-    async with httpx.AsyncClient() as client:
-        response = await client.post(API_URL, headers=API_HEADERS, json=data)
+    # Send message to WhatsApp API (shares the per-number rate limit with broadcasts)
+    await tasks.phone_rate_limiter.acquire(phone_id)
+    client = get_graph_client()
+    response = await client.post(API_URL, headers=API_HEADERS, json=data)
 
     if response.status_code == 200:
         print(f"Message sent successfully to {customer_phone}")
@@ -200,7 +200,8 @@ async def handle_woocommerce_webhook(request: Request, db: AsyncSession = Depend
     try:
         
         payload = await request.json()
-        await send_order_confirmation_message(payload,user.PAccessToken,user.Phone_id,db,user.id)
+        # Sent by a worker from the transactional queue, not inline in the webhook
+        tasks.send_order_confirmation.send(payload, user.id)
     except Exception as e:
         return {"error": "Invalid JSON", "detail": str(e)}
 
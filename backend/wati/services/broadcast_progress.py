@@ -0,0 +1,172 @@
+"""
+Live Broadcast Progress
+Workers keep per-broadcast counters in Redis and publish throttled progress
+events; the API process relays them to the owning user's WebSocket and serves
+them from GET /broadcast/{id}/progress without touching Postgres.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Optional
+
+PROGRESS_CHANNEL = "broadcast:progress"
+
+# At most one progress event per broadcast per interval, across all workers
+PROGRESS_PUBLISH_INTERVAL_MS = int(os.getenv("BROADCAST_PROGRESS_INTERVAL_MS", "1000"))
+
+# Counters are kept for a day after the (possibly scheduled) broadcast starts
+PROGRESS_TTL_SECONDS = 86400
+
+COUNTER_FIELDS = ("total", "sent", "failed", "in_flight")
+
+
+def _progress_key(broadcast_id) -> str:
+    return f"broadcast:{broadcast_id}:progress"
+
+
+def _tick_key(broadcast_id) -> str:
+    return f"broadcast:{broadcast_id}:progress_tick"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class BroadcastProgress:
+    """
+    Redis-backed progress counters per broadcast (sent, failed, in-flight).
+
+    All methods are best effort: progress is informational, so Redis errors are
+    logged and never fail a send.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def start(self, broadcast_id: int, user_id: int, total: int, delay_seconds: float = 0):
+        """Initialise the counters when a broadcast is enqueued."""
+        key = _progress_key(broadcast_id)
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hset(key, mapping={
+                "user_id": user_id,
+                "total": total,
+                "sent": 0,
+                "failed": 0,
+                "in_flight": 0,
+                "status": "Scheduled" if delay_seconds > 0 else "processing...",
+            })
+            pipe.expire(key, int(delay_seconds) + PROGRESS_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Could not initialise progress for broadcast {broadcast_id}: {e}")
+
+    def add_in_flight(self, broadcast_id: int, count: int):
+        """Count a batch as in flight; the first batch also stamps the start time."""
+        key = _progress_key(broadcast_id)
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hincrby(key, "in_flight", count)
+            pipe.hsetnx(key, "started_at", time.time())
+            pipe.hset(key, "status", "processing...")
+            pipe.expire(key, PROGRESS_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Could not update progress for broadcast {broadcast_id}: {e}")
+
+    def record(self, broadcast_id: int, sent: int, failed: int, in_flight: bool = True):
+        """
+        Move a finished batch from in-flight to sent/failed and publish (throttled).
+        in_flight=False counts recipients that were never sent, such as those of a
+        chunk given up, without taking them off the in-flight count.
+        """
+        key = _progress_key(broadcast_id)
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.hincrby(key, "sent", sent)
+            pipe.hincrby(key, "failed", failed)
+            if in_flight:
+                pipe.hincrby(key, "in_flight", -(sent + failed))
+            pipe.expire(key, PROGRESS_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logging.warning(f"Could not update progress for broadcast {broadcast_id}: {e}")
+            return
+        self.publish(broadcast_id)
+
+    def finish(self, broadcast_id: int, status: str):
+        """Record the final status and always publish it."""
+        key = _progress_key(broadcast_id)
+        try:
+            self.redis_client.hset(key, mapping={"status": status, "in_flight": 0})
+        except Exception as e:
+            logging.warning(f"Could not update progress for broadcast {broadcast_id}: {e}")
+            return
+        self.publish(broadcast_id, force=True)
+
+    def publish(self, broadcast_id: int, force: bool = False):
+        """Publish a progress event, at most once per interval unless forced."""
+        try:
+            if not force and not self.redis_client.set(
+                _tick_key(broadcast_id), 1, nx=True, px=PROGRESS_PUBLISH_INTERVAL_MS
+            ):
+                return
+            progress = self.snapshot(broadcast_id)
+            if progress:
+                self.redis_client.publish(PROGRESS_CHANNEL, json.dumps(progress))
+        except Exception as e:
+            logging.warning(f"Could not publish progress for broadcast {broadcast_id}: {e}")
+
+    def snapshot(self, broadcast_id: int) -> Optional[dict]:
+        """Current counters plus send rate and ETA, or None if none are recorded."""
+        raw = self.redis_client.hgetall(_progress_key(broadcast_id))
+        if not raw:
+            return None
+        fields = {_decode(k): _decode(v) for k, v in raw.items()}
+
+        progress = {"broadcast_id": broadcast_id, "user_id": int(fields.get("user_id", 0))}
+        for name in COUNTER_FIELDS:
+            progress[name] = max(0, int(fields.get(name, 0)))
+        progress["status"] = fields.get("status")
+
+        done = progress["sent"] + progress["failed"]
+        progress["remaining"] = max(0, progress["total"] - done)
+
+        rate = None
+        eta_seconds = None
+        if fields.get("started_at") and done:
+            elapsed = max(time.time() - float(fields["started_at"]), 0.001)
+            rate = done / elapsed
+            eta_seconds = round(progress["remaining"] / rate)
+        progress["rate"] = round(rate, 1) if rate else None
+        progress["eta_seconds"] = eta_seconds
+        return progress
+
+
+async def forward_progress_events(async_redis_client, manager):
+    """
+    Relay progress events published by the workers to the owning user's
+    WebSocket. Runs for the lifetime of the API process.
+    """
+    while True:
+        pubsub = async_redis_client.pubsub()
+        try:
+            await pubsub.subscribe(PROGRESS_CHANNEL)
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                progress = json.loads(message["data"])
+                await manager.send_to_user(progress["user_id"], {"type": "broadcast_progress", "data": progress})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Broadcast progress subscription lost, reconnecting: {e}")
+            await asyncio.sleep(5)
+        finally:
+            try:
+                await pubsub.close()
+            except Exception:
+                pass
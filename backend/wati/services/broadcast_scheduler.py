@@ -0,0 +1,210 @@
+"""
+Broadcast Scheduler
+Scheduled broadcasts live only in Postgres (BroadcastList.scheduled_time plus a
+ScheduledBroadcast row) until they are due. One leader-elected sweeper in the
+API processes claims due rows in small batches and enqueues their chunks just in
+time, so Redis holds no delayed messages however many broadcasts are scheduled.
+
+A due row is first claimed (Scheduled -> Enqueuing) in its own transaction, then
+its chunks are enqueued. A per-broadcast high-water mark in Redis records the
+chunks already enqueued, so a sweep that retries a partly enqueued broadcast
+only enqueues the rest.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..database import database
+from ..models import BroadcastList, BroadcastRecipient, ScheduledBroadcast, User
+from .graph_client import graph_url
+from . import tasks
+
+# How often the leader sweeps, and how far ahead of scheduled_time it enqueues
+# (the remainder is a short Dramatiq delay, at most one sweep interval)
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv("BROADCAST_SCHEDULER_INTERVAL_SECONDS", "15"))
+SCHEDULER_LOOKAHEAD_SECONDS = int(os.getenv("BROADCAST_SCHEDULER_LOOKAHEAD_SECONDS", str(SCHEDULER_INTERVAL_SECONDS)))
+
+# Due broadcasts claimed per transaction
+SCHEDULER_CLAIM_BATCH = int(os.getenv("BROADCAST_SCHEDULER_CLAIM_BATCH", "20"))
+
+# A claimed row still Enqueuing after this long was left by a sweeper that
+# died mid-enqueue, and is claimed again
+SCHEDULER_CLAIM_STALE_SECONDS = int(os.getenv("BROADCAST_SCHEDULER_CLAIM_STALE_SECONDS", "300"))
+
+CLAIMED_STATUS = "Enqueuing"
+
+LEADER_KEY = "broadcast_scheduler:leader"
+LEADER_TTL_SECONDS = SCHEDULER_INTERVAL_SECONDS * 3
+
+# Take the lease if it is free, or extend it if we already hold it
+ACQUIRE_LEADER_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    return 1
+end
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEADER_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class SchedulerLeader:
+    """
+    Redis lease electing the one API process that sweeps. The lease expires if
+    its holder dies, and another process takes over on its next sweep.
+    """
+
+    def __init__(self, async_redis_client, key: str = LEADER_KEY, ttl_seconds: int = LEADER_TTL_SECONDS):
+        self.redis_client = async_redis_client
+        self.key = key
+        self.ttl_seconds = ttl_seconds
+        self.instance_id = uuid.uuid4().hex
+
+    async def acquire(self) -> bool:
+        try:
+            return bool(await self.redis_client.eval(
+                ACQUIRE_LEADER_SCRIPT, 1, self.key, self.instance_id, self.ttl_seconds
+            ))
+        except Exception as e:
+            logging.warning(f"Broadcast scheduler could not reach Redis for the leader lease: {e}")
+            return False
+
+    async def release(self):
+        try:
+            await self.redis_client.eval(RELEASE_LEADER_SCRIPT, 1, self.key, self.instance_id)
+        except Exception as e:
+            logging.warning(f"Broadcast scheduler could not release the leader lease: {e}")
+
+
+leader = SchedulerLeader(tasks.async_redis_client)
+
+
+async def enqueue_scheduled_broadcast(db: AsyncSession, broadcast_list: BroadcastList,
+                                      scheduled: ScheduledBroadcast, owner: User, now: datetime) -> str:
+    """
+    Enqueue the chunks of a due broadcast not enqueued yet; returns the first
+    message id, or None if every chunk had already been enqueued.
+    """
+    total = (await db.execute(
+        select(func.count()).select_from(BroadcastRecipient).where(
+            BroadcastRecipient.broadcast_id == broadcast_list.id
+        )
+    )).scalar_one()
+
+    delay_seconds = max(0.0, (broadcast_list.scheduled_time - now).total_seconds())
+    API_url = graph_url(f"{owner.Phone_id}/messages")
+    headers = {
+        "Authorization": f"Bearer {owner.PAccessToken}",
+        "Content-Type": "application/json"
+    }
+
+    chunks = tasks.chunk_ranges(total)
+    enqueued = await asyncio.to_thread(tasks.chunks_enqueued, broadcast_list.id)
+    if enqueued == 0:
+        await asyncio.to_thread(tasks.register_broadcast_chunks, broadcast_list.id, len(chunks), delay_seconds=delay_seconds)
+        await asyncio.to_thread(
+            tasks.broadcast_progress.start, broadcast_list.id, owner.id, total, delay_seconds=delay_seconds
+        )
+
+    message_ids = []
+    for chunk_index, recipient_range in enumerate(chunks):
+        if chunk_index < enqueued:
+            continue
+        message = tasks.send_broadcast.send_with_options(
+            args=[broadcast_list.template, scheduled.template_data, None, broadcast_list.id, API_url, headers,
+                  owner.id, scheduled.image_id, scheduled.body_parameters, owner.Phone_id, chunk_index, recipient_range],
+            delay=int(delay_seconds * 1000),
+        )
+        await asyncio.to_thread(tasks.mark_chunks_enqueued, broadcast_list.id, chunk_index + 1, delay_seconds=delay_seconds)
+        message_ids.append(message.message_id)
+    return message_ids[0] if message_ids else None
+
+
+async def claim_due_broadcasts(db: AsyncSession, now: datetime) -> int:
+    """
+    Claim one batch of due broadcasts and enqueue them.
+
+    The rows are marked Enqueuing and committed before anything is enqueued,
+    so an overlapping sweep skips them; rows locked by another sweeper are
+    skipped too. A row whose enqueue fails goes back to Scheduled, and the
+    next sweep enqueues only its remaining chunks.
+    """
+    horizon = now + timedelta(seconds=SCHEDULER_LOOKAHEAD_SECONDS)
+    stale_before = func.now() - timedelta(seconds=SCHEDULER_CLAIM_STALE_SECONDS)
+    result = await db.execute(
+        select(BroadcastList, ScheduledBroadcast, User)
+        .join(ScheduledBroadcast, ScheduledBroadcast.broadcast_id == BroadcastList.id)
+        .join(User, User.id == BroadcastList.user_id)
+        .where(or_(
+            and_(BroadcastList.status == "Scheduled", BroadcastList.scheduled_time <= horizon),
+            and_(BroadcastList.status == CLAIMED_STATUS, BroadcastList.updated_at < stale_before),
+        ))
+        .order_by(BroadcastList.scheduled_time)
+        .limit(SCHEDULER_CLAIM_BATCH)
+        .with_for_update(skip_locked=True, of=BroadcastList)
+    )
+    rows = result.all()
+    if not rows:
+        return 0
+
+    for broadcast_list, _, _ in rows:
+        broadcast_list.status = CLAIMED_STATUS
+    await db.commit()
+
+    claimed = 0
+    for broadcast_list, scheduled, owner in rows:
+        try:
+            task_id = await enqueue_scheduled_broadcast(db, broadcast_list, scheduled, owner, now)
+        except Exception as e:
+            # Chunks enqueued so far are recorded; the next sweep enqueues the rest
+            logging.error(f"Could not enqueue scheduled broadcast {broadcast_list.id}: {e}")
+            await _set_claimed_status(db, broadcast_list.id, "Scheduled")
+            continue
+        await _set_claimed_status(db, broadcast_list.id, "processing...", task_id)
+        claimed += 1
+    return claimed
+
+
+async def _set_claimed_status(db: AsyncSession, broadcast_id: int, status: str, task_id: str = None):
+    """Move a claimed row on, unless it was cancelled meanwhile."""
+    values = {"status": status}
+    if task_id:
+        values["task_id"] = task_id
+    await db.execute(
+        update(BroadcastList)
+        .where(BroadcastList.id == broadcast_id, BroadcastList.status == CLAIMED_STATUS)
+        .values(**values)
+    )
+    await db.commit()
+
+
+async def sweep_scheduled_broadcasts() -> None:
+    """Scheduler job: enqueue broadcasts due before the next sweep, on the leader only."""
+    if not await leader.acquire():
+        return
+    try:
+        async for db in database.get_db():
+            total = 0
+            while True:
+                claimed = await claim_due_broadcasts(db, datetime.utcnow())
+                total += claimed
+                if claimed < SCHEDULER_CLAIM_BATCH:
+                    break
+            if total:
+                print(f"Enqueued {total} scheduled broadcasts.")
+            break
+    except Exception as e:
+        print(f"Error in sweep_scheduled_broadcasts: {e}")
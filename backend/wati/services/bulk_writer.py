@@ -0,0 +1,71 @@
+"""
+Bulk Row Writer
+Buffers rows for the send paths (BroadcastAnalysis, Conversation) and writes
+them with multi-row INSERT ... VALUES statements instead of one ORM object each.
+"""
+import os
+import time
+import logging
+from typing import Dict, List
+
+from sqlalchemy import insert, Table
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Rows buffered per table before they are written
+BULK_WRITE_CHUNK_SIZE = int(os.getenv("BULK_WRITE_CHUNK_SIZE", "1000"))
+
+# asyncpg allows 32767 bind parameters per statement
+MAX_BIND_PARAMS = 30000
+
+
+class BulkWriter:
+    """
+    Buffers plain row dicts per table and flushes them in chunks.
+
+    Rows go through Core `insert()`, so no ORM objects are created and nothing
+    is tracked in the session's identity map. Flushing only executes the
+    INSERTs; committing stays with the caller so other writes (counters,
+    checkpoints) can share the transaction.
+    """
+
+    def __init__(self, db: AsyncSession, chunk_size: int = BULK_WRITE_CHUNK_SIZE):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.buffers: Dict[Table, List[dict]] = {}
+        self.rows_written = 0
+        self.flush_seconds = 0.0
+
+    async def add(self, model, **values):
+        """Buffer one row for `model`, writing the buffer out once it is full."""
+        table = model.__table__
+        rows = self.buffers.setdefault(table, [])
+        rows.append(values)
+        if len(rows) >= self.chunk_size:
+            await self._flush_table(table)
+
+    async def flush(self):
+        """Write every buffered row."""
+        for table in list(self.buffers):
+            await self._flush_table(table)
+
+    async def _flush_table(self, table: Table):
+        rows = self.buffers.get(table)
+        if not rows:
+            return
+        self.buffers[table] = []
+
+        # Multi-row VALUES needs the same columns in every row
+        columns = []
+        for row in rows:
+            for column in row:
+                if column not in columns:
+                    columns.append(column)
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+
+        started = time.perf_counter()
+        rows_per_statement = max(1, MAX_BIND_PARAMS // len(columns))
+        for start in range(0, len(rows), rows_per_statement):
+            await self.db.execute(insert(table).values(rows[start:start + rows_per_statement]))
+        self.flush_seconds += time.perf_counter() - started
+        self.rows_written += len(rows)
+        logging.info(f"Bulk inserted {len(rows)} rows into {table.name}")
@@ -0,0 +1,44 @@
+"""
+Active Conversations Events
+The active-conversations WebSocket sends one snapshot on connect and then
+single-row deltas, each carrying a per-user version:
+
+    {"type": "initial", "version": 41, "data": [chat, ...]}
+    {"type": "upsert",  "version": 42, "data": chat}
+    {"type": "remove",  "version": 43, "data": {"id": ...}}
+
+A client that sees a version other than last + 1 (or a null version) sends
+{"type": "resync"} and gets a fresh "initial" snapshot.
+"""
+import logging
+from typing import Optional
+
+from . import tasks
+from .websocket_manager import manager
+
+
+def _version_key(user_id) -> str:
+    return f"ws:active_conversations:{user_id}:version"
+
+
+async def current_version(user_id: int) -> Optional[int]:
+    """Version a snapshot taken now corresponds to (None if Redis is unavailable)."""
+    try:
+        return int(await tasks.async_redis_client.get(_version_key(user_id)) or 0)
+    except Exception as e:
+        logging.warning(f"Could not read active conversations version of user {user_id}: {e}")
+        return None
+
+
+async def publish_active_conversation_change(user_id: int, change_type: str, chat: dict):
+    """Send one upsert/remove delta to the user's active-conversations socket."""
+    try:
+        version = await tasks.async_redis_client.incr(_version_key(user_id))
+    except Exception as e:
+        # A null version makes the client resync instead of missing the change
+        logging.warning(f"Could not bump active conversations version of user {user_id}: {e}")
+        version = None
+    await manager.broadcast_active_conversations_update(
+        user_id,
+        {"type": change_type, "version": version, "data": chat}
+    )
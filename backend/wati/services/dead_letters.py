@@ -0,0 +1,93 @@
+"""
+Broadcast Dead Letters
+Sends that still failed transiently after every retry are parked in Redis,
+one hash per user, so they can be inspected and replayed in bulk.
+
+Each user keeps at most DEAD_LETTER_MAX_PER_USER entries for at most
+DEAD_LETTER_TTL_SECONDS; older entries are trimmed whenever new ones are added.
+"""
+import os
+import json
+import time
+import uuid
+from typing import List, Optional
+
+DEAD_LETTER_MAX_PER_USER = int(os.getenv("DEAD_LETTER_MAX_PER_USER", "10000"))
+DEAD_LETTER_TTL_SECONDS = int(os.getenv("DEAD_LETTER_TTL_SECONDS", str(14 * 86400)))
+
+
+def _dead_letter_key(user_id) -> str:
+    return f"deadletter:user:{user_id}"
+
+
+def _dead_letter_index_key(user_id) -> str:
+    # Entry ids by failed_at, to find the oldest entries to trim
+    return f"deadletter:user:{user_id}:index"
+
+
+class DeadLetterStore:
+    """
+    Dead-lettered sends per user. Each entry keeps the rendered payload, so a
+    replay sends exactly what was attempted; the access token is not stored
+    and is looked up again at replay time.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def add(self, user_id: int, entries: List[dict]):
+        """Park entries (broadcast_id, phone_id, recipient, payload, error_reason, attempts, ...)."""
+        if not entries:
+            return
+        now = time.time()
+        self.put_back(user_id, [dict(entry, id=uuid.uuid4().hex, failed_at=now) for entry in entries])
+
+    def put_back(self, user_id: int, entries: List[dict]):
+        """Park entries again as they were returned by take(), keeping their id and failed_at."""
+        if not entries:
+            return
+        key = _dead_letter_key(user_id)
+        index_key = _dead_letter_index_key(user_id)
+        pipe = self.redis_client.pipeline()
+        pipe.hset(key, mapping={entry["id"]: json.dumps(entry) for entry in entries})
+        pipe.zadd(index_key, {entry["id"]: entry["failed_at"] for entry in entries})
+        pipe.expire(key, DEAD_LETTER_TTL_SECONDS)
+        pipe.expire(index_key, DEAD_LETTER_TTL_SECONDS)
+        pipe.execute()
+        self._trim(user_id)
+
+    def _trim(self, user_id: int):
+        """Drop entries older than DEAD_LETTER_TTL_SECONDS and beyond the newest DEAD_LETTER_MAX_PER_USER."""
+        index_key = _dead_letter_index_key(user_id)
+        pipe = self.redis_client.pipeline()
+        pipe.zrangebyscore(index_key, "-inf", time.time() - DEAD_LETTER_TTL_SECONDS)
+        pipe.zrange(index_key, 0, -(DEAD_LETTER_MAX_PER_USER + 1))
+        expired, overflow = pipe.execute()
+        stale = set(expired) | set(overflow)
+        if not stale:
+            return
+        pipe = self.redis_client.pipeline()
+        pipe.hdel(_dead_letter_key(user_id), *stale)
+        pipe.zrem(index_key, *stale)
+        pipe.execute()
+
+    def list(self, user_id: int, broadcast_id: Optional[int] = None) -> List[dict]:
+        entries = [json.loads(raw) for raw in self.redis_client.hvals(_dead_letter_key(user_id))]
+        if broadcast_id is not None:
+            entries = [entry for entry in entries if entry["broadcast_id"] == broadcast_id]
+        return sorted(entries, key=lambda entry: entry["failed_at"])
+
+    def take(self, user_id: int, broadcast_id: Optional[int] = None) -> List[dict]:
+        """
+        Remove and return entries for replay. An entry is only returned to the
+        caller whose HDEL removed it, so concurrent replays never double-send.
+        """
+        entries = self.list(user_id, broadcast_id)
+        if not entries:
+            return []
+        pipe = self.redis_client.pipeline()
+        for entry in entries:
+            pipe.hdel(_dead_letter_key(user_id), entry["id"])
+        pipe.zrem(_dead_letter_index_key(user_id), *[entry["id"] for entry in entries])
+        removed = pipe.execute()[:-1]
+        return [entry for entry, deleted in zip(entries, removed) if deleted]
@@ -1,14 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends
-from dramatiq import Message
 from ..models import Broadcast
 from ..Schemas import broadcast, user
 from ..oauth2 import get_current_user
-from .tasks import send_broadcast
+from .tasks import store_broadcast_recipients
 from datetime import datetime
-from dramatiq import Message
 from ..database import database
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
 
 router = APIRouter()
 
@@ -26,10 +23,7 @@ async def schedule_template_message(
     # Get current time in UTC (timezone-naive)
     now = datetime.utcnow()
 
-    # Calculate delay in seconds
-    delay = (scheduled_datetime - now).total_seconds()
-
-    if delay < 0:
+    if scheduled_datetime <= now:
         raise HTTPException(status_code=400, detail="Scheduled time must be in the future.")
 
     # Create a new broadcast list entry
@@ -52,35 +46,21 @@ async def schedule_template_message(
 
     saved_broadcast_id = broadcast_list.id
 
-    # API details
-    API_url = f"https://graph.facebook.com/v20.0/{get_current_user.Phone_id}/messages"
-    headers = {
-        "Authorization": f"Bearer {get_current_user.PAccessToken}",
-        "Content-Type": "application/json"
-    }
-
-    # Schedule the task with the calculated delay
-    task: Message = send_broadcast.send_with_options(
-        args=[request.template, request.template_data, contacts, saved_broadcast_id, API_url, headers, get_current_user.id, request.image_id, request.body_parameters,get_current_user.Phone_id],
-        delay=delay * 1000  # delay in milliseconds
-    )
-
-    # Update the broadcast list entry with the task ID asynchronously
-    result = await db.execute(
-        select(Broadcast.BroadcastList).filter(Broadcast.BroadcastList.id == saved_broadcast_id)
-    )
-    broadcast_log_task_id = result.scalars().first()
-
-    if not broadcast_log_task_id:
-        raise HTTPException(status_code=404, detail="Broadcast not found")
-
-    broadcast_log_task_id.task_id = task.message_id
-    db.add(broadcast_log_task_id)
+    # Store the recipients and send parameters; nothing is queued in Redis yet.
+    # The broadcast scheduler enqueues the chunks just before scheduled_time.
+    await store_broadcast_recipients(db, saved_broadcast_id, contacts)
+    db.add(Broadcast.ScheduledBroadcast(
+        broadcast_id=saved_broadcast_id,
+        template_data=request.template_data,
+        image_id=request.image_id,
+        body_parameters=request.body_parameters,
+    ))
     await db.commit()
-    await db.refresh(broadcast_log_task_id)
 
     # Return success message
     return {
         "message": f"Message {saved_broadcast_id} scheduled to be sent at {request.scheduled_time}.",
-        "task_id": task.message_id
+        "broadcast_id": saved_broadcast_id,
+        # No message is queued until the scheduler picks the broadcast up; kept for existing clients
+        "task_id": saved_broadcast_id
     }
@@ -0,0 +1,108 @@
+"""
+Shared Graph API Client
+One long-lived httpx.AsyncClient per process for calls to graph.facebook.com,
+so sends reuse pooled (HTTP/2 when available) connections instead of paying a
+TLS handshake per actor invocation or request.
+"""
+import os
+import logging
+from typing import Optional
+
+import httpx
+from dramatiq import Middleware
+
+GRAPH_API_BASE_URL = os.getenv("GRAPH_API_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_API_VERSION = os.getenv("GRAPH_API_VERSION", "v20.0")
+
+# Connection caps. The client only talks to the Graph API host, so the pool
+# limits are effectively per-host limits. With HTTP/2 each connection
+# multiplexes many concurrent sends.
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "20"))
+GRAPH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GRAPH_MAX_KEEPALIVE_CONNECTIONS", "10"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "120"))
+GRAPH_TIMEOUT_SECONDS = float(os.getenv("GRAPH_TIMEOUT_SECONDS", "30"))
+GRAPH_HTTP2 = os.getenv("GRAPH_HTTP2", "true").lower() == "true"
+
+try:
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def graph_url(path: str) -> str:
+    """Absolute Graph API URL for a path such as f"{phone_id}/messages"."""
+    return f"{GRAPH_API_BASE_URL}/{GRAPH_API_VERSION}/{path.lstrip('/')}"
+
+
+def create_graph_client() -> httpx.AsyncClient:
+    http2 = GRAPH_HTTP2 and HTTP2_AVAILABLE
+    if GRAPH_HTTP2 and not HTTP2_AVAILABLE:
+        logging.warning("h2 is not installed, Graph API client falls back to HTTP/1.1")
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(GRAPH_TIMEOUT_SECONDS, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=GRAPH_MAX_CONNECTIONS,
+            max_keepalive_connections=GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def get_graph_client() -> httpx.AsyncClient:
+    """
+    The process-wide Graph API client, created on first use.
+
+    Must be used from the process's event loop (the Dramatiq AsyncIO loop in
+    workers, the server loop in the API). Do not close it after use.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_graph_client()
+    return _client
+
+
+async def warm_up_graph_client():
+    """Open a pooled connection to the Graph API ahead of the first send."""
+    client = get_graph_client()
+    try:
+        response = await client.head(GRAPH_API_BASE_URL, timeout=5.0)
+        logging.info(f"Graph API client warmed up ({response.http_version})")
+    except httpx.HTTPError as e:
+        logging.warning(f"Graph API warm-up failed, connecting on first send instead: {e}")
+
+
+async def close_graph_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+class GraphClientMiddleware(Middleware):
+    """
+    Creates and warms up the shared Graph API client when a Dramatiq worker
+    boots, and closes it on shutdown. Must be added after AsyncIO(), which
+    owns the event loop the client is bound to.
+
+    The client is closed in after_worker_shutdown: by then the worker threads
+    have finished their in-flight sends, and after_* hooks run in reverse
+    order, so this runs before AsyncIO stops the event loop.
+    """
+
+    def after_worker_boot(self, broker, worker):
+        from dramatiq.asyncio import get_event_loop_thread
+
+        event_loop_thread = get_event_loop_thread()
+        if event_loop_thread is not None:
+            event_loop_thread.run_coroutine(warm_up_graph_client())
+
+    def after_worker_shutdown(self, broker, worker):
+        from dramatiq.asyncio import get_event_loop_thread
+
+        event_loop_thread = get_event_loop_thread()
+        if event_loop_thread is not None:
+            event_loop_thread.run_coroutine(close_graph_client())
@@ -0,0 +1,108 @@
+"""
+Compiled Template Payload Plans
+Builds the WhatsApp template payload once per broadcast: the invariant JSON is
+serialized up front and only the per-recipient values are spliced in per send.
+"""
+import json
+from operator import itemgetter
+from typing import Callable, List, Optional
+
+# Parameter keys that resolve to a field of the recipient record.
+# Anything else renders as an empty string, as the send loops always did.
+PARAMETER_FIELDS = {
+    "Name": "name",
+    "billing.first_name": "name",
+}
+
+_SLOT = "__wotnot_slot_{}__"
+
+
+def _constant(value: str) -> Callable:
+    return lambda recipient: value
+
+
+def compile_accessor(key: str) -> Callable:
+    """Compile a template parameter key to a direct accessor on the recipient record."""
+    field = PARAMETER_FIELDS.get(key)
+    return itemgetter(field) if field else _constant("")
+
+
+def _encode(value) -> bytes:
+    return json.dumps("" if value is None else str(value), ensure_ascii=False).encode("utf-8")
+
+
+class PayloadPlan:
+    """
+    A template message payload with holes for `to` and the body parameter values.
+
+    Use `compile_payload_plan()` to build one; `render(recipient)` returns the
+    request body as JSON bytes.
+    """
+
+    def __init__(self, segments: List[bytes], accessors: List[Callable]):
+        self.segments = segments
+        self.accessors = accessors
+
+    def render(self, recipient) -> bytes:
+        parts = [self.segments[0]]
+        for accessor, segment in zip(self.accessors, self.segments[1:]):
+            parts.append(_encode(accessor(recipient)))
+            parts.append(segment)
+        return b"".join(parts)
+
+
+def compile_payload_plan(
+    template_name: str,
+    language: str,
+    image_id: Optional[str] = None,
+    parameter_keys: Optional[List[str]] = None,
+    to_field: str = "phone",
+) -> PayloadPlan:
+    """
+    Compile a template send into a PayloadPlan.
+
+    Args:
+        template_name: approved WhatsApp template name.
+        language: template language code.
+        image_id: media id for an image header, if any.
+        parameter_keys: body parameter keys (e.g. "Name", "billing.first_name").
+            None sends no body component; [] sends a body with no parameters.
+        to_field: recipient field holding the phone number.
+    """
+    accessors = [itemgetter(to_field)]
+    template = {
+        "name": template_name,
+        "language": {"code": language},
+    }
+
+    components = []
+    if image_id:
+        components.append({
+            "type": "header",
+            "parameters": [{"type": "image", "image": {"id": image_id}}]
+        })
+    if parameter_keys is not None:
+        body_params = []
+        for key in parameter_keys:
+            body_params.append({"type": "text", "text": _SLOT.format(len(accessors))})
+            accessors.append(compile_accessor(key))
+        components.append({"type": "body", "parameters": body_params})
+    if components:
+        template["components"] = components
+
+    data = {
+        "messaging_product": "whatsapp",
+        "to": _SLOT.format(0),
+        "type": "template",
+        "template": template,
+    }
+
+    # Serialize once, then cut the JSON at each slot (including its quotes)
+    serialized = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    segments = []
+    for index in range(len(accessors)):
+        head, serialized = serialized.split(json.dumps(_SLOT.format(index)), 1)
+        segments.append(head.encode("utf-8"))
+    segments.append(serialized.encode("utf-8"))
+
+    return PayloadPlan(segments, accessors)
@@ -0,0 +1,191 @@
+"""
+Cluster-wide WhatsApp Send Rate Limiter
+A Redis token bucket keyed by Phone_id, shared by every worker and API process
+so that concurrent senders from the same number stay within Meta's limits.
+"""
+import os
+import asyncio
+import logging
+
+from .sender import get_target_rate, MIN_SEND_RATE, THROTTLE_COOLDOWN_SECONDS
+
+# Tokens a number may accumulate while idle (defaults to one second of traffic)
+DEFAULT_SEND_BURST = os.getenv("WHATSAPP_SEND_BURST")
+
+# Share of a number's rate bulk traffic (broadcasts) may use; the rest is kept
+# free for transactional sends such as order confirmations and chat replies
+BULK_RATE_SHARE = float(os.getenv("WHATSAPP_BULK_RATE_SHARE", "0.8"))
+
+# The rate a number is currently allowed, adapted to Meta throttling, is kept
+# in Redis next to its buckets so every process slows down together. After
+# this long without throttling or sends it falls back to the configured rate.
+ADAPTIVE_RATE_TTL_MS = 3600 * 1000
+
+# Atomically refill the bucket and reserve `requested` tokens.
+# The bucket may go into debt: the caller is told how long to wait for its
+# reserved slot instead of polling, which keeps callers in FIFO order.
+#
+# The bucket refills at the adapted rate (KEYS[2] 'rate', at most the target)
+# times `share`. Reservations from the shared bucket (share 1) raise an adapted
+# rate back towards the target: about 1 msg/s for every `rate` sends.
+#
+# KEYS[1] - bucket key, KEYS[2] - adapted rate key
+# ARGV[1] - target rate (tokens/second), ARGV[2] - burst, ARGV[3] - tokens requested,
+# ARGV[4] - share of the rate this bucket refills at, ARGV[5] - adapted rate TTL (ms)
+# Returns the wait in milliseconds before the reserved tokens may be used.
+TOKEN_BUCKET_SCRIPT = """
+local target = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local share = tonumber(ARGV[4])
+
+local adapted = math.min(target, tonumber(redis.call('HGET', KEYS[2], 'rate')) or target)
+local rate = adapted * share
+burst = math.max(1, burst * adapted / target)
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000) - requested
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) * 1000 / rate) + 1000)
+
+if share >= 1 and adapted < target then
+    local raised = math.min(target, adapted + requested / adapted)
+    if raised >= target then
+        redis.call('HDEL', KEYS[2], 'rate')
+    else
+        redis.call('HSET', KEYS[2], 'rate', tostring(raised))
+        redis.call('PEXPIRE', KEYS[2], ARGV[5])
+    end
+end
+
+if tokens >= 0 then
+    return 0
+end
+return math.ceil(-tokens * 1000 / rate)
+"""
+
+# Halve a number's adapted rate (not below the minimum) after Meta throttling.
+# Throttling reported within the cooldown of the last one counts as the same
+# event, however many requests in flight, in however many processes, report it.
+#
+# KEYS[1] - adapted rate key
+# ARGV[1] - target rate, ARGV[2] - minimum rate, ARGV[3] - cooldown (ms), ARGV[4] - TTL (ms)
+# Returns {adapted rate as a string, 1 if this call lowered it else 0}.
+THROTTLE_SCRIPT = """
+local target = tonumber(ARGV[1])
+local min_rate = tonumber(ARGV[2])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'rate', 'throttled_at')
+local rate = math.min(target, tonumber(state[1]) or target)
+if now - (tonumber(state[2]) or 0) < tonumber(ARGV[3]) then
+    return {tostring(rate), 0}
+end
+
+rate = math.max(min_rate, rate / 2)
+redis.call('HSET', KEYS[1], 'rate', tostring(rate), 'throttled_at', now)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {tostring(rate), 1}
+"""
+
+
+class PhoneRateLimiter:
+    """
+    Token bucket per WhatsApp phone number, stored in Redis.
+
+    Rates come from WHATSAPP_SEND_RATE / WHATSAPP_SEND_RATE_OVERRIDES (see
+    services/sender.py); burst from WHATSAPP_SEND_BURST. Meta throttling seen
+    by any process halves the number's rate for all of them (on_throttled),
+    and sends raise it back towards the configured rate.
+
+    A bulk limiter first waits on a second, bulk-only bucket per number that
+    refills at BULK_RATE_SHARE of the rate, and only then reserves from the
+    shared bucket. Broadcasts therefore never hold more than that share of the
+    shared bucket, and transactional sends always find capacity.
+    """
+
+    def __init__(self, redis_client, burst: float = None, prefix: str = "ratelimit:phone", bulk: bool = False):
+        self.redis_client = redis_client
+        self.burst = burst
+        self.prefix = prefix
+        self.bulk = bulk
+        self.script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.throttle_script = redis_client.register_script(THROTTLE_SCRIPT)
+
+    def _rate_key(self, phone_id) -> str:
+        return f"{self.prefix}:{phone_id}:rate"
+
+    def reserve(self, phone_id, tokens: int = 1, bulk_bucket: bool = False) -> float:
+        """
+        Reserve send slots for a number (from its bulk-only bucket if `bulk_bucket`).
+
+        Returns:
+            float: seconds to wait before sending. 0 if Redis is unavailable,
+            in which case the per-process bucket in the sender engine still applies.
+        """
+        rate = get_target_rate(phone_id)
+        burst = self.burst or rate
+        share = 1
+        key = f"{self.prefix}:{phone_id}"
+        if bulk_bucket:
+            key += ":bulk"
+            share = BULK_RATE_SHARE
+            burst *= BULK_RATE_SHARE
+        try:
+            wait_ms = self.script(
+                keys=[key, self._rate_key(phone_id)],
+                args=[rate, burst, tokens, share, ADAPTIVE_RATE_TTL_MS]
+            )
+        except Exception as e:
+            logging.warning(f"Rate limiter unavailable for {phone_id}, continuing without it: {e}")
+            return 0
+        return int(wait_ms) / 1000
+
+    def throttled(self, phone_id):
+        """
+        Halve the number's cluster-wide rate after Meta throttling.
+
+        Returns:
+            tuple: (adapted rate, whether this call lowered it). (configured rate,
+            False) if Redis is unavailable.
+        """
+        rate = get_target_rate(phone_id)
+        try:
+            adapted, lowered = self.throttle_script(
+                keys=[self._rate_key(phone_id)],
+                args=[rate, MIN_SEND_RATE, int(THROTTLE_COOLDOWN_SECONDS * 1000), ADAPTIVE_RATE_TTL_MS]
+            )
+            return float(adapted), bool(lowered)
+        except Exception as e:
+            logging.warning(f"Could not lower the shared send rate of {phone_id}: {e}")
+            return rate, False
+
+    async def on_throttled(self, phone_id):
+        """Report Meta throttling of this phone number to every process."""
+        rate, lowered = await asyncio.to_thread(self.throttled, phone_id)
+        if lowered:
+            logging.warning(f"Meta throttling for {phone_id}: shared send rate lowered to {rate:.1f} msg/s")
+
+    async def acquire(self, phone_id, tokens: int = 1):
+        """Wait until `tokens` sends are allowed for this phone number."""
+        if self.bulk:
+            wait = await asyncio.to_thread(self.reserve, phone_id, tokens, True)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        wait = await asyncio.to_thread(self.reserve, phone_id, tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def create_phone_rate_limiter(redis_client, bulk: bool = False) -> PhoneRateLimiter:
+    burst = float(DEFAULT_SEND_BURST) if DEFAULT_SEND_BURST else None
+    return PhoneRateLimiter(redis_client, burst=burst, bulk=bulk)
@@ -0,0 +1,236 @@
+"""
+Broadcast Sender Engine
+Sends WhatsApp messages with a bounded number of requests in flight per sender
+phone number, paced by a token bucket whose rate adapts to Meta throttling.
+"""
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# Default send rate (messages/second) and in-flight requests per Phone_id.
+# Meta's default Cloud API throughput is 80 msg/sec per business number.
+DEFAULT_SEND_RATE = float(os.getenv("WHATSAPP_SEND_RATE", "80"))
+DEFAULT_SEND_CONCURRENCY = int(os.getenv("WHATSAPP_SEND_CONCURRENCY", "16"))
+MIN_SEND_RATE = float(os.getenv("WHATSAPP_MIN_SEND_RATE", "5"))
+
+# Meta error codes that mean "slow down" rather than "this message is bad"
+THROTTLE_ERROR_CODES = {4, 80007, 130429}
+MAX_THROTTLE_ATTEMPTS = 3
+
+# Meta error codes worth retrying later: rate limits plus temporary Graph errors
+# (1 unknown, 2 service, 17/341 app limits, 131000 generic, 131016 service
+# unavailable, 131056 pair rate limit, 133004 server unavailable)
+TRANSIENT_ERROR_CODES = THROTTLE_ERROR_CODES | {1, 2, 17, 341, 131000, 131016, 131056, 133004}
+# Throttling reported by requests already in flight counts as one event
+THROTTLE_COOLDOWN_SECONDS = 1.0
+
+
+def _parse_rate_overrides(raw: str) -> Dict[str, float]:
+    """
+    Parse per-number rate overrides, e.g. "1234567890:250,9876543210:40".
+    """
+    overrides = {}
+    for item in (raw or "").split(","):
+        if ":" not in item:
+            continue
+        phone_id, rate = item.split(":", 1)
+        try:
+            overrides[phone_id.strip()] = float(rate)
+        except ValueError:
+            logging.warning(f"Ignoring invalid send rate override: {item}")
+    return overrides
+
+
+SEND_RATE_OVERRIDES = _parse_rate_overrides(os.getenv("WHATSAPP_SEND_RATE_OVERRIDES", ""))
+
+
+def get_target_rate(phone_id) -> float:
+    """Configured send rate (msg/sec) for a sender phone number."""
+    return SEND_RATE_OVERRIDES.get(str(phone_id), DEFAULT_SEND_RATE)
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def set_rate(self, rate: float):
+        self._refill()
+        self.rate = rate
+        self.burst = max(1.0, rate)
+        self.tokens = min(self.tokens, self.burst)
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class SendResult:
+    """Outcome of one Graph API send."""
+    recipient: Any
+    status_code: Optional[int]
+    response_data: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == 200
+
+    @property
+    def wamid(self) -> Optional[str]:
+        return self.response_data["messages"][0]["id"] if self.ok else None
+
+    @property
+    def wa_id(self) -> Optional[str]:
+        return self.response_data["contacts"][0]["wa_id"] if self.ok else None
+
+    @property
+    def error_code(self):
+        return self.response_data.get("error", {}).get("code", "N/A")
+
+    @property
+    def error_reason(self) -> str:
+        error_detail = self.response_data.get("error", {}).get("message", "Unknown error")
+        return f"Error Code: {self.error_code}, Detail: {error_detail}"
+
+    @property
+    def throttled(self) -> bool:
+        return self.status_code == 429 or self.error_code in THROTTLE_ERROR_CODES
+
+    @property
+    def transient(self) -> bool:
+        """Failed for a reason that may go away: network errors, timeouts, 5xx, rate limits."""
+        if self.ok:
+            return False
+        if self.status_code is None or self.status_code >= 500 or self.status_code == 429:
+            return True
+        return self.error_code in TRANSIENT_ERROR_CODES
+
+
+class PhoneSender:
+    """
+    Per-Phone_id send state: concurrency limit plus an adaptive token bucket.
+
+    The rate is halved whenever Meta reports throttling and creeps back up
+    (additive increase) towards the configured target as sends succeed.
+    """
+
+    def __init__(self, phone_id, rate: float, concurrency: int):
+        self.phone_id = str(phone_id)
+        self.target_rate = rate
+        self.bucket = TokenBucket(rate)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.throttled_at = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def on_throttled(self):
+        now = time.monotonic()
+        if now - self.throttled_at < THROTTLE_COOLDOWN_SECONDS:
+            return
+        self.throttled_at = now
+        new_rate = max(MIN_SEND_RATE, self.bucket.rate / 2)
+        if new_rate < self.bucket.rate:
+            logging.warning(f"Meta throttling for {self.phone_id}: send rate {self.bucket.rate:.1f} -> {new_rate:.1f} msg/s")
+            self.bucket.set_rate(new_rate)
+
+    def on_success(self):
+        if self.bucket.rate < self.target_rate:
+            # Regain roughly 1 msg/s for every `rate` successful sends
+            self.bucket.set_rate(min(self.target_rate, self.bucket.rate + 1 / self.bucket.rate))
+
+    async def send(self, client: httpx.AsyncClient, api_url: str, headers: dict, recipient, payload, limiter=None) -> SendResult:
+        """
+        Send one message, waiting for a free in-flight slot, a local token and,
+        if given, a token from the cluster-wide limiter (services/rate_limiter.py).
+        """
+        attempt = 0
+        async with self.semaphore:
+            while True:
+                attempt += 1
+                await self.bucket.acquire()
+                if limiter is not None:
+                    await limiter.acquire(self.phone_id)
+                result = await _post(client, api_url, headers, recipient, payload)
+                if result.ok:
+                    self.on_success()
+                    return result
+                if not result.throttled:
+                    return result
+                self.on_throttled()
+                if limiter is not None:
+                    await limiter.on_throttled(self.phone_id)
+                if attempt >= MAX_THROTTLE_ATTEMPTS:
+                    return result
+
+
+async def _post(client: httpx.AsyncClient, api_url: str, headers: dict, recipient, payload) -> SendResult:
+    try:
+        if isinstance(payload, (bytes, bytearray)):
+            response = await client.post(api_url, headers=headers, content=payload)
+        else:
+            response = await client.post(api_url, headers=headers, json=payload)
+    except httpx.HTTPError as e:
+        return SendResult(recipient, None, {"error": {"code": "N/A", "message": f"{type(e).__name__}: {e}"}})
+
+    try:
+        response_data = response.json()
+    except ValueError:
+        response_data = {"error": {"code": response.status_code, "message": response.text[:200]}}
+    return SendResult(recipient, response.status_code, response_data)
+
+
+# One PhoneSender per phone number for the lifetime of the worker process,
+# so concurrent broadcasts from the same number share its budget.
+_senders: Dict[str, PhoneSender] = {}
+
+
+def get_phone_sender(phone_id) -> PhoneSender:
+    key = str(phone_id)
+    sender = _senders.get(key)
+    if sender is None:
+        sender = PhoneSender(key, get_target_rate(key), DEFAULT_SEND_CONCURRENCY)
+        _senders[key] = sender
+    return sender
+
+
+async def send_many(client: httpx.AsyncClient, phone_id, api_url: str, headers: dict, messages: List[tuple], limiter=None) -> List[SendResult]:
+    """
+    Send many messages from one phone number concurrently.
+
+    Args:
+        messages: list of (recipient, payload) tuples; payload is a dict or pre-serialized JSON bytes.
+        limiter: optional shared PhoneRateLimiter, so other processes sending from
+            the same number are accounted for.
+
+    Returns:
+        SendResult list in the same order as `messages`.
+    """
+    sender = get_phone_sender(phone_id)
+    return await asyncio.gather(*(
+        sender.send(client, api_url, headers, recipient, payload, limiter)
+        for recipient, payload in messages
+    ))
@@ -0,0 +1,223 @@
+"""
+Coalesced Delivery Status Updates
+Webhook status events (sent / delivered / read / failed) are merged per wamid,
+keeping the highest-ranked state, and applied to BroadcastAnalysis with one
+UPDATE ... FROM (VALUES ...) per batch instead of a SELECT and commit per event.
+
+Statuses for wamids without a BroadcastAnalysis row yet (the sender has not
+committed its batch) are parked in Redis and applied by the sender right after
+it commits the rows.
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import update, values, column, case, func, or_, false, String, Integer, Boolean
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models import Broadcast
+
+# A status only ever moves up this ranking, however its events are ordered or batched
+STATUS_RANK = {
+    "sent": 1,
+    "delivered": 2,
+    "read": 3,
+    "failed": 4,
+    "replied": 5,
+}
+
+# Rows are updated in statements of at most this many wamids
+STATUS_UPDATE_BATCH_SIZE = 1000
+
+
+def status_update_from_event(status: dict) -> Optional[dict]:
+    """The update for one webhook `statuses` entry, or None for an unknown status."""
+    message_status = status["status"]
+    rank = STATUS_RANK.get(message_status)
+    if rank is None:
+        return None
+
+    error_reason = None
+    if message_status == "failed" and status.get("errors"):
+        # Log the error reason from the status (assuming only one error is present)
+        error_details = status["errors"][0]
+        error_data_details = error_details.get("error_data", {}).get("details", "No details available")
+        error_reason = f"Error Code: {error_details.get('code', 'N/A')}, " \
+                       f"Title: {error_details.get('title', 'N/A')}, " \
+                       f"Details: {error_data_details}"
+
+    return {
+        "message_id": status["id"],
+        "status": message_status,
+        "rank": rank,
+        "read": message_status == "read",
+        "delivered": message_status in ("delivered", "read"),
+        "sent": message_status in ("sent", "delivered", "read"),
+        "error_reason": error_reason,
+    }
+
+
+def merge_status_update(updates: Dict[str, dict], status_update: dict):
+    """Merge an update into `updates` (wamid -> update), keeping the highest rank."""
+    current = updates.get(status_update["message_id"])
+    if current is None:
+        updates[status_update["message_id"]] = status_update
+        return
+    merged = status_update if status_update["rank"] > current["rank"] else dict(current)
+    for flag in ("read", "delivered", "sent"):
+        merged[flag] = current[flag] or status_update[flag]
+    merged["error_reason"] = status_update["error_reason"] or current["error_reason"]
+    updates[status_update["message_id"]] = merged
+
+
+def _current_rank(status_column):
+    return case(
+        *[(status_column == name, rank) for name, rank in STATUS_RANK.items()],
+        else_=0,
+    )
+
+
+async def apply_status_updates(db: AsyncSession, updates: Dict[str, dict]) -> Set[str]:
+    """
+    Apply merged updates with set-based UPDATEs and commit. The status never
+    moves down the ranking and the read/delivered/sent flags are only ever set.
+    Returns the wamids that matched a BroadcastAnalysis row.
+    """
+    analysis = Broadcast.BroadcastAnalysis
+    rows = list(updates.values())
+    found = set()
+
+    for start in range(0, len(rows), STATUS_UPDATE_BATCH_SIZE):
+        batch = rows[start:start + STATUS_UPDATE_BATCH_SIZE]
+        incoming = values(
+            column("message_id", String),
+            column("status", String),
+            column("rank", Integer),
+            column("read", Boolean),
+            column("delivered", Boolean),
+            column("sent", Boolean),
+            column("error_reason", String),
+            name="incoming",
+        ).data([
+            (row["message_id"], row["status"], row["rank"], row["read"], row["delivered"], row["sent"], row["error_reason"])
+            for row in batch
+        ])
+
+        result = await db.execute(
+            update(analysis)
+            .where(analysis.message_id == incoming.c.message_id)
+            .values(
+                status=case(
+                    (incoming.c.rank > _current_rank(analysis.status), incoming.c.status),
+                    else_=analysis.status,
+                ),
+                read=or_(func.coalesce(analysis.read, false()), incoming.c.read),
+                delivered=or_(func.coalesce(analysis.delivered, false()), incoming.c.delivered),
+                sent=or_(func.coalesce(analysis.sent, false()), incoming.c.sent),
+                error_reason=func.coalesce(incoming.c.error_reason, analysis.error_reason),
+            )
+            .returning(analysis.message_id)
+            .execution_options(synchronize_session=False)
+        )
+        found.update(result.scalars().all())
+
+    await db.commit()
+    return found
+
+
+# Statuses of wamids that never get a row (chat messages, other apps on the
+# number) expire with their hourly bucket after this many hours
+PENDING_STATUS_HOURS = int(os.getenv("PENDING_STATUS_HOURS", "6"))
+
+
+def _pending_key(hour: int) -> str:
+    return f"webhook:pending_statuses:{hour}"
+
+
+def _pending_fields(wamid: str):
+    return [f"{wamid}:{status}" for status in STATUS_RANK]
+
+
+class PendingStatusStore:
+    """
+    Parked status updates in hourly Redis hashes (field "<wamid>:<status>"),
+    each expiring PENDING_STATUS_HOURS after its hour, so nothing needs
+    cleaning up for wamids that never get a row.
+
+    The methods block on the (sync) Redis client; coroutines call them through
+    asyncio.to_thread so the event loop keeps serving other requests.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def _hours(self):
+        current = int(time.time() // 3600)
+        return range(current, current - PENDING_STATUS_HOURS - 1, -1)
+
+    def park(self, updates: Dict[str, dict]):
+        if not updates:
+            return
+        hour = self._hours()[0]
+        key = _pending_key(hour)
+        pipe = self.redis_client.pipeline()
+        pipe.hset(key, mapping={
+            f"{wamid}:{update['status']}": json.dumps(update) for wamid, update in updates.items()
+        })
+        pipe.expire(key, (PENDING_STATUS_HOURS + 1) * 3600)
+        pipe.execute()
+
+    def get(self, wamids: Iterable[str]) -> Dict[str, dict]:
+        """Parked updates for these wamids, merged per wamid."""
+        fields = [field for wamid in wamids for field in _pending_fields(wamid)]
+        if not fields:
+            return {}
+        pipe = self.redis_client.pipeline()
+        for hour in self._hours():
+            pipe.hmget(_pending_key(hour), fields)
+        updates = {}
+        for values_in_hour in pipe.execute():
+            for raw in values_in_hour:
+                if raw:
+                    merge_status_update(updates, json.loads(raw))
+        return updates
+
+    def discard(self, wamids: Iterable[str]):
+        fields = [field for wamid in wamids for field in _pending_fields(wamid)]
+        if not fields:
+            return
+        pipe = self.redis_client.pipeline()
+        for hour in self._hours():
+            pipe.hdel(_pending_key(hour), *fields)
+        pipe.execute()
+
+
+async def apply_or_park_status_updates(db: AsyncSession, updates: Dict[str, dict], pending: PendingStatusStore):
+    """
+    Webhook side: apply updates, and park those whose row does not exist yet.
+
+    After parking, the missing ones are tried once more: a sender that committed
+    its rows between the first UPDATE and the park has already looked for parked
+    statuses, so this second pass is what picks them up.
+    """
+    found = await apply_status_updates(db, updates)
+    missing = {wamid: update for wamid, update in updates.items() if wamid not in found}
+    if not missing:
+        return
+    await asyncio.to_thread(pending.park, missing)
+    found_now = await apply_status_updates(db, missing)
+    await asyncio.to_thread(pending.discard, found_now)
+
+
+async def reconcile_pending_statuses(db: AsyncSession, pending: PendingStatusStore, wamids: Iterable[str]):
+    """
+    Sender side, after committing BroadcastAnalysis rows: apply any statuses
+    that arrived for these wamids before the rows existed.
+    """
+    updates = await asyncio.to_thread(pending.get, list(wamids))
+    if not updates:
+        return
+    found = await apply_status_updates(db, updates)
+    await asyncio.to_thread(pending.discard, found)
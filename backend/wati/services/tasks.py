@@ -1,20 +1,33 @@
 import dramatiq
 from dramatiq import Middleware
 from dramatiq.middleware import Middleware, SkipMessage, AsyncIO
+from dramatiq.asyncio import get_event_loop_thread
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import select
+from sqlalchemy import select, update, delete, func
 from sqlalchemy.future import select as future_select
 from ..models import Broadcast, Integration, User
 from ..models.ChatBox import Conversation
 from ..routes import contacts
+from .sender import send_many, SendResult
+from .payload_plan import compile_payload_plan
+from .bulk_writer import BulkWriter
+from .rate_limiter import create_phone_rate_limiter
+from .graph_client import GraphClientMiddleware, get_graph_client, graph_url
+from .tenant_fairness import TenantConcurrencyMiddleware
+from .webhook_stream import WebhookStream
+from .webhook_dedup import WebhookDeduplicator
+from .status_updates import PendingStatusStore, reconcile_pending_statuses
+from .broadcast_progress import BroadcastProgress
+from .dead_letters import DeadLetterStore
 import httpx
 import requests
 import json
 import logging
 import os
 import time
+import random
 import ssl
 import base64
 import pandas as pd
@@ -24,6 +37,7 @@ import pytz
 from datetime import datetime, timedelta
 from fastapi import HTTPException
 from contextlib import asynccontextmanager
+from typing import Callable
 from urllib.parse import urlparse, unquote
 from dotenv import load_dotenv
 
@@ -86,65 +100,57 @@ async def get_task_status(task_id: int, db: AsyncSession):
     return "unknown"
 
 
-# class CancelationMiddleware(Middleware):
-#     def __init__(self, db_session_factory):
-#         """
-#         Initialize the middleware with a database session factory.
-        
-#         Args:
-#             db_session_factory: A callable that provides a database session (e.g., get_db).
-#         """
-#         self.db_session_factory = db_session_factory
-
-#     def before_process_message(self, broker, message):
-#         """
-#         Middleware hook to run before processing a message.
-
-#         Args:
-#             broker: The broker instance.
-#             message: The message being processed.
-#         """
-#         loop = self._get_or_create_event_loop()
-#         task_status = loop.run_until_complete(self._check_task_status(message.message_id))
-        
-#         if task_status == "Cancelled":
-#             raise SkipMessage("Task has been cancelled.")
-
-#     # async def _check_task_status(self, task_id):
-#     #     """
-#     #     Check the status of a task from the database asynchronously.
-
-#     #     Args:
-#     #         task_id: The ID of the task to check.
-
-#     #     Returns:
-#     #         str: The status of the task.
-#     #     """
-#     #     async for db in self.db_session_factory():
-#     #         return await get_task_status(task_id, db)
-
-
-
-
-#     async def _check_task_status(self, task_id):
-#         """
-#         Check the status of a task from the database asynchronously.
-
-#         Args:
-#             task_id: The ID of the task to check.
-
-#         Returns:
-#             str: The status of the task.
-#         """
-#         async for db in self.db_session_factory():# Use async with instead of async for
-#             return await get_task_status(task_id, db)
+class CancellationMiddleware(Middleware):
+    """
+    Skips broadcast messages whose broadcast was cancelled while they waited
+    in the queue (e.g. scheduled chunks), using the Redis cancellation registry
+    instead of a database query per message.
+    """
 
+    # actor name -> (positional index, keyword name) of the broadcast id argument
+    BROADCAST_ID_ARGS = {
+        "send_broadcast": (3, "broadcastId"),
+        "send_template_messages_task": (0, "broadcast_id"),
+    }
+    # actor name -> (positional index, keyword name) of the chunk index argument
+    CHUNK_INDEX_ARGS = {
+        "send_broadcast": (10, "chunk_index"),
+        "send_template_messages_task": (9, "chunk_index"),
+    }
 
-# cancelation_middleware = CancelationMiddleware(get_db)
+    @staticmethod
+    def _arg(message, arg):
+        index, name = arg
+        value = message.kwargs.get(name)
+        if value is None and len(message.args) > index:
+            value = message.args[index]
+        return value
+
+    def before_process_message(self, broker, message):
+        """
+        Middleware hook to run before processing a message.
+
+        Args:
+            broker: The broker instance.
+            message: The message being processed.
+        """
+        arg = self.BROADCAST_ID_ARGS.get(message.actor_name)
+        if arg is None:
+            return
+
+        broadcast_id = self._arg(message, arg)
+        if broadcast_id is not None and is_broadcast_cancelled(broadcast_id):
+            logging.info(f"Broadcast {broadcast_id} was cancelled. Skipping {message.actor_name} message.")
+            # The skipped chunk still reports what it already sent (a paused or
+            # resumed chunk has a checkpoint) and counts towards finalizing the broadcast
+            chunk_index = self._arg(message, self.CHUNK_INDEX_ARGS[message.actor_name]) or 0
+            get_event_loop_thread().run_coroutine(settle_cancelled_chunk(broadcast_id, chunk_index))
+            raise SkipMessage()
 
 # Add the middleware to your Dramatiq broker
 from dramatiq.brokers.redis import RedisBroker
 import redis as redis_lib
+import redis.asyncio as redis_asyncio
 
 def get_redis_url():
     """
@@ -304,6 +310,29 @@ while retry_count < max_retries:
                 redis_client = redis_lib.Redis(**redis_client_kwargs)
                 print("\n   ⚠️  Continuing anyway - Dramatiq will retry when it needs Redis")
 
+# Shared per-Phone_id send limiter on the same Redis connection (see services/rate_limiter.py)
+phone_rate_limiter = create_phone_rate_limiter(redis_client)
+# Broadcast sends use at most WHATSAPP_BULK_RATE_SHARE of each number's rate
+bulk_rate_limiter = create_phone_rate_limiter(redis_client, bulk=True)
+
+# Live per-broadcast progress counters (see services/broadcast_progress.py)
+broadcast_progress = BroadcastProgress(redis_client)
+
+# Sends that exhausted their retries (see services/dead_letters.py)
+dead_letters = DeadLetterStore(redis_client)
+
+# Delivery statuses that arrived before their BroadcastAnalysis row (see services/status_updates.py)
+pending_statuses = PendingStatusStore(redis_client)
+
+# asyncio client for long-lived subscriptions in the API process (connects lazily)
+async_redis_client = redis_asyncio.Redis(**redis_client_kwargs)
+
+# Buffered Meta webhooks, consumed in the API process (see services/webhook_stream.py)
+webhook_stream = WebhookStream(async_redis_client)
+
+# Drops Meta webhook retries and redelivered events (see services/webhook_dedup.py)
+webhook_dedup = WebhookDeduplicator(async_redis_client)
+
 # Create Redis broker with the configured client
 # Configure prefetch for better performance with Upstash (reduces script complexity)
 try:
@@ -315,7 +344,11 @@ try:
     )
     
     redis_broker.add_middleware(AsyncIO()) 
-    # redis_broker.add_middleware(cancelation_middleware)
+    # One pooled Graph API client per worker process (needs the AsyncIO loop)
+    redis_broker.add_middleware(GraphClientMiddleware())
+    redis_broker.add_middleware(CancellationMiddleware())
+    # Per-tenant concurrency caps, so one large broadcast cannot hold every worker thread
+    redis_broker.add_middleware(TenantConcurrencyMiddleware(redis_client))
     
     # Final connection validation before setting broker
     # This prevents Dramatiq from starting with a bad connection
@@ -355,9 +388,701 @@ except Exception as e:
         raise  # Fail fast in dev mode
 
 
+# Named queues, so bulk sends never delay transactional messages. Workers consume
+# every queue by default; run a dedicated worker with `--queues transactional`
+# (see start_dramatiq.py / DRAMATIQ_QUEUES) to reserve capacity for it.
+TRANSACTIONAL_QUEUE = "transactional"
+BULK_QUEUE = "bulk"
+SCHEDULED_QUEUE = "scheduled"
+
+# Recipients are handed to the sender engine in batches of this size to bound memory
+SEND_BATCH_SIZE = int(os.getenv("BROADCAST_SEND_BATCH_SIZE", "500"))
+
+# Large broadcasts are split into child messages of this many recipients so
+# that every worker process can work on the same broadcast in parallel
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "1000"))
+
+
+def chunk_ranges(total: int, chunk_size: int = BROADCAST_CHUNK_SIZE) -> list:
+    """
+    Split `total` recipients into [start, end) seq ranges (always at least one,
+    so an empty broadcast still gets finalized).
+    """
+    return [[start, min(start + chunk_size, total)] for start in range(0, total, chunk_size)] or [[0, 0]]
+
+
+async def store_broadcast_recipients(db: AsyncSession, broadcast_id: int, recipients: list) -> int:
+    """
+    Persist a broadcast's recipients as BroadcastRecipient rows numbered by seq,
+    so queue messages only carry the broadcast id and a seq range. The caller commits.
+    """
+    writer = BulkWriter(db)
+    for seq, contact in enumerate(recipients):
+        await writer.add(
+            Broadcast.BroadcastRecipient,
+            broadcast_id=broadcast_id,
+            seq=seq,
+            name=contact["name"],
+            phone=contact["phone"]
+        )
+    await writer.flush()
+    return len(recipients)
+
+
+class RecipientPages:
+    """
+    The recipients of one broadcast chunk, fetched a page at a time.
+
+    New messages reference BroadcastRecipient rows by [start, end) seq range;
+    messages enqueued before that carry the recipients inline.
+    """
+
+    def __init__(self, db: AsyncSession, broadcast_id: int, recipients: list = None, recipient_range: list = None):
+        self.db = db
+        self.broadcast_id = broadcast_id
+        self.recipients = recipients
+        self.start, self.end = recipient_range or [0, len(recipients or [])]
+
+    def __len__(self):
+        return self.end - self.start
+
+    async def fetch(self, offset: int, limit: int) -> list:
+        """Recipients `offset`..`offset + limit` of the chunk, as {"name", "phone"} dicts."""
+        if self.recipients is not None:
+            return self.recipients[offset:offset + limit]
+
+        start = self.start + offset
+        result = await self.db.execute(
+            select(Broadcast.BroadcastRecipient.name, Broadcast.BroadcastRecipient.phone)
+            .filter(
+                Broadcast.BroadcastRecipient.broadcast_id == self.broadcast_id,
+                Broadcast.BroadcastRecipient.seq >= start,
+                Broadcast.BroadcastRecipient.seq < min(start + limit, self.end)
+            )
+            .order_by(Broadcast.BroadcastRecipient.seq)
+        )
+        return [{"name": name, "phone": phone} for name, phone in result.all()]
+
+
+def _chunks_key(broadcast_id) -> str:
+    return f"broadcast:{broadcast_id}:chunks_remaining"
+
+
+def _chunks_enqueued_key(broadcast_id) -> str:
+    return f"broadcast:{broadcast_id}:chunks_enqueued"
+
+
+def register_broadcast_chunks(broadcast_id: int, chunk_count: int, delay_seconds: float = 0):
+    """
+    Record how many child messages a broadcast was split into.
+    The key outlives the (possibly scheduled) broadcast by a day; an existing
+    count is kept, since chunks already enqueued may have decremented it.
+    """
+    redis_client.set(_chunks_key(broadcast_id), chunk_count, ex=int(delay_seconds) + 86400, nx=True)
+
+
+def chunks_enqueued(broadcast_id: int) -> int:
+    """High-water mark of the chunks of a broadcast already enqueued, in chunk order."""
+    return int(redis_client.get(_chunks_enqueued_key(broadcast_id)) or 0)
+
+
+def mark_chunks_enqueued(broadcast_id: int, count: int, delay_seconds: float = 0):
+    redis_client.set(_chunks_enqueued_key(broadcast_id), count, ex=int(delay_seconds) + 86400)
+
+
+# Cancellation flags outlive any scheduled broadcast they may apply to
+CANCEL_FLAG_TTL_SECONDS = 30 * 86400
+
+
+def _cancel_key(broadcast_id) -> str:
+    return f"broadcast:{broadcast_id}:cancelled"
+
+
+def cancel_broadcast(broadcast_id: int):
+    """Flag a broadcast as cancelled; queued and running chunks stop at their next batch."""
+    redis_client.set(_cancel_key(broadcast_id), 1, ex=CANCEL_FLAG_TTL_SECONDS)
+
+
+def is_broadcast_cancelled(broadcast_id: int) -> bool:
+    """O(1) Redis check; a Redis outage does not stop sends."""
+    try:
+        return bool(redis_client.exists(_cancel_key(broadcast_id)))
+    except Exception as e:
+        logging.warning(f"Could not check cancellation of broadcast {broadcast_id}: {e}")
+        return False
+
+
+async def add_broadcast_counts(db: AsyncSession, broadcast_id: int, success_count: int, failed_count: int):
+    """Atomically add to a broadcast's success/failed counters (the caller commits)."""
+    await db.execute(
+        update(Broadcast.BroadcastList)
+        .where(Broadcast.BroadcastList.id == broadcast_id)
+        .values(
+            success=func.coalesce(Broadcast.BroadcastList.success, 0) + success_count,
+            failed=func.coalesce(Broadcast.BroadcastList.failed, 0) + failed_count,
+        )
+    )
+
+
+async def record_chunk_result(db: AsyncSession, broadcast_id: int, success_count: int, failed_count: int):
+    """
+    Add one chunk's counts to its BroadcastList row and, if it was the last
+    chunk still running, hand the broadcast to the finalize_broadcast coordinator.
+    """
+    await add_broadcast_counts(db, broadcast_id, success_count, failed_count)
+    await db.commit()
+    await asyncio.to_thread(chunk_finished, broadcast_id)
+
+
+def chunk_finished(broadcast_id: int):
+    """Count one chunk as done; the last one hands the broadcast to finalize_broadcast."""
+    remaining = redis_client.decr(_chunks_key(broadcast_id))
+    if remaining <= 0:
+        redis_client.delete(_chunks_key(broadcast_id))
+        finalize_broadcast.send(broadcast_id)
+
+
+@dramatiq.actor(max_retries=3, queue_name=TRANSACTIONAL_QUEUE)
+async def finalize_broadcast(broadcast_id: int):
+    """
+    Coordinator: runs once all chunks of a broadcast have reported and sets
+    the final status from the aggregated success/failed counts.
+    """
+    db = await anext(get_db())
+    try:
+        broadcast = await db.get(Broadcast.BroadcastList, broadcast_id)
+        if not broadcast:
+            logging.error(f"Broadcast not found for ID {broadcast_id}")
+            return
+        # A cancelled broadcast keeps its status
+        if broadcast.status != "Cancelled":
+            if broadcast.failed == 0:
+                broadcast.status = "Successful"
+            elif broadcast.success > 0:
+                broadcast.status = "Partially Successful"
+            else:
+                broadcast.status = "Failed"
+
+        # Recipients and schedule parameters are only needed until the chunks have sent
+        await db.execute(
+            delete(Broadcast.BroadcastRecipient).where(Broadcast.BroadcastRecipient.broadcast_id == broadcast_id)
+        )
+        await db.execute(
+            delete(Broadcast.ScheduledBroadcast).where(Broadcast.ScheduledBroadcast.broadcast_id == broadcast_id)
+        )
+
+        await db.commit()
+        await asyncio.to_thread(broadcast_progress.finish, broadcast_id, broadcast.status)
+        logging.info(f"Broadcast {broadcast_id} completed: {broadcast.success} sent, {broadcast.failed} failed")
+    finally:
+        await db.close()
+
+
+# Chunks stop and re-enqueue themselves once they have been sending for this
+# long, well inside the actor time limit (Dramatiq's default is 10 minutes)
+BROADCAST_TIME_BUDGET_SECONDS = int(os.getenv("BROADCAST_TIME_BUDGET_SECONDS", "480"))
+BROADCAST_ACTOR_TIME_LIMIT_MS = (BROADCAST_TIME_BUDGET_SECONDS + 300) * 1000
+
+
+async def get_checkpoint(db: AsyncSession, broadcast_id: int, chunk_index: int):
+    """Fetch (or create) the send checkpoint of one broadcast chunk."""
+    result = await db.execute(
+        select(Broadcast.BroadcastCheckpoint).filter(
+            Broadcast.BroadcastCheckpoint.broadcast_id == broadcast_id,
+            Broadcast.BroadcastCheckpoint.chunk_index == chunk_index
+        )
+    )
+    checkpoint = result.scalars().first()
+    if not checkpoint:
+        checkpoint = Broadcast.BroadcastCheckpoint(
+            broadcast_id=broadcast_id,
+            chunk_index=chunk_index,
+            cursor=0,
+            success=0,
+            failed=0,
+            status="running"
+        )
+        db.add(checkpoint)
+        await db.commit()
+    return checkpoint
+
+
+async def mark_chunk_resumable(db: AsyncSession, broadcast_id: int, chunk_index: int):
+    """
+    Flag a chunk as resumable from its last checkpoint. Its broadcast stays
+    "processing..." until finalize_broadcast sets the final status.
+    """
+    await db.execute(
+        update(Broadcast.BroadcastCheckpoint)
+        .where(
+            Broadcast.BroadcastCheckpoint.broadcast_id == broadcast_id,
+            Broadcast.BroadcastCheckpoint.chunk_index == chunk_index,
+            Broadcast.BroadcastCheckpoint.status != "done"
+        )
+        .values(status="resumable")
+    )
+    await db.commit()
+
+
+# A chunk that fails is resumed from its checkpoint by a continuation message,
+# with exponential backoff, at most this many times before it is given up
+CHUNK_RESUME_MAX_ATTEMPTS = int(os.getenv("BROADCAST_CHUNK_RESUME_MAX_ATTEMPTS", "5"))
+CHUNK_RESUME_BASE_DELAY_MS = int(os.getenv("BROADCAST_CHUNK_RESUME_BASE_DELAY_MS", "10000"))
+
+
+def chunk_resume_delay_ms(resume_attempt: int) -> int:
+    """Backoff before continuation `resume_attempt` (1-based): base * 2^(attempt-1), at most 10 minutes."""
+    return min(600000, CHUNK_RESUME_BASE_DELAY_MS * 2 ** (resume_attempt - 1))
+
+
+async def give_up_chunk(db: AsyncSession, broadcast_id: int, chunk_index: int, total_recipients: int):
+    """
+    Stop resuming a chunk: count its unsent recipients as failed, add its totals
+    to the broadcast and report it to the coordinator, so the broadcast still finalizes.
+    """
+    unsent = 0
+    try:
+        await db.rollback()
+        checkpoint = await get_checkpoint(db, broadcast_id, chunk_index)
+        if checkpoint.status in ("done", "failed"):
+            # Already reported
+            return
+        unsent = max(0, total_recipients - checkpoint.cursor)
+        checkpoint.status = "failed"
+        await add_broadcast_counts(db, broadcast_id, checkpoint.success, checkpoint.failed + unsent)
+        await db.commit()
+    except Exception as e:
+        # Still report the chunk below: a broadcast stuck waiting for it is worse than off counts
+        logging.critical(f"Could not record giving up broadcast {broadcast_id} chunk {chunk_index}: {e}")
+    # Never sent, so never counted in flight
+    await asyncio.to_thread(broadcast_progress.record, broadcast_id, 0, unsent, in_flight=False)
+    await asyncio.to_thread(chunk_finished, broadcast_id)
+    logging.error(f"Broadcast {broadcast_id} chunk {chunk_index} given up after {CHUNK_RESUME_MAX_ATTEMPTS} resumes, "
+                  f"{unsent} recipients counted as failed")
+
+
+async def settle_cancelled_chunk(broadcast_id: int, chunk_index: int):
+    """
+    Report a queued chunk of a cancelled broadcast without sending it: the counts
+    of its checkpoint (if it already sent some) are added to the broadcast, as a
+    chunk stopping on cancel does, and it counts towards finalizing the broadcast.
+    """
+    db = await anext(get_db())
+    try:
+        result = await db.execute(
+            select(Broadcast.BroadcastCheckpoint).filter(
+                Broadcast.BroadcastCheckpoint.broadcast_id == broadcast_id,
+                Broadcast.BroadcastCheckpoint.chunk_index == chunk_index
+            )
+        )
+        checkpoint = result.scalars().first()
+        if checkpoint and checkpoint.status in ("done", "failed"):
+            # Already reported
+            return
+        if checkpoint:
+            checkpoint.status = "done"
+            await add_broadcast_counts(db, broadcast_id, checkpoint.success, checkpoint.failed)
+            await db.commit()
+    except Exception as e:
+        # Still report the chunk below: a broadcast stuck waiting for it is worse than off counts
+        logging.critical(f"Could not record cancelled broadcast {broadcast_id} chunk {chunk_index}: {e}")
+    finally:
+        await db.close()
+    await asyncio.to_thread(chunk_finished, broadcast_id)
+
+
+async def resume_or_give_up_chunk(db: AsyncSession, broadcast_id: int, chunk_index: int, total_recipients: int,
+                                  resume_attempt: int, resend: Callable[[int, int], None]) -> bool:
+    """
+    Handle a chunk that failed: flag it resumable and enqueue a continuation through
+    `resend(resume_attempt, delay_ms)`, or give it up after CHUNK_RESUME_MAX_ATTEMPTS.
+
+    Returns:
+        bool: True if a continuation was enqueued.
+    """
+    if resume_attempt >= CHUNK_RESUME_MAX_ATTEMPTS:
+        await give_up_chunk(db, broadcast_id, chunk_index, total_recipients)
+        return False
+
+    try:
+        await db.rollback()
+        await mark_chunk_resumable(db, broadcast_id, chunk_index)
+    except Exception as e:
+        # The continuation resumes from the last committed cursor either way
+        logging.warning(f"Could not flag broadcast {broadcast_id} chunk {chunk_index} resumable: {e}")
+    delay_ms = chunk_resume_delay_ms(resume_attempt + 1)
+    resend(resume_attempt + 1, delay_ms)
+    logging.warning(f"Broadcast {broadcast_id} chunk {chunk_index} resumes in {delay_ms / 1000:.0f}s "
+                    f"(attempt {resume_attempt + 1}/{CHUNK_RESUME_MAX_ATTEMPTS})")
+    return True
+
+
+async def log_send_result(writer: BulkWriter, broadcast_id: int, user_id: int, phone_id, message_content: str, result: SendResult):
+    """Buffer the BroadcastAnalysis row (and Conversation row on success) for one send."""
+    recipient_name = result.recipient["name"]
+    recipient_phone = result.recipient["phone"]
+
+    if result.ok:
+        # Log successful message (buffered, written in bulk)
+        await writer.add(
+            Broadcast.BroadcastAnalysis,
+            user_id=user_id,
+            broadcast_id=broadcast_id,
+            error_reason="",
+            message_id=result.wamid,
+            status="sent",
+            phone_no=result.wa_id,
+            contact_name=recipient_name
+        )
+
+        # Save conversation record (buffered, written in bulk)
+        await writer.add(
+            Conversation,
+            wa_id=recipient_phone,
+            message_id=result.wamid,
+            media_id="",
+            phone_number_id=phone_id,
+            message_content=message_content,
+            timestamp=datetime.utcnow(),
+            context_message_id=None,
+            message_type="text",
+            direction="sent"
+        )
+    else:
+        # Log failed message (buffered, written in bulk)
+        await writer.add(
+            Broadcast.BroadcastAnalysis,
+            user_id=user_id,
+            broadcast_id=broadcast_id,
+            status="failed",
+            message_id=None,
+            phone_no=recipient_phone,
+            contact_name=recipient_name,
+            error_reason=result.error_reason
+        )
+
 
+# Retry stage for transient send failures (429, 5xx, timeouts, temporary Graph errors)
+RETRY_MAX_ATTEMPTS = int(os.getenv("BROADCAST_RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.getenv("BROADCAST_RETRY_BASE_DELAY_MS", "2000"))
+RETRY_MAX_DELAY_MS = int(os.getenv("BROADCAST_RETRY_MAX_DELAY_MS", "300000"))
 
-@dramatiq.actor(max_retries=0)
+
+def retry_delay_ms(attempt: int) -> int:
+    """Exponential backoff with jitter: 50-100% of base * 2^(attempt-1), capped."""
+    delay = min(RETRY_MAX_DELAY_MS, RETRY_BASE_DELAY_MS * 2 ** (attempt - 1))
+    return int(delay * random.uniform(0.5, 1.0))
+
+
+def schedule_send_retry(broadcast_id: int, user_id: int, phone_id, API_url: str, headers: dict,
+                        message_content: str, failures: list, attempt: int, delay_ms: int = None):
+    """
+    Hand (recipient, payload) pairs that failed transiently to the retry stage.
+
+    The retry message counts as one more chunk of the broadcast, so
+    finalize_broadcast only runs once it has been resolved.
+    """
+    if not failures:
+        return
+    messages = [
+        [recipient, payload.decode("utf-8") if isinstance(payload, bytes) else payload]
+        for recipient, payload in failures
+    ]
+    redis_client.incr(_chunks_key(broadcast_id))
+    retry_failed_sends.send_with_options(
+        args=[broadcast_id, user_id, phone_id, API_url, headers, message_content, messages, attempt],
+        delay=retry_delay_ms(attempt) if delay_ms is None else delay_ms
+    )
+    logging.info(f"Broadcast {broadcast_id}: {len(messages)} sends queued for retry attempt {attempt}")
+
+
+def _dead_letter_entry(broadcast_id, phone_id, message_content, recipient, payload, error_reason, attempts) -> dict:
+    return {
+        "broadcast_id": broadcast_id,
+        "phone_id": str(phone_id),
+        "message_content": message_content,
+        "recipient": recipient,
+        "payload": payload,
+        "error_reason": error_reason,
+        "attempts": attempts,
+    }
+
+
+@dramatiq.actor(max_retries=0, queue_name=BULK_QUEUE)
+async def retry_failed_sends(broadcast_id, user_id, phone_id, API_url, headers, message_content, messages, attempt):
+    """
+    Retry stage: re-send messages that failed transiently.
+
+    Successes and permanent failures are logged and counted like any chunk;
+    sends that fail transiently again go back to the retry stage with a longer
+    backoff, and after RETRY_MAX_ATTEMPTS they are counted as failed and
+    dead-lettered for replay.
+    """
+    db = await anext(get_db())
+    committed = False
+    try:
+        writer = BulkWriter(db)
+        success_count = 0
+        failed_count = 0
+        retries = []
+        dead = []
+
+        if await asyncio.to_thread(is_broadcast_cancelled, broadcast_id):
+            # Not sent: counted and logged as failed, but never retried or dead-lettered
+            # (a SendResult without a status code would classify as transient)
+            for recipient, payload in messages:
+                failed_count += 1
+                await log_send_result(writer, broadcast_id, user_id, phone_id, message_content, SendResult(
+                    recipient, None, {"error": {"code": "N/A", "message": "Broadcast cancelled before retry"}}
+                ))
+            results = []
+        else:
+            results = await send_many(
+                get_graph_client(), phone_id, API_url, headers,
+                [(recipient, payload.encode("utf-8")) for recipient, payload in messages],
+                limiter=bulk_rate_limiter
+            )
+
+        for (recipient, payload), result in zip(messages, results):
+            if result.transient and attempt < RETRY_MAX_ATTEMPTS:
+                retries.append((recipient, payload))
+                continue
+
+            if result.ok:
+                success_count += 1
+            else:
+                failed_count += 1
+                if result.transient:
+                    dead.append(_dead_letter_entry(
+                        broadcast_id, phone_id, message_content, recipient, payload, result.error_reason, attempt
+                    ))
+
+            await log_send_result(writer, broadcast_id, user_id, phone_id, message_content, result)
+
+        await writer.flush()
+        await add_broadcast_counts(db, broadcast_id, success_count, failed_count)
+        await db.commit()
+        committed = True
+        await reconcile_pending_statuses(db, pending_statuses, [result.wamid for result in results if result.ok])
+
+        await asyncio.to_thread(dead_letters.add, user_id, dead)
+        await asyncio.to_thread(
+            schedule_send_retry, broadcast_id, user_id, phone_id, API_url, headers, message_content, retries, attempt + 1
+        )
+        await asyncio.to_thread(broadcast_progress.record, broadcast_id, success_count, failed_count)
+        logging.info(
+            f"Broadcast {broadcast_id} retry attempt {attempt}: {success_count} sent, {failed_count} failed, "
+            f"{len(retries)} retrying, {len(dead)} dead-lettered"
+        )
+
+    except Exception as e:
+        await db.rollback()
+        logging.critical(f"Critical error in retry stage of broadcast {broadcast_id}: {str(e)}")
+        if committed:
+            # The sends are already logged and counted
+            raise e
+
+        # Count the sends as failed, like any dead-lettered send, so a replay
+        # taking them back leaves the counters consistent
+        counted = True
+        try:
+            await add_broadcast_counts(db, broadcast_id, 0, len(messages))
+            await db.commit()
+            await asyncio.to_thread(broadcast_progress.record, broadcast_id, 0, len(messages))
+        except Exception as count_error:
+            await db.rollback()
+            counted = False
+            logging.critical(f"Could not count failed retries of broadcast {broadcast_id}: {count_error}")
+
+        # Keep the messages replayable rather than losing them
+        await asyncio.to_thread(dead_letters.add, user_id, [
+            dict(_dead_letter_entry(broadcast_id, phone_id, message_content, recipient, payload, str(e), attempt),
+                 counted=counted)
+            for recipient, payload in messages
+        ])
+        raise e
+    finally:
+        await asyncio.to_thread(chunk_finished, broadcast_id)
+        await db.close()
+
+
+async def replay_dead_letters(db: AsyncSession, current_user, broadcast_id: int = None) -> int:
+    """
+    Re-send a user's dead-lettered messages (optionally of one broadcast) through
+    the retry stage.
+
+    Their failed BroadcastAnalysis rows and failed counts are taken back first
+    (entries parked with counted=False never reached the counts), and the retry
+    counts as a new chunk, so the broadcast is re-finalized with consistent
+    totals once the replay resolves. Entries of cancelled broadcasts stay
+    parked, and taken entries are parked again if the database update fails.
+    """
+    taken = await asyncio.to_thread(dead_letters.take, current_user.id, broadcast_id)
+    if not taken:
+        return 0
+
+    try:
+        # Locked until the commit, so a broadcast cannot be cancelled mid-replay
+        cancelled = set((await db.execute(
+            select(Broadcast.BroadcastList.id)
+            .where(
+                Broadcast.BroadcastList.id.in_({entry["broadcast_id"] for entry in taken}),
+                Broadcast.BroadcastList.status == "Cancelled"
+            )
+            .with_for_update()
+        )).scalars().all())
+        entries = [entry for entry in taken if entry["broadcast_id"] not in cancelled]
+
+        groups = {}
+        for entry in entries:
+            groups.setdefault((entry["broadcast_id"], entry["phone_id"], entry["message_content"]), []).append(entry)
+
+        for (entry_broadcast_id, phone_id, message_content), group in groups.items():
+            await db.execute(
+                update(Broadcast.BroadcastList)
+                .where(Broadcast.BroadcastList.id == entry_broadcast_id)
+                .values(
+                    failed=func.greatest(
+                        func.coalesce(Broadcast.BroadcastList.failed, 0) - sum(1 for entry in group if entry.get("counted", True)),
+                        0
+                    ),
+                    status="processing..."
+                )
+            )
+            await db.execute(
+                delete(Broadcast.BroadcastAnalysis).where(
+                    Broadcast.BroadcastAnalysis.broadcast_id == entry_broadcast_id,
+                    Broadcast.BroadcastAnalysis.status == "failed",
+                    Broadcast.BroadcastAnalysis.phone_no.in_([entry["recipient"]["phone"] for entry in group])
+                )
+            )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        await asyncio.to_thread(dead_letters.put_back, current_user.id, taken)
+        raise
+    await asyncio.to_thread(
+        dead_letters.put_back, current_user.id, [entry for entry in taken if entry["broadcast_id"] in cancelled]
+    )
+
+    headers = {
+        "Authorization": f"Bearer {current_user.PAccessToken}",
+        "Content-Type": "application/json"
+    }
+    for (entry_broadcast_id, phone_id, message_content), group in groups.items():
+        for start in range(0, len(group), SEND_BATCH_SIZE):
+            await asyncio.to_thread(
+                schedule_send_retry, entry_broadcast_id, current_user.id, phone_id, graph_url(f"{phone_id}/messages"), headers,
+                message_content, [(entry["recipient"], entry["payload"]) for entry in group[start:start + SEND_BATCH_SIZE]],
+                attempt=1, delay_ms=0
+            )
+
+    return len(entries)
+
+
+async def run_broadcast_chunk(
+    db: AsyncSession,
+    broadcast_id: int,
+    chunk_index: int,
+    recipients: RecipientPages,
+    plan,
+    message_content: str,
+    API_url: str,
+    headers: dict,
+    phone_id,
+    user_id: int,
+) -> bool:
+    """
+    Send one chunk of a broadcast, starting from its checkpoint.
+
+    Message logs, conversations and the checkpoint cursor are committed together
+    after every send batch, so an interrupted chunk resumes where it stopped and
+    at most the batch in flight at the time of a crash is attempted twice.
+
+    Returns:
+        bool: True when the chunk is finished (and reported to the coordinator),
+        False when its time budget ran out and a continuation message is needed.
+    """
+    checkpoint = await get_checkpoint(db, broadcast_id, chunk_index)
+    if checkpoint.status in ("done", "failed"):
+        logging.info(f"Broadcast {broadcast_id} chunk {chunk_index} already {checkpoint.status}, skipping")
+        return True
+
+    if checkpoint.status == "resumable":
+        logging.info(f"Broadcast {broadcast_id} chunk {chunk_index} resuming at recipient {checkpoint.cursor}")
+        checkpoint.status = "running"
+        await db.commit()
+
+    writer = BulkWriter(db)
+    started = time.monotonic()
+    errors = []
+
+    client = get_graph_client()
+    while checkpoint.cursor < len(recipients):
+        # Checked before every send batch, so a cancel takes effect within one batch
+        if await asyncio.to_thread(is_broadcast_cancelled, broadcast_id):
+            logging.info(f"Broadcast {broadcast_id} was cancelled. Chunk {chunk_index} stopping at recipient {checkpoint.cursor}.")
+            break
+
+        if time.monotonic() - started > BROADCAST_TIME_BUDGET_SECONDS:
+            await mark_chunk_resumable(db, broadcast_id, chunk_index)
+            logging.info(f"Broadcast {broadcast_id} chunk {chunk_index} paused at recipient {checkpoint.cursor}/{len(recipients)}")
+            return False
+
+        messages = [
+            (contact, plan.render(contact))
+            for contact in await recipients.fetch(checkpoint.cursor, SEND_BATCH_SIZE)
+        ]
+        if not messages:
+            logging.warning(f"Broadcast {broadcast_id} chunk {chunk_index}: recipients missing from recipient {checkpoint.cursor}")
+            break
+
+        # Send the batch concurrently (rate limited per Phone_id by the sender engine)
+        logging.info(f"Broadcast {broadcast_id} chunk {chunk_index}: sending to {len(messages)} recipients")
+        await asyncio.to_thread(broadcast_progress.add_in_flight, broadcast_id, len(messages))
+        results = await send_many(client, phone_id, API_url, headers, messages, limiter=bulk_rate_limiter)
+        batch_success = 0
+        batch_failed = 0
+        retries = []
+
+        for (contact, payload), result in zip(messages, results):
+            if result.transient:
+                # Resolved (and counted) later by the retry stage
+                retries.append((contact, payload))
+                continue
+
+            if result.ok:
+                batch_success += 1
+            else:
+                batch_failed += 1
+                logging.error(f"Failed to send to {contact['phone']}: {result.error_reason}")
+                if len(errors) < 3:
+                    errors.append({"recipient": contact["phone"], "error": result.response_data})
+
+            await log_send_result(writer, broadcast_id, user_id, phone_id, message_content, result)
+
+        # Commit this batch's rows together with the advanced cursor
+        checkpoint.cursor += len(messages)
+        checkpoint.success += batch_success
+        checkpoint.failed += batch_failed
+        await writer.flush()
+        await db.commit()
+        await reconcile_pending_statuses(db, pending_statuses, [result.wamid for result in results if result.ok])
+        await asyncio.to_thread(
+            schedule_send_retry, broadcast_id, user_id, phone_id, API_url, headers, message_content, retries, attempt=1
+        )
+        await asyncio.to_thread(broadcast_progress.record, broadcast_id, batch_success, batch_failed)
+
+    if errors:
+        logging.warning(f"Broadcast {broadcast_id} chunk {chunk_index} had {checkpoint.failed} failures: {errors}")
+    logging.info(f"Broadcast {broadcast_id} chunk {chunk_index} completed: {checkpoint.success} sent, {checkpoint.failed} failed")
+
+    checkpoint.status = "done"
+    await record_chunk_result(db, broadcast_id, checkpoint.success, checkpoint.failed)
+    return True
+
+
+@dramatiq.actor(max_retries=0, time_limit=BROADCAST_ACTOR_TIME_LIMIT_MS, queue_name=SCHEDULED_QUEUE)
 async def send_broadcast(
     template_name,
     template_data, 
@@ -368,36 +1093,28 @@ async def send_broadcast(
     user_id, 
     image_id, 
     body_parameters,
-    Phone_id):
+    Phone_id,
+    chunk_index=None,
+    recipient_range=None,
+    resume_attempt=0):
     """
     Dramatiq actor to send scheduled broadcast messages.
+
+    Each message sends one chunk of the broadcast: the BroadcastRecipient rows in
+    `recipient_range` ([start, end) seq), or the inline `recipients` list of messages
+    enqueued before recipients were stored. The final status is set by the
+    finalize_broadcast coordinator once every chunk has reported.
     
     OPTIMIZATIONS:
-    - Batch database commits (commit once after all messages)
-    - Rate limiting to prevent WhatsApp API throttling (20 msg/sec)
+    - Bulk INSERTs of message logs and conversations, committed per send batch
+    - Concurrent sends per Phone_id, paced by an adaptive token bucket (see services/sender.py)
+    - Checkpointed: a chunk that runs out of time or dies resumes from its last batch
     - Better error handling (doesn't fail task if some messages succeed)
-    - Cancellation support (checks if broadcast was cancelled)
+    - Cancellation support (Redis flag checked by CancellationMiddleware and before every batch)
     """
+    chunk_index = chunk_index or 0
     db = await anext(get_db())
     try:
-        success_count = 0
-        failed_count = 0
-        errors = []
-
-        # Check if broadcast was cancelled before starting
-        result = await db.execute(
-            select(Broadcast.BroadcastList).filter(Broadcast.BroadcastList.id == broadcastId)
-        )
-        broadcast = result.scalars().first()
-
-        if not broadcast:
-            logging.error(f"Broadcast {broadcastId} not found")
-            raise HTTPException(status_code=404, detail="Broadcast not found")
-        
-        if broadcast.status == "Cancelled":
-            logging.info(f"Broadcast {broadcastId} was cancelled. Terminating task.")
-            raise SkipMessage()
-
         # Parse template_data once (not in loop)
         if isinstance(template_data, str):
             template_data_json = json.loads(template_data)
@@ -406,153 +1123,47 @@ async def send_broadcast(
         
         Templatelanguage = template_data_json.get("language")
 
-        async with httpx.AsyncClient() as client:
-            for contact in recipients:
-                recipient_name = contact["name"]
-                recipient_phone = contact["phone"]
-
-                # Build WhatsApp API payload
-                data = {
-                    "messaging_product": "whatsapp",
-                    "to": recipient_phone,
-                    "type": "template",
-                    "template": {
-                        "name": template_name,
-                        "language": {"code": Templatelanguage},
-                    }
-                }
-
-                # Add header media if provided
-                if image_id:
-                    data["template"]["components"] = [
-                        {
-                            "type": "header",
-                            "parameters": [
-                                {
-                                    "type": "image",
-                                    "image": {"id": image_id}
-                                }
-                            ]
-                        }
-                    ]
-
-                # Add body parameters for personalization
-                if body_parameters:
-                    body_params = [{"type": "text", "text": recipient_name if body_parameters == "Name" else ""}]
-                    if "components" not in data["template"]:
-                        data["template"]["components"] = []
-                    data["template"]["components"].append({
-                        "type": "body",
-                        "parameters": body_params
-                    })
-
-                # Send message via WhatsApp API
-                logging.info(f"Sending scheduled template '{template_name}' to {recipient_phone}")
-                response = await client.post(API_url, headers=headers, data=json.dumps(data))
-                response_data = response.json()
-
-                if response.status_code == 200:
-                    success_count += 1
-                    wamid = response_data['messages'][0]['id']
-                    phone_num = response_data['contacts'][0]["wa_id"]
-
-                    # Log successful message (add to session, commit later)
-                    MessageIdLog = Broadcast.BroadcastAnalysis(
-                        user_id=user_id,
-                        broadcast_id=broadcastId,
-                        error_reason="",
-                        message_id=wamid,
-                        status="sent",
-                        phone_no=phone_num,
-                        contact_name=recipient_name
-                    )
-                    db.add(MessageIdLog)
-
-                    # Save conversation record (add to session, commit later)
-                    conversation = Conversation(
-                        wa_id=recipient_phone,
-                        message_id=wamid,
-                        media_id="",
-                        phone_number_id=Phone_id,
-                        message_content=f"#template_message# {template_data}",
-                        timestamp=datetime.utcnow(),
-                        context_message_id=None,
-                        message_type="text",
-                        direction="sent"
-                    )
-                    db.add(conversation)
-
-                else:
-                    failed_count += 1
-                    error_detail = response_data.get("error", {}).get("message", "Unknown error")
-                    error_code = response_data.get("error", {}).get("code", "N/A")
-                    error_reason = f"Error Code: {error_code}, Detail: {error_detail}"
-                
-                    logging.error(f"Failed to send to {recipient_phone}: {error_reason}")
-                    errors.append({"recipient": recipient_phone, "error": response_data})
-                    
-                    # Log failed message (add to session, commit later)
-                    MessageIdLog = Broadcast.BroadcastAnalysis(
-                        user_id=user_id,
-                        broadcast_id=broadcastId,
-                        status="failed",
-                        phone_no=recipient_phone,
-                        contact_name=recipient_name,
-                        error_reason=error_reason
-                    )
-                    db.add(MessageIdLog)
-
-                # RATE LIMITING: Sleep to prevent WhatsApp API throttling
-                # WhatsApp allows ~80 msg/sec, we use 20 msg/sec for safety
-                await asyncio.sleep(0.05)  # 50ms delay = 20 messages/second
-
-        # BATCH COMMIT: Commit all message logs and conversations at once
-        logging.info(f"Committing {success_count + failed_count} message logs to database")
-        await db.commit()
-
-        # Update broadcast status
-        broadcastLog = await db.get(Broadcast.BroadcastList, broadcastId)
-        if not broadcastLog:
-            logging.error(f"Broadcast not found for ID {broadcastId}")
-            raise Exception(f"Broadcast not found for ID {broadcastId}")
-
-        broadcastLog.success = success_count
-        broadcastLog.failed = failed_count
-        
-        # Determine final status
-        if failed_count == 0:
-            broadcastLog.status = "Successful"
-        elif success_count > 0:
-            broadcastLog.status = "Partially Successful"
-        else:
-            broadcastLog.status = "Failed"
+        # Compile the payload once; only "to" and parameter values change per recipient
+        plan = compile_payload_plan(
+            template_name,
+            Templatelanguage,
+            image_id=image_id,
+            parameter_keys=[body_parameters] if body_parameters else None,
+        )
 
-        db.add(broadcastLog)
-        await db.commit()
-        await db.refresh(broadcastLog)
+        finished = await run_broadcast_chunk(
+            db, broadcastId, chunk_index, RecipientPages(db, broadcastId, recipients, recipient_range), plan,
+            f"#template_message# {template_data}", API_url, headers, Phone_id, user_id
+        )
+        if not finished:
+            # Continue from the checkpoint in a fresh message (and a fresh time limit)
+            send_broadcast.send(
+                template_name, template_data, recipients, broadcastId, API_url,
+                headers, user_id, image_id, body_parameters, Phone_id, chunk_index, recipient_range
+            )
 
-        # Log results (don't raise exception - task should complete)
-        if errors:
-            logging.warning(f"Scheduled broadcast {broadcastId} completed with {failed_count} failures: {errors[:3]}")
-        
-        logging.info(f"Scheduled broadcast {broadcastId} completed: {success_count} sent, {failed_count} failed")
-        
     except SkipMessage:
         # Re-raise SkipMessage for cancelled broadcasts
         raise
     except Exception as e:
-        await db.rollback()
         logging.critical(f"Critical error in scheduled broadcast {broadcastId}: {str(e)}")
-        raise e
-    finally:
-        await db.close()
-
-   
 
+        def resend(attempt, delay_ms):
+            send_broadcast.send_with_options(
+                args=[template_name, template_data, recipients, broadcastId, API_url,
+                      headers, user_id, image_id, body_parameters, Phone_id, chunk_index, recipient_range],
+                kwargs={"resume_attempt": attempt},
+                delay=delay_ms
+            )
 
+        total = len(RecipientPages(db, broadcastId, recipients, recipient_range))
+        if not await resume_or_give_up_chunk(db, broadcastId, chunk_index, total, resume_attempt, resend):
+            raise e
+    finally:
+        await db.close()
 
 
-@dramatiq.actor(max_retries=0)
+@dramatiq.actor(max_retries=0, time_limit=BROADCAST_ACTOR_TIME_LIMIT_MS, queue_name=BULK_QUEUE)
 async def send_template_messages_task(
     broadcast_id: int,
     recipients: list,
@@ -563,22 +1174,29 @@ async def send_template_messages_task(
     phone_id: str,
     access_token: str,
     user_id: int,
+    chunk_index: int = None,
+    recipient_range: list = None,
+    resume_attempt: int = 0,
 ):
     """
     Dramatiq actor to send WhatsApp template messages to multiple recipients.
+
+    Each message sends one chunk of the broadcast: the BroadcastRecipient rows in
+    `recipient_range` ([start, end) seq), or the inline `recipients` list of messages
+    enqueued before recipients were stored. The final status is set by the
+    finalize_broadcast coordinator once every chunk has reported.
     
     OPTIMIZATIONS:
-    - Batch database commits (commit once after all messages)
-    - Rate limiting to prevent WhatsApp API throttling (20 msg/sec)
+    - Bulk INSERTs of message logs and conversations, committed per send batch
+    - Concurrent sends per Phone_id, paced by an adaptive token bucket (see services/sender.py)
+    - Checkpointed: a chunk that runs out of time or dies resumes from its last batch
     - Better error handling (doesn't fail task if some messages succeed)
+    - Cancellation support (Redis flag checked by CancellationMiddleware and before every batch)
     """
+    chunk_index = chunk_index or 0
     db = await anext(get_db())
     try:
-        success_count = 0
-        failed_count = 0
-        errors = []
-        
-        API_url = f"https://graph.facebook.com/v20.0/{phone_id}/messages"
+        API_url = graph_url(f"{phone_id}/messages")
         headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
@@ -592,142 +1210,58 @@ async def send_template_messages_task(
 
         Templatelanguage = template_data_json.get("language")
 
-        async with httpx.AsyncClient() as client:
-            for contact in recipients:
-                recipient_name = contact["name"]
-                recipient_phone = contact["phone"]
-
-                # Build WhatsApp API payload
-                data = {
-                    "messaging_product": "whatsapp",
-                    "to": recipient_phone,
-                    "type": "template",
-                    "template": {
-                        "name": template,
-                        "language": {"code": Templatelanguage},
-                    }
-                }
-
-                # Add header media if provided
-                if image_id:
-                    data["template"]["components"] = [
-                        {
-                            "type": "header",
-                            "parameters": [
-                                {
-                                    "type": "image",
-                                    "image": {"id": image_id}
-                                }
-                            ]
-                        }
-                    ]
-
-                # Add body parameters for personalization
-                if body_parameters:
-                    body_params = [{"type": "text", "text": f"{recipient_name}"}] if body_parameters == "Name" else []
-                    if "components" not in data["template"]:
-                        data["template"]["components"] = []
-
-                    data["template"]["components"].append({
-                        "type": "body",
-                        "parameters": body_params
-                    })
-
-                # Send message via WhatsApp API
-                logging.info(f"Sending template '{template}' to {recipient_phone}")
-                response = await client.post(API_url, headers=headers, json=data)
-                response_data = response.json()
-
-                if response.status_code == 200:
-                    success_count += 1
-                    wamid = response_data['messages'][0]['id']
-                    phone_num = response_data['contacts'][0]["wa_id"]
-
-                    # Log successful message (add to session, commit later)
-                    message_log = Broadcast.BroadcastAnalysis(
-                        user_id=user_id,
-                        broadcast_id=broadcast_id,
-                        message_id=wamid,
-                        error_reason="",
-                        status="sent",
-                        phone_no=phone_num,
-                        contact_name=recipient_name,
-                    )
-                    db.add(message_log)
-
-                    # Save conversation record (add to session, commit later)
-                    conversation = Conversation(
-                        wa_id=recipient_phone,
-                        message_id=wamid,
-                        media_id="",
-                        phone_number_id=phone_id,
-                        message_content=f"#template_message# {template_data}",
-                        timestamp=datetime.utcnow(),
-                        context_message_id=None,
-                        message_type="text",
-                        direction="sent"
-                    )
-                    db.add(conversation)
-
-                else:
-                    failed_count += 1
-                    error_detail = response_data.get("error", {}).get("message", "Unknown error")
-                    error_code = response_data.get("error", {}).get("code", "N/A")
-                    error_reason = f"Error Code: {error_code}, Detail: {error_detail}"
-
-                    logging.error(f"Failed to send to {recipient_phone}: {error_reason}")
-                    errors.append({"recipient": recipient_phone, "error": response_data})
-
-                    # Log failed message (add to session, commit later)
-                    message_log = Broadcast.BroadcastAnalysis(
-                        user_id=user_id,
-                        broadcast_id=broadcast_id,
-                        status="failed",
-                        phone_no=recipient_phone,
-                        contact_name=recipient_name,
-                        error_reason=error_reason
-                    )
-                    db.add(message_log)
-
-                # RATE LIMITING: Sleep to prevent WhatsApp API throttling
-                # WhatsApp allows ~80 msg/sec, we use 20 msg/sec for safety
-                await asyncio.sleep(0.05)  # 50ms delay = 20 messages/second
-
-        # BATCH COMMIT: Commit all message logs and conversations at once
-        logging.info(f"Committing {success_count + failed_count} message logs to database")
-        await db.commit()
-
-        # Update broadcast status
-        broadcast = await db.get(Broadcast.BroadcastList, broadcast_id)
-        if not broadcast:
-            logging.error(f"Broadcast not found for ID {broadcast_id}")
-            raise Exception(f"Broadcast not found for ID {broadcast_id}")
-        
-        broadcast.success = success_count
-        broadcast.failed = failed_count
-        
-        # Determine final status
-        if failed_count == 0:
-            broadcast.status = "Successful"
-        elif success_count > 0:
-            broadcast.status = "Partially Successful"
+        # Compile the payload once; only "to" and parameter values change per recipient
+        if body_parameters:
+            parameter_keys = [body_parameters] if body_parameters == "Name" else []
         else:
-            broadcast.status = "Failed"
+            parameter_keys = None
+        plan = compile_payload_plan(template, Templatelanguage, image_id=image_id, parameter_keys=parameter_keys)
 
-        db.add(broadcast)
-        await db.commit()
-        await db.refresh(broadcast)
+        finished = await run_broadcast_chunk(
+            db, broadcast_id, chunk_index, RecipientPages(db, broadcast_id, recipients, recipient_range), plan,
+            f"#template_message# {template_data}", API_url, headers, phone_id, user_id
+        )
+        if not finished:
+            # Continue from the checkpoint in a fresh message (and a fresh time limit)
+            send_template_messages_task.send(
+                broadcast_id=broadcast_id,
+                recipients=recipients,
+                template=template,
+                template_data=template_data,
+                image_id=image_id,
+                body_parameters=body_parameters,
+                phone_id=phone_id,
+                access_token=access_token,
+                user_id=user_id,
+                chunk_index=chunk_index,
+                recipient_range=recipient_range
+            )
 
-        # Log results (don't raise exception - task should complete)
-        if errors:
-            logging.warning(f"Broadcast {broadcast_id} completed with {failed_count} failures: {errors[:3]}")  # Log first 3 errors
-        
-        logging.info(f"Broadcast {broadcast_id} completed: {success_count} sent, {failed_count} failed")
-        
     except Exception as e:
-        await db.rollback()
         logging.critical(f"Critical error in broadcast {broadcast_id}: {str(e)}")
-        raise e
+
+        def resend(attempt, delay_ms):
+            send_template_messages_task.send_with_options(
+                kwargs=dict(
+                    broadcast_id=broadcast_id,
+                    recipients=recipients,
+                    template=template,
+                    template_data=template_data,
+                    image_id=image_id,
+                    body_parameters=body_parameters,
+                    phone_id=phone_id,
+                    access_token=access_token,
+                    user_id=user_id,
+                    chunk_index=chunk_index,
+                    recipient_range=recipient_range,
+                    resume_attempt=attempt
+                ),
+                delay=delay_ms
+            )
+
+        total = len(RecipientPages(db, broadcast_id, recipients, recipient_range))
+        if not await resume_or_give_up_chunk(db, broadcast_id, chunk_index, total, resume_attempt, resend):
+            raise e
     finally:
         await db.close()
 
@@ -883,7 +1417,7 @@ async def get_event_loop():
         asyncio.set_event_loop(loop)
     return loop
 
-@dramatiq.actor(max_retries=0)
+@dramatiq.actor(max_retries=0, queue_name=SCHEDULED_QUEUE)
 async def schedule_woo_task(integration_id: int):
     """
     Task to execute the WooCommerce integration and reschedule itself.
@@ -899,6 +1433,8 @@ async def schedule_woo_task(integration_id: int):
             yield session  # Properly manage session lifecycle
 
     async for db in get_db_session():  # Use async for to handle session properly
+        writer = BulkWriter(db)
+        sent_wamids = []
         try:
             # Get the database session
             
@@ -1005,7 +1541,7 @@ async def schedule_woo_task(integration_id: int):
                         image_id = integration.image_id
                         recipients = df_reduced.to_json(orient='records')
                         recipients_list = json.loads(recipients) # Convert JSON string to Python list
-                        API_url = f"https://graph.facebook.com/v20.0/{user.Phone_id}/messages"
+                        API_url = graph_url(f"{user.Phone_id}/messages")
 
                         success_count = 0
                         failed_count = 0
@@ -1014,150 +1550,112 @@ async def schedule_woo_task(integration_id: int):
                         
 
                         
-                    async with httpx.AsyncClient() as client:   
-                        for contact in recipients_list:
-                                recipient_name = contact["name"]
-                                recipient_phone = contact["phone_no"]
-
-                                fb_headers = {
-                                        "Authorization": f"Bearer {user.PAccessToken}",
-                                        "Content-Type": "application/json"
-                                    }
-                                
-                                if isinstance(integration.template_data, str):
-                                    template_data = json.loads(integration.template_data)
-                                TemplateLanguage = template_data.get("language")
-
-                                data = {
-                                    "messaging_product": "whatsapp",
-                                    "to": recipient_phone,
-                                    "type": "template",
-                                    "template": {
-                                        "name": integration.template,
-                                        "language": {"code": TemplateLanguage},
-                                    }
-                                }
-
-                                if image_id:
-                                    data["template"]["components"] = [
-                                        {
-                                            "type": "header",
-                                            "parameters": [
-                                                {
-                                                    "type": "image",
-                                                    "image": {"id": image_id}
-                                                }
-                                            ]
-                                        }
-                                    ]
-
-                                if integration.parameters:
-                                    for param in integration.parameters:
-                                        param_key = param["key"]
-                                        
-                                        # Map parameter keys to specific values
-                                        if param_key == "billing.first_name":
-                                            value = recipient_name
-                                        # elif param_key == "id":
-                                        #     value = order_id
-                                        # elif param_key == "total":
-                                        #     value = order_total
-                                        else:
-                                            value = ""  # Default for unknown parameters
-
-
-                                        body_params = [{"type": "text", "text": f"{value}"}] 
-                                        # Ensure the components list exists
-                                        if "components" not in data["template"]:
-                                            data["template"]["components"] = []
-                                            
-                                        data["template"]["components"].append({
-                                                "type": "body",
-                                                "parameters": body_params
-                                            })
-
-
-
-                                # Send the message
-
-                                print(data)
-                                response = await client.post(API_url, headers=fb_headers, json=data)
-                                response_data = response.json()
-
-                                if response.status_code == 200:
-                                    success_count += 1
-                                    wamid = response_data['messages'][0]['id']
-                                    phone_num = response_data['contacts'][0]["wa_id"]
-
-                                    # Log success in the database
-                                    MessageIdLog = Broadcast.BroadcastAnalysis(
-                                        user_id=integration.user_id,
-                                        broadcast_id=db_broadcast_list.id,
-                                        error_reason="",
-                                        message_id=wamid,
-                                        status="sent",
-                                        phone_no=phone_num,
-                                        contact_name=recipient_name
-                                    )
-                                    db.add(MessageIdLog)
-                                    await db.commit()
-                                    await db.refresh(MessageIdLog)
-
-                                    # Save conversation data
-                                    conversation = Conversation(
-                                        wa_id=recipient_phone,
-                                        message_id=wamid,
-                                        media_id="",
-                                        phone_number_id=user.Phone_id,
-                                        message_content=f"#template_message# {integration.template_data}",
-                                        timestamp=datetime.utcnow(),
-                                        context_message_id=None,
-                                        message_type="text",
-                                        direction="sent"
-                                    )
-                                    db.add(conversation)
-                                    await db.commit()
-                                    await db.refresh(conversation)
-
-                                else:
-                                    failed_count += 1
-                                    error_detail = response_data.get("error", {}).get("message", "Unknown error")
-                                    error_code = response_data.get("error", {}).get("code", "N/A")
-                                    error_reason = f"Error Code: {error_code}, Detail: {error_detail}"
-
-                                    errors.append({"recipient": recipient_phone, "error": response_data})
-
-                                    # Log failure in the database
-                                    MessageIdLog = Broadcast.BroadcastAnalysis(
-                                        user_id=user.id,
-                                        broadcast_id=db_broadcast_list.id,
-                                        status="failed",
-                                        phone_no=recipient_phone,
-                                        contact_name=recipient_name,
-                                        error_reason=error_reason
-                                    )
-                                    db.add(MessageIdLog)
-                                    await db.commit()
-                                    await db.refresh(MessageIdLog)
-
-                        # Update broadcast log
-                        broadcastLog = await db.get(Broadcast.BroadcastList, db_broadcast_list.id)
-                        if not broadcastLog:
-                            raise Exception(f"Broadcast not found for ID {db_broadcast_list.id}")
-
-                        broadcastLog.success = success_count
-                        broadcastLog.status = "Successful" if success_count > 0 else "Failed"
-                        broadcastLog.failed = failed_count
-
-                        db.add(broadcastLog)
-                        await db.commit()
-                        await db.refresh(broadcastLog)
+                    # Parse template_data and compile the payload once (not per recipient)
+                    if isinstance(integration.template_data, str):
+                        template_data = json.loads(integration.template_data)
+                    else:
+                        template_data = integration.template_data
+                    TemplateLanguage = template_data.get("language")
+
+                    plan = compile_payload_plan(
+                        integration.template,
+                        TemplateLanguage,
+                        image_id=image_id,
+                        parameter_keys=[param["key"] for param in integration.parameters] if integration.parameters else None,
+                        to_field="phone_no",
+                    )
+                    message_content = f"#template_message# {integration.template_data}"
 
-                        if errors:
-                            print(f"Failed to send some messages: {errors}")
-                            raise Exception(f"Failed to send broadcast: {errors}")
+                    fb_headers = {
+                            "Authorization": f"Bearer {user.PAccessToken}",
+                            "Content-Type": "application/json"
+                        }
 
-                        print(f"Successfully sent {success_count} messages.")
+                    client = get_graph_client()
+                    for contact in recipients_list:
+                            recipient_name = contact["name"]
+                            recipient_phone = contact["phone_no"]
+
+                            # Send the message
+                            await bulk_rate_limiter.acquire(user.Phone_id)
+                            response = await client.post(API_url, headers=fb_headers, content=plan.render(contact))
+                            response_data = response.json()
+
+                            if response.status_code == 200:
+                                success_count += 1
+                                wamid = response_data['messages'][0]['id']
+                                phone_num = response_data['contacts'][0]["wa_id"]
+                                sent_wamids.append(wamid)
+
+                                # Log success (buffered, written in bulk)
+                                await writer.add(
+                                    Broadcast.BroadcastAnalysis,
+                                    user_id=integration.user_id,
+                                    broadcast_id=db_broadcast_list.id,
+                                    error_reason="",
+                                    message_id=wamid,
+                                    status="sent",
+                                    phone_no=phone_num,
+                                    contact_name=recipient_name
+                                )
+
+                                # Save conversation data (buffered, written in bulk)
+                                await writer.add(
+                                    Conversation,
+                                    wa_id=recipient_phone,
+                                    message_id=wamid,
+                                    media_id="",
+                                    phone_number_id=user.Phone_id,
+                                    message_content=message_content,
+                                    timestamp=datetime.utcnow(),
+                                    context_message_id=None,
+                                    message_type="text",
+                                    direction="sent"
+                                )
+
+                            else:
+                                failed_count += 1
+                                error_detail = response_data.get("error", {}).get("message", "Unknown error")
+                                error_code = response_data.get("error", {}).get("code", "N/A")
+                                error_reason = f"Error Code: {error_code}, Detail: {error_detail}"
+
+                                errors.append({"recipient": recipient_phone, "error": response_data})
+
+                                # Log failure (buffered, written in bulk)
+                                await writer.add(
+                                    Broadcast.BroadcastAnalysis,
+                                    user_id=user.id,
+                                    broadcast_id=db_broadcast_list.id,
+                                    status="failed",
+                                    message_id=None,
+                                    phone_no=recipient_phone,
+                                    contact_name=recipient_name,
+                                    error_reason=error_reason
+                                )
+
+                    # Write the remaining buffered rows in one go
+                    await writer.flush()
+                    await db.commit()
+                    await reconcile_pending_statuses(db, pending_statuses, sent_wamids)
+
+                    # Update broadcast log
+                    broadcastLog = await db.get(Broadcast.BroadcastList, db_broadcast_list.id)
+                    if not broadcastLog:
+                        raise Exception(f"Broadcast not found for ID {db_broadcast_list.id}")
+
+                    broadcastLog.success = success_count
+                    broadcastLog.status = "Successful" if success_count > 0 else "Failed"
+                    broadcastLog.failed = failed_count
+
+                    db.add(broadcastLog)
+                    await db.commit()
+                    await db.refresh(broadcastLog)
+
+                    if errors:
+                        print(f"Failed to send some messages: {errors}")
+                        raise Exception(f"Failed to send broadcast: {errors}")
+
+                    print(f"Successfully sent {success_count} messages.")
 
         except Exception as e:
             await db.rollback()  # Rollback on error
@@ -1167,3 +1665,25 @@ async def schedule_woo_task(integration_id: int):
             await db.close()  # Ensure db is closed
 
 
+@dramatiq.actor(max_retries=3, queue_name=TRANSACTIONAL_QUEUE)
+async def send_order_confirmation(order_data: dict, user_id: int):
+    """
+    Send a WooCommerce order confirmation off the webhook request, on the
+    transactional queue so it never waits behind broadcast chunks.
+    """
+    # Imported here: the woocommerce routes import this module
+    from ..routes.woocommerce import send_order_confirmation_message
+
+    db = await anext(get_db())
+    try:
+        user = await db.get(User, user_id)
+        if not user:
+            logging.error(f"Order confirmation skipped, user {user_id} not found")
+            return
+        await send_order_confirmation_message(order_data, user.PAccessToken, user.Phone_id, db, user.id)
+    except (KeyError, TypeError, ValueError) as e:
+        # No matching order confirmation integration, or a malformed order:
+        # permanent, so dropped rather than retried
+        logging.warning(f"Order confirmation for order {order_data.get('id')} dropped: {e!r}")
+    finally:
+        await db.close()
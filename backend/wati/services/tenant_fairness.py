@@ -0,0 +1,141 @@
+"""
+Tenant Fair Scheduling
+Caps how many broadcast work units (chunks and retry batches) of one tenant
+(user_id) run at once across all Dramatiq workers. A unit over its tenant's cap
+is deferred to the back of the queue instead of taking a worker thread, so one
+large broadcast cannot hold every thread while other tenants' chunks wait.
+"""
+import os
+import time
+import random
+import logging
+
+from dramatiq import Middleware
+from dramatiq.middleware import SkipMessage
+
+# Concurrent work units per tenant unless overridden in the caps hash
+TENANT_MAX_CONCURRENCY = int(os.getenv("TENANT_MAX_CONCURRENCY", "2"))
+
+# Deferred units are re-enqueued after this delay, doubled on each further
+# deferral of the same unit up to the maximum (plus up to 100% jitter), so a
+# tenant queued far beyond its cap does not keep cycling its units through
+# the queue every few seconds
+TENANT_DEFER_DELAY_MS = int(os.getenv("TENANT_DEFER_DELAY_MS", "3000"))
+TENANT_DEFER_MAX_DELAY_MS = int(os.getenv("TENANT_DEFER_MAX_DELAY_MS", "120000"))
+
+# Leases of workers that died are dropped after the actor's time limit plus this margin
+TENANT_LEASE_MARGIN_MS = 60000
+DEFAULT_LEASE_MS = 600000
+
+CAPS_KEY = "tenant:concurrency_caps"
+
+
+def _leases_key(user_id) -> str:
+    return f"tenant:{user_id}:leases"
+
+
+# Drop expired leases, then take one if the tenant is under its cap
+# (per-tenant override from the caps hash, else the default)
+ACQUIRE_LEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local cap = tonumber(redis.call('HGET', KEYS[2], ARGV[2]) or ARGV[3])
+if redis.call('ZCARD', KEYS[1]) < cap then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[5]), ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+
+def defer_delay_ms(deferrals: int) -> int:
+    """Delay before the given deferral (1-based) of a unit is retried, with jitter."""
+    delay = min(TENANT_DEFER_MAX_DELAY_MS, TENANT_DEFER_DELAY_MS * 2 ** min(deferrals - 1, 16))
+    return int(delay * (1 + random.random()))
+
+
+def set_tenant_concurrency_cap(redis_client, user_id: int, cap: int = None):
+    """Set a tenant's concurrency cap (its weight against other tenants); None restores the default."""
+    if cap is None:
+        redis_client.hdel(CAPS_KEY, user_id)
+    else:
+        redis_client.hset(CAPS_KEY, user_id, cap)
+
+
+class TenantConcurrencyMiddleware(Middleware):
+    """
+    Per-tenant concurrency caps, enforced with a Redis sorted set of leases
+    (message id -> expiry) per user_id. Deferred units go back on their queue
+    with a delay, so the worker thread picks up the next tenant's unit; this
+    round-robins threads between tenants, weighted by their caps.
+
+    Redis errors fail open: fairness is best effort and never blocks sends.
+    """
+
+    # actor name -> (positional index, keyword name) of the user id argument
+    TENANT_ARGS = {
+        "send_broadcast": (6, "user_id"),
+        "send_template_messages_task": (8, "user_id"),
+        "retry_failed_sends": (1, "user_id"),
+    }
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def _tenant_of(self, message):
+        arg = self.TENANT_ARGS.get(message.actor_name)
+        if arg is None:
+            return None
+        index, name = arg
+        user_id = message.kwargs.get(name)
+        if user_id is None and len(message.args) > index:
+            user_id = message.args[index]
+        return user_id
+
+    def _lease_ms(self, broker, message) -> int:
+        actor = broker.get_actor(message.actor_name)
+        time_limit = actor.options.get("time_limit") or DEFAULT_LEASE_MS
+        return int(time_limit + TENANT_LEASE_MARGIN_MS)
+
+    def before_process_message(self, broker, message):
+        user_id = self._tenant_of(message)
+        if user_id is None:
+            return
+
+        try:
+            acquired = self.redis_client.eval(
+                ACQUIRE_LEASE_SCRIPT, 2, _leases_key(user_id), CAPS_KEY,
+                int(time.time() * 1000), user_id, TENANT_MAX_CONCURRENCY, message.message_id,
+                self._lease_ms(broker, message),
+            )
+        except Exception as e:
+            logging.warning(f"Could not check concurrency of tenant {user_id}, running unthrottled: {e}")
+            return
+
+        if not acquired:
+            deferrals = message.options.get("tenant_deferrals", 0) + 1
+            message.options["tenant_deferrals"] = deferrals
+            delay = defer_delay_ms(deferrals)
+            logging.info(
+                f"Tenant {user_id} is at its concurrency cap, deferring {message.actor_name} "
+                f"by {delay}ms (deferral {deferrals})"
+            )
+            broker.enqueue(message, delay=delay)
+            raise SkipMessage()
+
+    def _release(self, message):
+        user_id = self._tenant_of(message)
+        if user_id is None:
+            return
+        try:
+            # A no-op for a deferred message, which never held a lease
+            self.redis_client.zrem(_leases_key(user_id), message.message_id)
+        except Exception as e:
+            logging.warning(f"Could not release concurrency lease of tenant {user_id}: {e}")
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        self._release(message)
+
+    def after_skip_message(self, broker, message):
+        self._release(message)
@@ -0,0 +1,167 @@
+"""
+Tenant Routing Table
+Process-local index of every user's Phone_id, WABAID and api_key, so webhook
+handlers resolve the tenant (user id and access token) without a database
+round trip. Loaded at startup, fully reloaded every TENANT_ROUTING_TTL_SECONDS
+and invalidated when a user's credentials change. Invalidations are published
+over Redis to the other API processes; if Redis is unavailable, those keep the
+old credentials until their next reload, at most TENANT_ROUTING_TTL_SECONDS.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..models.User import User
+
+TENANT_ROUTING_TTL_SECONDS = int(os.getenv("TENANT_ROUTING_TTL_SECONDS", "300"))
+
+# "Not found" answers cached at most, least recently used dropped first: the
+# api_key lookup is reachable with arbitrary keys by unauthenticated callers
+TENANT_ROUTING_MAX_MISSES = int(os.getenv("TENANT_ROUTING_MAX_MISSES", "10000"))
+
+INVALIDATION_CHANNEL = "tenant_routes:invalidate"
+
+
+class TenantRoute(NamedTuple):
+    """The User fields webhook processing needs (same names as on User)."""
+    id: int
+    Phone_id: Optional[int]
+    WABAID: Optional[int]
+    api_key: Optional[str]
+    PAccessToken: Optional[str]
+
+
+ROUTE_COLUMNS = (User.id, User.Phone_id, User.WABAID, User.api_key, User.PAccessToken)
+
+
+class TenantRoutingTable:
+    """
+    Phone_id / WABAID / api_key -> TenantRoute. A lookup that misses the table
+    (e.g. a user created since the last load) queries that one user and caches
+    the answer, including "not found" (for at most max_misses keys), until the
+    next reload.
+    """
+
+    def __init__(self, ttl_seconds: int = TENANT_ROUTING_TTL_SECONDS, max_misses: int = TENANT_ROUTING_MAX_MISSES):
+        self.ttl_seconds = ttl_seconds
+        self.max_misses = max_misses
+        self.loaded_at = None
+        self._indexes: Dict[str, dict] = {"Phone_id": {}, "WABAID": {}, "api_key": {}}
+        self._misses = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    def _add_miss(self, field: str, key):
+        self._misses[(field, key)] = True
+        self._misses.move_to_end((field, key))
+        while len(self._misses) > self.max_misses:
+            self._misses.popitem(last=False)
+
+    def _add(self, route: TenantRoute):
+        for field, index in self._indexes.items():
+            key = getattr(route, field)
+            if key is not None:
+                index[key] = route
+
+    async def load(self, db: AsyncSession):
+        """(Re)build the table from the Users table."""
+        result = await db.execute(select(*ROUTE_COLUMNS))
+        self._indexes = {field: {} for field in self._indexes}
+        self._misses = OrderedDict()
+        for row in result.all():
+            self._add(TenantRoute(*row))
+        self.loaded_at = time.monotonic()
+        logging.info(f"Tenant routing table loaded ({len(self._indexes['Phone_id'])} phone numbers)")
+
+    async def _ensure_fresh(self, db: AsyncSession):
+        if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl_seconds:
+            return
+        async with self._lock:
+            # Another lookup may have reloaded while this one waited
+            if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl_seconds:
+                await self.load(db)
+
+    async def _lookup(self, db: AsyncSession, field: str, key) -> Optional[TenantRoute]:
+        if key is None:
+            return None
+        await self._ensure_fresh(db)
+        route = self._indexes[field].get(key)
+        if route is not None:
+            return route
+        if (field, key) in self._misses:
+            self._misses.move_to_end((field, key))
+            return None
+
+        result = await db.execute(select(*ROUTE_COLUMNS).where(getattr(User, field) == key))
+        row = result.first()
+        if row is None:
+            self._add_miss(field, key)
+            return None
+        route = TenantRoute(*row)
+        self._add(route)
+        return route
+
+    async def by_phone_id(self, db: AsyncSession, phone_id) -> Optional[TenantRoute]:
+        return await self._lookup(db, "Phone_id", int(phone_id))
+
+    async def by_waba_id(self, db: AsyncSession, waba_id) -> Optional[TenantRoute]:
+        return await self._lookup(db, "WABAID", int(waba_id))
+
+    async def by_api_key(self, db: AsyncSession, api_key: str) -> Optional[TenantRoute]:
+        return await self._lookup(db, "api_key", api_key)
+
+    def invalidate(self, user_id: int = None):
+        """
+        Forget a user's routes (or all routes) after their credentials changed;
+        the next lookup queries them again.
+        """
+        for index in self._indexes.values():
+            for key in [key for key, route in index.items() if user_id is None or route.id == user_id]:
+                del index[key]
+        self._misses = OrderedDict()
+
+    async def invalidate_everywhere(self, async_redis_client, user_id: int = None):
+        """invalidate() here, and in the other API processes through Redis."""
+        self.invalidate(user_id)
+        try:
+            await async_redis_client.publish(INVALIDATION_CHANNEL, json.dumps({"user_id": user_id}))
+        except Exception as e:
+            logging.warning(f"Could not publish tenant routing invalidation, other processes "
+                            f"pick it up within {self.ttl_seconds}s: {e}")
+
+    async def listen_for_invalidations(self, async_redis_client):
+        """
+        Apply invalidations published by any API process. Runs for the lifetime
+        of the API process.
+        """
+        while True:
+            pubsub = async_redis_client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    self.invalidate(json.loads(message["data"])["user_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"Tenant routing invalidation subscription lost, reconnecting: {e}")
+                # Invalidations may have been missed meanwhile
+                self.invalidate()
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+
+# Process-wide table used by the webhook handlers
+tenant_routes = TenantRoutingTable()
@@ -0,0 +1,134 @@
+"""
+Webhook Deduplication
+Meta retries webhooks and sometimes redelivers events outright. Every status
+(wamid, status) and incoming message (message id) is claimed once in a bounded
+in-process LRU and checked against Redis keys shared by all API processes;
+events seen before are dropped before anything touches Postgres.
+
+The Redis key is only written once the event's processing has committed, so an
+event whose consumer dies mid-batch is processed again on redelivery rather
+than lost. A crash between the commit and the confirm can process an event
+twice; at-least-once is the intended trade-off.
+"""
+import os
+import logging
+from collections import OrderedDict
+from typing import List
+
+WEBHOOK_DEDUP_TTL_SECONDS = int(os.getenv("WEBHOOK_DEDUP_TTL_SECONDS", "86400"))
+WEBHOOK_DEDUP_LRU_SIZE = int(os.getenv("WEBHOOK_DEDUP_LRU_SIZE", "50000"))
+
+
+def _seen_key(event_key: str) -> str:
+    return f"webhook:seen:{event_key}"
+
+
+def _event_key(field: str, item: dict) -> str:
+    """Dedup key of one entry of a change value's "statuses" or "messages"."""
+    if field == "statuses":
+        return f"status:{item.get('id')}:{item.get('status')}"
+    return f"message:{item.get('id')}"
+
+
+def is_status_key(event_key: str) -> bool:
+    """Whether a claimed key is a delivery status's (rather than a message's)."""
+    return event_key.startswith("status:")
+
+
+class WebhookDeduplicator:
+    """
+    Claims webhook event keys. The LRU answers repeats seen by this process
+    without a Redis round trip (including events still being processed);
+    Redis catches repeats of events another process has confirmed. Redis
+    errors fail open (the event is processed).
+    """
+
+    def __init__(self, async_redis_client, maxsize: int = WEBHOOK_DEDUP_LRU_SIZE,
+                 ttl_seconds: int = WEBHOOK_DEDUP_TTL_SECONDS):
+        self.redis_client = async_redis_client
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._recent = OrderedDict()
+
+    def _remember(self, key: str):
+        self._recent[key] = True
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+
+    async def claim(self, keys: List[str]) -> List[bool]:
+        """
+        Per key, True if this is its first delivery. Claimed keys are only
+        held by this process until they are confirmed or released.
+        """
+        first = []
+        unseen = []
+        for key in keys:
+            is_new = key not in self._recent
+            self._remember(key)
+            first.append(is_new)
+            if is_new:
+                unseen.append(len(first) - 1)
+
+        if unseen:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for position in unseen:
+                    pipe.exists(_seen_key(keys[position]))
+                for position, seen in zip(unseen, await pipe.execute()):
+                    first[position] = not seen
+            except Exception as e:
+                logging.warning(f"Could not check webhook duplicates in Redis: {e}")
+        return first
+
+    async def confirm(self, keys: List[str]):
+        """Mark events as seen in Redis, once their processing has committed."""
+        if not keys:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.set(_seen_key(key), 1, ex=self.ttl_seconds)
+            await pipe.execute()
+        except Exception as e:
+            logging.warning(f"Could not record webhook dedup keys: {e}")
+
+    async def release(self, keys: List[str]):
+        """Un-claim events whose processing failed, so their redelivery is processed."""
+        for key in keys:
+            self._recent.pop(key, None)
+
+    async def drop_duplicates(self, body: dict) -> List[str]:
+        """
+        Remove already-seen statuses and messages from a webhook body in place.
+        Returns the keys claimed for the events that remain.
+        """
+        groups = []
+        for event in body.get("entry", []):
+            for change in event.get("changes", []):
+                value = change.get("value")
+                if not isinstance(value, dict):
+                    continue
+                for field in ("statuses", "messages"):
+                    if value.get(field):
+                        groups.append((value, field))
+
+        keys = [_event_key(field, item) for value, field in groups for item in value[field]]
+        if not keys:
+            return []
+        first = iter(await self.claim(keys))
+
+        claimed = []
+        keys_iter = iter(keys)
+        for value, field in groups:
+            kept = []
+            for item in value[field]:
+                key = next(keys_iter)
+                if next(first):
+                    kept.append(item)
+                    claimed.append(key)
+            if kept:
+                value[field] = kept
+            else:
+                del value[field]
+        return claimed
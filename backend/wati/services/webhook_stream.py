@@ -0,0 +1,388 @@
+"""
+Meta Webhook Stream
+POST /meta-webhook only validates the payload shape and appends it to a Redis
+Stream, so Meta gets its 200 within milliseconds however large the
+delivery-status burst. Consumers in the API processes read the streams in
+batches and run the actual processing.
+
+Events are partitioned by (phone_number_id, wa_id) over WEBHOOK_PARTITIONS
+streams. Each partition is owned by one consumer at a time through a Redis
+lease and processed sequentially, so events of one conversation are applied
+in order while different conversations are processed in parallel, across
+partitions and across API processes. A failed entry holds back the rest of
+its partition until it is processed or dropped.
+"""
+import os
+import json
+import math
+import time
+import uuid
+import zlib
+import random
+import socket
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List
+
+from redis.exceptions import ResponseError
+
+WEBHOOK_STREAM = "meta:webhook:events"
+WEBHOOK_GROUP = "webhook-processors"
+WEBHOOK_PARTITIONS = int(os.getenv("WEBHOOK_PARTITIONS", "8"))
+
+# Entries are trimmed (approximately) beyond this length per partition; acked
+# entries are not needed again, the margin only covers consumer downtime
+WEBHOOK_STREAM_MAXLEN = int(os.getenv("WEBHOOK_STREAM_MAXLEN", "100000"))
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_BLOCK_MS = 1000
+
+# A failed entry is retried by its partition's owner before newer entries,
+# and dropped after failing this many times
+WEBHOOK_MAX_DELIVERIES = int(os.getenv("WEBHOOK_MAX_DELIVERIES", "5"))
+
+# Partition leases expire this long after their owner stops renewing them;
+# owners renew them between batches and every third of it during a batch
+WEBHOOK_LEASE_MS = int(os.getenv("WEBHOOK_LEASE_MS", "30000"))
+WEBHOOK_REBALANCE_SECONDS = 5
+
+CONSUMERS_KEY = "meta:webhook:consumers"
+
+# handler(bodies) -> per body, whether it was processed (and can be acknowledged).
+# Handlers stop at the first failure and report the bodies after it as not processed.
+BatchHandler = Callable[[List[dict]], Awaitable[List[bool]]]
+
+# Renew (or release, with a zero TTL) a lease only if we still hold it
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    if tonumber(ARGV[2]) > 0 then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _stream_key(partition: int) -> str:
+    return f"{WEBHOOK_STREAM}:{partition}"
+
+
+def _lease_key(partition: int) -> str:
+    return f"{WEBHOOK_STREAM}:{partition}:owner"
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def conversation_key(value: dict) -> str:
+    """
+    (phone_number_id, wa_id) of a change value, as the partitioning key. Only
+    the first message, status or contact is looked at: values carrying several
+    conversations are split by split_value first.
+    """
+    phone_number_id = value.get("metadata", {}).get("phone_number_id", "")
+    wa_id = ""
+    if value.get("messages"):
+        wa_id = value["messages"][0].get("from", "")
+    elif value.get("statuses"):
+        wa_id = value["statuses"][0].get("recipient_id", "")
+    elif value.get("contacts"):
+        wa_id = value["contacts"][0].get("wa_id", "")
+    return f"{phone_number_id}:{wa_id}"
+
+
+def partition_of(key: str, partitions: int = WEBHOOK_PARTITIONS) -> int:
+    # crc32, not hash(): it must agree across processes
+    return zlib.crc32(key.encode()) % partitions
+
+
+def split_value(value: dict) -> List[dict]:
+    """
+    Split a change value into one value per conversation (wa_id), keeping the
+    order of its messages and statuses. Contacts go with their conversation's
+    messages; a value of a single conversation is returned as is.
+    """
+    groups = {}
+    for field, wa_id_field in (("messages", "from"), ("statuses", "recipient_id")):
+        for item in value.get(field) or []:
+            groups.setdefault(item.get(wa_id_field, ""), {}).setdefault(field, []).append(item)
+    if len(groups) <= 1:
+        return [value]
+
+    parts = []
+    for wa_id, items in groups.items():
+        part = {name: field for name, field in value.items() if name not in ("messages", "statuses")}
+        part.update(items)
+        if value.get("contacts"):
+            part["contacts"] = [contact for contact in value["contacts"] if contact.get("wa_id") == wa_id] \
+                or value["contacts"]
+        parts.append(part)
+    return parts
+
+
+def split_by_conversation(body: dict) -> Dict[int, List[dict]]:
+    """One webhook body per change and conversation, grouped by partition."""
+    parts = {}
+    for event in body.get("entry", []):
+        for change in event.get("changes", []):
+            value = change.get("value")
+            # Malformed changes pass through whole, for the handler to reject
+            values = split_value(value) if isinstance(value, dict) else [value]
+            for part_value in values:
+                part_change = dict(change, value=part_value) if isinstance(value, dict) else change
+                part_body = dict(body, entry=[dict(event, changes=[part_change])])
+                key = conversation_key(part_value if isinstance(part_value, dict) else {})
+                parts.setdefault(partition_of(key), []).append(part_body)
+    return parts
+
+
+class WebhookStream:
+    """Partitioned producer and lease-holding consumers for buffered webhook payloads."""
+
+    def __init__(self, async_redis_client, partitions: int = WEBHOOK_PARTITIONS, group: str = WEBHOOK_GROUP):
+        self.redis_client = async_redis_client
+        self.partitions = partitions
+        self.group = group
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._stopping: Dict[int, asyncio.Event] = {}
+
+    async def enqueue(self, body: dict) -> bool:
+        """Append a webhook body, split per conversation; False if Redis is unavailable."""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for partition, part_bodies in split_by_conversation(body).items():
+                for part_body in part_bodies:
+                    pipe.xadd(
+                        _stream_key(partition), {"body": json.dumps(part_body)},
+                        maxlen=WEBHOOK_STREAM_MAXLEN, approximate=True
+                    )
+            await pipe.execute()
+            return True
+        except Exception as e:
+            logging.error(f"Could not buffer webhook in Redis: {e}")
+            return False
+
+    async def ensure_group(self, partition: int):
+        try:
+            await self.redis_client.xgroup_create(_stream_key(partition), self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    # Leases
+
+    async def _acquire(self, partition: int) -> bool:
+        return bool(await self.redis_client.set(_lease_key(partition), self.consumer, nx=True, px=WEBHOOK_LEASE_MS))
+
+    async def _renew(self, partition: int) -> bool:
+        return bool(await self.redis_client.eval(RENEW_LEASE_SCRIPT, 1, _lease_key(partition), self.consumer, WEBHOOK_LEASE_MS))
+
+    async def _release(self, partition: int):
+        try:
+            await self.redis_client.eval(RENEW_LEASE_SCRIPT, 1, _lease_key(partition), self.consumer, 0)
+        except Exception as e:
+            logging.warning(f"Could not release webhook partition {partition}: {e}")
+
+    async def _fair_share(self) -> int:
+        """Partitions this process should hold, given the consumers heartbeating now."""
+        now = time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zadd(CONSUMERS_KEY, {self.consumer: now})
+        pipe.zremrangebyscore(CONSUMERS_KEY, "-inf", now - WEBHOOK_LEASE_MS / 1000)
+        pipe.zcard(CONSUMERS_KEY)
+        live = (await pipe.execute())[-1]
+        return math.ceil(self.partitions / max(live, 1))
+
+    # Consuming one partition
+
+    async def _take_over(self, partition: int, stopping: asyncio.Event) -> bool:
+        """
+        Claim what previous owners left unacknowledged, to process it first.
+
+        Entries are only claimed once idle for a whole lease, so an owner that
+        lost the partition mid-batch is never raced; until every entry of other
+        consumers has been claimed, newer entries are not read. Returns False
+        if the partition was lost or given back while waiting.
+        """
+        while True:
+            start_id = "0-0"
+            while True:
+                next_id, *_ = await self.redis_client.xautoclaim(
+                    _stream_key(partition), self.group, self.consumer, min_idle_time=WEBHOOK_LEASE_MS,
+                    start_id=start_id, count=WEBHOOK_BATCH_SIZE
+                )
+                if next_id in (b"0-0", "0-0"):
+                    break
+                start_id = next_id
+
+            summary = await self.redis_client.xpending(_stream_key(partition), self.group)
+            others = [
+                consumer for consumer in summary.get("consumers") or []
+                if _decode(consumer["name"]) != self.consumer and int(consumer["pending"])
+            ]
+            if not others:
+                return True
+            if stopping.is_set() or not await self._renew(partition):
+                return False
+            await asyncio.sleep(1)
+
+    async def _hold_lease(self, partition: int):
+        """Renew the lease while a batch runs; returns once it is lost."""
+        expires = time.monotonic() + WEBHOOK_LEASE_MS / 1000
+        while True:
+            await asyncio.sleep(WEBHOOK_LEASE_MS / 3000)
+            try:
+                if not await self._renew(partition):
+                    return
+                expires = time.monotonic() + WEBHOOK_LEASE_MS / 1000
+            except Exception as e:
+                # Keep trying while the last renewal still holds
+                logging.warning(f"Could not renew webhook partition {partition}: {e}")
+                if time.monotonic() >= expires - WEBHOOK_LEASE_MS / 3000:
+                    return
+
+    async def _process_holding_lease(self, partition: int, entries: list, handler: BatchHandler, attempts: dict):
+        """
+        process_batch while renewing the lease. The batch is abandoned
+        (unacknowledged, for the next owner) if the lease is lost; returns None then.
+        """
+        batch = asyncio.create_task(self.process_batch(partition, entries, handler, attempts))
+        lease = asyncio.create_task(self._hold_lease(partition))
+        try:
+            await asyncio.wait({batch, lease}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            lease.cancel()
+            if not batch.done():
+                batch.cancel()
+            await asyncio.gather(batch, lease, return_exceptions=True)
+        if batch.cancelled():
+            return None
+        return batch.result()
+
+    async def _read(self, partition: int, pending: bool) -> list:
+        # "0" re-reads this consumer's unacknowledged entries, oldest first
+        response = await self.redis_client.xreadgroup(
+            self.group, self.consumer, {_stream_key(partition): "0" if pending else ">"},
+            count=WEBHOOK_BATCH_SIZE, block=None if pending else WEBHOOK_BLOCK_MS
+        )
+        return response[0][1] if response else []
+
+    async def process_batch(self, partition: int, entries: list, handler: BatchHandler, attempts: dict) -> bool:
+        """
+        Process entries in order and acknowledge them up to the first failure;
+        returns True if entries are left to retry, starting with the failed one.
+        """
+        order, bodies = [], []
+        for entry_id, fields in entries:
+            if not fields:
+                # Trimmed from the stream while still pending
+                order.append((entry_id, False))
+                continue
+            if attempts.get(entry_id, 0) >= WEBHOOK_MAX_DELIVERIES:
+                logging.error(f"Dropping webhook event {entry_id} after {WEBHOOK_MAX_DELIVERIES} failed attempts")
+                order.append((entry_id, False))
+                continue
+            try:
+                bodies.append(json.loads(fields[b"body"]))
+                order.append((entry_id, True))
+            except (KeyError, ValueError) as e:
+                logging.error(f"Discarding malformed webhook event {entry_id}: {e}")
+                order.append((entry_id, False))
+
+        processed = iter(await handler(bodies) if bodies else [])
+        done = []
+        for entry_id, handled in order:
+            if handled and not next(processed):
+                attempts[entry_id] = attempts.get(entry_id, 0) + 1
+                break
+            done.append(entry_id)
+
+        if done:
+            await self.redis_client.xack(_stream_key(partition), self.group, *done)
+            for entry_id in done:
+                attempts.pop(entry_id, None)
+        return len(done) < len(entries)
+
+    async def _consume_partition(self, partition: int, handler: BatchHandler, stopping: asyncio.Event):
+        attempts = {}
+        try:
+            await self.ensure_group(partition)
+            if not await self._take_over(partition, stopping):
+                return
+            retry = True
+            while not stopping.is_set():
+                if not await self._renew(partition):
+                    logging.warning(f"Lost webhook partition {partition}")
+                    return
+                entries = await self._read(partition, pending=retry)
+                if retry and not entries:
+                    retry = False
+                    continue
+                if entries:
+                    retry = await self._process_holding_lease(partition, entries, handler, attempts)
+                    if retry is None:
+                        logging.warning(f"Lost webhook partition {partition} during a batch, abandoning it")
+                        return
+                    if retry:
+                        await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"Webhook partition {partition} consumer error: {e}")
+        finally:
+            await self._release(partition)
+
+    # Rebalancing
+
+    def _held(self) -> List[int]:
+        for partition, task in list(self._workers.items()):
+            if task.done():
+                del self._workers[partition]
+                self._stopping.pop(partition, None)
+        return list(self._workers)
+
+    async def _rebalance(self, handler: BatchHandler):
+        share = await self._fair_share()
+        held = self._held()
+
+        # Hand back partitions above our share; each finishes its current batch first
+        for partition in held[share:]:
+            self._stopping[partition].set()
+
+        free = [partition for partition in range(self.partitions) if partition not in held]
+        random.shuffle(free)
+        for partition in free:
+            if len(self._workers) >= share:
+                break
+            if await self._acquire(partition):
+                stopping = asyncio.Event()
+                self._stopping[partition] = stopping
+                self._workers[partition] = asyncio.create_task(self._consume_partition(partition, handler, stopping))
+
+    async def consume(self, handler: BatchHandler):
+        """Hold a fair share of the partitions and process them, for the lifetime of the API process."""
+        try:
+            while True:
+                try:
+                    await self._rebalance(handler)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.warning(f"Webhook stream rebalance failed: {e}")
+                await asyncio.sleep(WEBHOOK_REBALANCE_SECONDS)
+        finally:
+            # Let each partition finish its batch (and release its dedup keys
+            # if that fails) before giving the partition up
+            for stopping in self._stopping.values():
+                stopping.set()
+            if self._workers:
+                _, unfinished = await asyncio.wait(self._workers.values(), timeout=WEBHOOK_BLOCK_MS / 1000 + 10)
+                for task in unfinished:
+                    task.cancel()
+            try:
+                await self.redis_client.zrem(CONSUMERS_KEY, self.consumer)
+            except Exception:
+                pass
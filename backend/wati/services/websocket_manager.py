@@ -1,126 +1,321 @@
 """
 WebSocket Manager for Real-time Updates
 Handles WebSocket connections and broadcasts updates to connected clients
+
+Updates go through a Redis pub/sub backplane so that any API process can reach
+a client connected to any other: each process subscribes to the channels of
+its locally connected users and conversations, and the broadcast_* methods
+publish to those channels. Without the backplane (Redis unavailable or not
+started yet) updates are delivered to this process's clients only.
+
+Each connection has its own bounded send queue and writer task, so a slow
+client never holds up updates to anyone else; the registry lock only guards
+the connection dicts. Endpoints send their own replies (snapshots, acks,
+pongs) through the same queue, so the writer task is the socket's only writer.
 """
+import os
 import json
 import asyncio
-from typing import Dict, Set, Any
+import logging
+from typing import Awaitable, Callable, Dict, Set, Any
 from fastapi import WebSocket, WebSocketDisconnect
 from sqlalchemy.ext.asyncio import AsyncSession
 
+ALL_ACTIVE_CHANNEL = "ws:active_conversations"
+
+# Updates queued per connection before it counts as too slow and is dropped
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+# A single send stalling longer than this drops the connection too
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+
+def _active_channel(user_id: int) -> str:
+    return f"ws:active_conversations:{user_id}"
+
+
+def _conversation_channel(contact_number: str) -> str:
+    return f"ws:conversation:{contact_number}"
+
+
+class ClientConnection:
+    """
+    Outbound side of one WebSocket: a bounded queue drained by its own writer
+    task. A client whose queue overflows, or whose send fails or stalls, is
+    dropped through on_failure; it reconnects and gets a fresh snapshot.
+    """
+
+    def __init__(self, websocket: WebSocket, on_failure: Callable[["ClientConnection", str], Awaitable[None]]):
+        self.websocket = websocket
+        self.on_failure = on_failure
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.writer = asyncio.create_task(self._write())
+
+    def send(self, data) -> bool:
+        """Queue an update (a dict, or text) without waiting; False if the client is too far behind."""
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _write(self):
+        try:
+            while True:
+                data = await self.queue.get()
+                if isinstance(data, str):
+                    send = self.websocket.send_text(data)
+                else:
+                    send = self.websocket.send_json(data)
+                await asyncio.wait_for(send, WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.on_failure(self, str(e) or type(e).__name__)
+
+    async def close(self):
+        """Stop the writer (unless closing from it) and close the socket."""
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+
 class ConnectionManager:
     """Manages WebSocket connections"""
     
     def __init__(self):
-        # Store active connections: {user_id: {websocket, db_session}}
+        # Store active connections: {user_id: {websocket, db_session, sender}}
         self.active_connections: Dict[int, Dict[str, Any]] = {}
-        # Store conversations connections: {contact_number: {user_id: websocket}}
-        self.conversation_connections: Dict[str, Dict[int, WebSocket]] = {}
+        # Store conversations connections: {contact_number: {user_id: sender}}
+        self.conversation_connections: Dict[str, Dict[int, ClientConnection]] = {}
+        # Guards the two dicts above only; never held across a send or close
         self.lock = asyncio.Lock()
+        # Backplane connection, set while run_backplane is subscribed
+        self.redis_client = None
+        self.pubsub = None
     
-    async def connect_active_conversations(self, websocket: WebSocket, user_id: int, db: AsyncSession):
-        """Connect a client for active conversations updates"""
+    async def connect_active_conversations(self, websocket: WebSocket, user_id: int, db: AsyncSession) -> ClientConnection:
+        """Connect a client for active conversations updates; returns its sender"""
         await websocket.accept()
+        sender = ClientConnection(websocket, lambda sender, reason: self._drop_active_conversations(user_id, sender, reason))
         async with self.lock:
+            previous = self.active_connections.get(user_id)
             self.active_connections[user_id] = {
                 'websocket': websocket,
-                'db': db
+                'db': db,
+                'sender': sender
             }
+        if previous:
+            # The newer socket of this user takes over its updates
+            previous['sender'].writer.cancel()
+        await self._subscribe(_active_channel(user_id))
         print(f"✅ WebSocket connected for active conversations (user_id: {user_id})")
+        return sender
     
-    async def connect_conversation(self, websocket: WebSocket, user_id: int, contact_number: str):
-        """Connect a client for specific conversation updates"""
+    async def connect_conversation(self, websocket: WebSocket, user_id: int, contact_number: str) -> ClientConnection:
+        """Connect a client for specific conversation updates; returns its sender"""
         await websocket.accept()
+        sender = ClientConnection(websocket, lambda sender, reason: self._drop_conversation(user_id, contact_number, sender, reason))
         async with self.lock:
             if contact_number not in self.conversation_connections:
                 self.conversation_connections[contact_number] = {}
-            self.conversation_connections[contact_number][user_id] = websocket
+            previous = self.conversation_connections[contact_number].get(user_id)
+            self.conversation_connections[contact_number][user_id] = sender
+        if previous:
+            previous.writer.cancel()
+        await self._subscribe(_conversation_channel(contact_number))
         print(f"✅ WebSocket connected for conversation {contact_number} (user_id: {user_id})")
+        return sender
     
-    async def disconnect_active_conversations(self, user_id: int):
-        """Disconnect a client from active conversations"""
+    async def disconnect_active_conversations(self, user_id: int, sender: ClientConnection = None):
+        """
+        Disconnect a client from active conversations. With `sender`, only that
+        socket is closed, and it is unregistered only if a newer socket of the
+        user has not replaced it.
+        """
         async with self.lock:
-            if user_id in self.active_connections:
-                connection = self.active_connections.pop(user_id)
-                try:
-                    await connection['websocket'].close()
-                except:
-                    pass
-                print(f"❌ WebSocket disconnected for active conversations (user_id: {user_id})")
+            connection = self.active_connections.get(user_id)
+            if connection and (sender is None or connection['sender'] is sender):
+                del self.active_connections[user_id]
+                sender = connection['sender']
+        if sender:
+            await sender.close()
+            print(f"❌ WebSocket disconnected for active conversations (user_id: {user_id})")
+        if user_id not in self.active_connections:
+            await self._unsubscribe(_active_channel(user_id))
     
-    async def disconnect_conversation(self, user_id: int, contact_number: str):
-        """Disconnect a client from conversation"""
+    async def disconnect_conversation(self, user_id: int, contact_number: str, sender: ClientConnection = None):
+        """
+        Disconnect a client from conversation. With `sender`, only that socket
+        is closed, and it is unregistered only if it is still the user's watcher.
+        """
         async with self.lock:
-            if contact_number in self.conversation_connections:
-                if user_id in self.conversation_connections[contact_number]:
-                    websocket = self.conversation_connections[contact_number].pop(user_id)
-                    try:
-                        await websocket.close()
-                    except:
-                        pass
-                    print(f"❌ WebSocket disconnected from conversation {contact_number} (user_id: {user_id})")
-                
-                # Clean up empty conversation dicts
-                if not self.conversation_connections[contact_number]:
-                    del self.conversation_connections[contact_number]
+            sender = self._pop_conversation(user_id, contact_number, sender) or sender
+        if sender:
+            await sender.close()
+            print(f"❌ WebSocket disconnected from conversation {contact_number} (user_id: {user_id})")
+        if contact_number not in self.conversation_connections:
+            await self._unsubscribe(_conversation_channel(contact_number))
+
+    def _pop_conversation(self, user_id: int, contact_number: str, sender: ClientConnection = None):
+        """Remove a watcher (only if it is still `sender`, when given); call with the lock held"""
+        watchers = self.conversation_connections.get(contact_number)
+        if not watchers or user_id not in watchers or (sender is not None and watchers[user_id] is not sender):
+            return None
+        removed = watchers.pop(user_id)
+        # Clean up empty conversation dicts
+        if not watchers:
+            del self.conversation_connections[contact_number]
+        return removed
+
+    async def _drop_active_conversations(self, user_id: int, sender: ClientConnection, reason: str):
+        """Drop a slow or broken active conversations socket (unless it was already replaced)"""
+        async with self.lock:
+            connection = self.active_connections.get(user_id)
+            if connection and connection['sender'] is sender:
+                del self.active_connections[user_id]
+        await sender.close()
+        print(f"⚠️ Dropped active conversations socket of user {user_id}: {reason}")
+        if user_id not in self.active_connections:
+            await self._unsubscribe(_active_channel(user_id))
+
+    async def _drop_conversation(self, user_id: int, contact_number: str, sender: ClientConnection, reason: str):
+        """Drop a slow or broken conversation socket (unless it was already replaced)"""
+        async with self.lock:
+            self._pop_conversation(user_id, contact_number, sender)
+        await sender.close()
+        print(f"⚠️ Dropped conversation {contact_number} socket of user {user_id}: {reason}")
+        if contact_number not in self.conversation_connections:
+            await self._unsubscribe(_conversation_channel(contact_number))
     
     async def broadcast_active_conversations_update(self, user_id: int, data: dict):
         """Broadcast active conversations update to specific user (event-driven, only when update occurs)"""
+        if await self._publish(_active_channel(user_id), data):
+            return True
+        return await self._deliver_active_conversations_update(user_id, data)
+
+    async def _deliver_active_conversations_update(self, user_id: int, data: dict):
+        """Queue an active conversations update for the user's socket in this process"""
         async with self.lock:
-            if user_id in self.active_connections:
-                websocket = self.active_connections[user_id]['websocket']
-                try:
-                    # Send update immediately (no polling, event-driven)
-                    await websocket.send_json(data)
-                    return True
-                except Exception as e:
-                    print(f"⚠️ Error sending update to user {user_id}: {e}")
-                    # Connection might be dead, clean it up
-                    try:
-                        await self.disconnect_active_conversations(user_id)
-                    except:
-                        pass
-                    return False
-        return False
+            connection = self.active_connections.get(user_id)
+        if not connection:
+            return False
+        if not connection['sender'].send(data):
+            await self._drop_active_conversations(user_id, connection['sender'], "send queue full")
+            return False
+        return True
+    
+    async def send_to_user(self, user_id: int, data: dict):
+        """Send an event (e.g. broadcast progress) to a user's active conversations socket"""
+        return await self._deliver_active_conversations_update(user_id, data)
     
     async def broadcast_conversation_update(self, contact_number: str, data: dict):
         """Broadcast conversation update to all users watching this conversation (event-driven, only when update occurs)"""
+        if await self._publish(_conversation_channel(contact_number), data):
+            return True
+        return await self._deliver_conversation_update(contact_number, data)
+
+    async def _deliver_conversation_update(self, contact_number: str, data: dict):
+        """Queue a conversation update for this process's watchers of the conversation"""
         async with self.lock:
-            if contact_number in self.conversation_connections:
-                disconnected_users = []
-                for user_id, websocket in self.conversation_connections[contact_number].items():
-                    try:
-                        # Send update immediately (no polling, event-driven)
-                        await websocket.send_json(data)
-                    except Exception as e:
-                        print(f"⚠️ Error sending update to user {user_id} for conversation {contact_number}: {e}")
-                        disconnected_users.append(user_id)
-                
-                # Clean up disconnected users
-                for user_id in disconnected_users:
-                    try:
-                        await self.disconnect_conversation(user_id, contact_number)
-                    except:
-                        pass
-                
-                return len(self.conversation_connections.get(contact_number, {})) > 0
-        return False
+            watchers = list(self.conversation_connections.get(contact_number, {}).items())
+        for user_id, sender in watchers:
+            if not sender.send(data):
+                await self._drop_conversation(user_id, contact_number, sender, "send queue full")
+        return len(self.conversation_connections.get(contact_number, {})) > 0
     
     async def broadcast_to_all_active_users(self, data: dict):
         """Broadcast to all users watching active conversations"""
+        if await self._publish(ALL_ACTIVE_CHANNEL, data):
+            return
+        await self._deliver_to_all_active_users(data)
+
+    async def _deliver_to_all_active_users(self, data: dict):
+        """Queue an update for every active conversations socket in this process"""
         async with self.lock:
-            disconnected_users = []
-            for user_id, connection in self.active_connections.items():
+            connections = list(self.active_connections.items())
+        for user_id, connection in connections:
+            if not connection['sender'].send(data):
+                await self._drop_active_conversations(user_id, connection['sender'], "send queue full")
+
+    # Redis pub/sub backplane
+
+    async def _publish(self, channel: str, data: dict) -> bool:
+        """
+        Publish an update to the backplane. False if it could not be published,
+        or no process has a client for it (then local delivery is a no-op anyway).
+        """
+        if self.pubsub is None:
+            return False
+        try:
+            return await self.redis_client.publish(channel, json.dumps(data, default=str)) > 0
+        except Exception as e:
+            logging.warning(f"Could not publish WebSocket update on {channel}: {e}")
+            return False
+
+    async def _subscribe(self, channel: str):
+        if self.pubsub is None:
+            return
+        try:
+            await self.pubsub.subscribe(channel)
+        except Exception as e:
+            logging.warning(f"Could not subscribe to {channel}: {e}")
+
+    async def _unsubscribe(self, channel: str):
+        if self.pubsub is None:
+            return
+        try:
+            await self.pubsub.unsubscribe(channel)
+        except Exception as e:
+            logging.warning(f"Could not unsubscribe from {channel}: {e}")
+
+    def _local_channels(self):
+        channels = [_active_channel(user_id) for user_id in self.active_connections]
+        channels += [_conversation_channel(contact_number) for contact_number in self.conversation_connections]
+        return channels
+
+    async def _dispatch(self, channel: str, data: dict):
+        """Deliver an update received from the backplane to this process's clients"""
+        if channel == ALL_ACTIVE_CHANNEL:
+            await self._deliver_to_all_active_users(data)
+        elif channel.startswith("ws:active_conversations:"):
+            await self._deliver_active_conversations_update(int(channel.rsplit(":", 1)[1]), data)
+        elif channel.startswith("ws:conversation:"):
+            await self._deliver_conversation_update(channel[len("ws:conversation:"):], data)
+
+    async def run_backplane(self, redis_client):
+        """
+        Subscribe to the channels of this process's clients and deliver what is
+        published on them. Runs for the lifetime of the API process.
+        """
+        self.redis_client = redis_client
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(ALL_ACTIVE_CHANNEL, *self._local_channels())
+                self.pubsub = pubsub
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None:
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    await self._dispatch(channel, json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"WebSocket backplane subscription lost, reconnecting: {e}")
+                await asyncio.sleep(5)
+            finally:
+                self.pubsub = None
                 try:
-                    await connection['websocket'].send_json(data)
-                except Exception as e:
-                    print(f"⚠️ Error broadcasting to user {user_id}: {e}")
-                    disconnected_users.append(user_id)
-            
-            # Clean up disconnected users
-            for user_id in disconnected_users:
-                await self.disconnect_active_conversations(user_id)
-    
+                    await pubsub.close()
+                except Exception:
+                    pass
+
     def get_active_user_count(self) -> int:
         """Get count of active connections"""
         return len(self.active_connections)